@@ -1,8 +1,15 @@
 # flake8: noqa
 import os
+import shutil
+import subprocess
 from textwrap import dedent
 
+import pyflow as pf
+import pytest
+
 import wellies.data as wl
+from wellies import telemetry
+from wellies.exceptions import WelliesConfigurationError
 
 
 def test_rsync_data_default():
@@ -529,3 +536,463 @@ def test_static_data_store():
 
     for name, data in data_store.items():
         assert isinstance(data, ref_class[name])
+
+
+def test_size_commands():
+    data_dir = os.path.join("path", "to", "data")
+
+    rsync = wl.RsyncData(
+        data_dir,
+        "rsync_data",
+        {"source": "hpc-login:/dir/to/sync", "files": ["a.nc", "b.nc"]},
+    )
+    assert rsync.size_command() == (
+        "ssh -o BatchMode=yes hpc-login "
+        "'du -scbL /dir/to/sync/a.nc /dir/to/sync/b.nc | tail -n 1'"
+    )
+    assert rsync.parse_size("1024\ttotal\n") == 1024
+
+    copy = wl.CopyData(data_dir, "copy_data", {"source": "/dir/to/copy"})
+    assert copy.size_command() == "du -scbL /dir/to/copy | tail -n 1"
+
+    ecfs = wl.ECFSData(data_dir, "ecfs_data", {"source": "ec:/path/to/data"})
+    assert ecfs.size_command().startswith("els -l ec:/path/to/data |")
+
+    marsdata = wl.MarsData(
+        data_dir,
+        "mars_data",
+        {"request": {"class": "od", "param": "t", "target": "t.grb"}},
+    )
+    cmd = marsdata.size_command()
+    assert "list," in cmd
+    assert "output=cost" in cmd
+    assert "target" not in cmd
+    output = "Entries       : 4\nTotal         : 4,254,720 (4.06 Mbytes)\n"
+    assert marsdata.parse_size(output) == 4254720
+
+    git = wl.GitData(
+        data_dir, "git_data", {"source": "git.example.com/repo.git"}
+    )
+    assert git.size_command() is None
+
+
+def test_static_data_store_plan():
+    static_data_dict = {
+        "rsync_data": {"type": "rsync", "source": "/dir/to/sync"},
+        "mars_data": {
+            "type": "mars",
+            "request": {"class": "od", "param": "t", "target": "t.grb"},
+        },
+        "link_data": {"type": "link", "source": "/path/to/link"},
+        "git_data": {"type": "git", "source": "git.example.com/repo.git"},
+        "copy_data": {"type": "copy", "source": "/missing"},
+    }
+    data_store = wl.StaticDataStore("$DATA_DIR", static_data_dict)
+
+    def runner(cmd, timeout):
+        if cmd.startswith("du") and "/missing" in cmd:
+            raise RuntimeError("du: cannot access '/missing'")
+        if cmd.startswith("du"):
+            return "500000000\ttotal\n"
+        return "Total : 100,000,000 (95 Mbytes)\n"
+
+    plan = data_store.plan(
+        bandwidth={"rsync": 100e6}, overhead={"mars": 0}, runner=runner
+    )
+    items = {it.name: it for it in plan.items}
+
+    assert items["rsync_data"].bytes == 500000000
+    assert items["rsync_data"].seconds == 10
+    assert items["rsync_data"].submit_arguments == {"time": "00:10:00"}
+    assert items["mars_data"].bytes == 100000000
+    assert items["mars_data"].seconds == 10
+    assert items["link_data"].bytes == 0
+    assert items["git_data"].bytes is None
+    assert "cannot access" in items["copy_data"].error
+    assert sorted(plan.unknown) == ["copy_data", "git_data"]
+    assert plan.total_bytes == 600000000
+    assert plan.parallelism == 3
+    assert "suggested parallelism: 3" in str(plan)
+
+
+def test_static_data_store_plan_empty_error():
+    data_store = wl.StaticDataStore(
+        "$DATA_DIR", {"copy_data": {"type": "copy", "source": "/src"}}
+    )
+
+    def runner(cmd, timeout):
+        raise RuntimeError("")
+
+    plan = data_store.plan(runner=runner)
+    assert plan.items[0].error == "RuntimeError"
+    assert plan.unknown == ["copy_data"]
+
+
+def test_dedup_option():
+    data_dir = os.path.join("path", "to", "data")
+    options = {"type": "rsync", "source": "/dir/to/sync", "dedup": True}
+
+    data = wl.RsyncData(data_dir, "rsync_data", options)
+    script = data.script.value
+    assert "# Deduplicate files against the content-hash store" in script
+    assert f"store_dir={data_dir}/.store" in script
+    assert 'ln "$file" "$obj" 2>/dev/null || true' in script
+    assert '    chmod a-w "$obj"' in script
+    assert "--reflink" not in script
+    # rsync replaces the files by default, leaving the store untouched
+    assert 'cp -p "$obj"' not in script
+    assert "cp -p" not in "\n".join(
+        wl.ECFSData(data_dir, "ecfs_data", options).script.generate_stub()
+    )
+
+    # shared files are copied before the transfer can update them in place
+    options["rsync_options"] = "-a --inplace"
+    script = wl.RsyncData(data_dir, "rsync_data", options).script.value
+    main = script.index("# Main script")
+    assert script.index('cp -p "$obj" "$file.$$"') < main
+    mars_options = {"request": {"param": "2t"}, "dedup": True}
+    script = wl.MarsData(data_dir, "mars_data", mars_options).script.value
+    assert script.index('cp -p "$obj" "$file.$$"') < script.index(
+        "# Main script"
+    )
+    del options["rsync_options"]
+
+    options["dedup"] = {"store": "/shared/store", "mode": "reflink"}
+    data = wl.RsyncData(data_dir, "rsync_data", options)
+    script = data.script.value
+    assert "store_dir=/shared/store" in script
+    assert 'cp --reflink=always "$obj"' in script
+
+
+def test_dedup_option_errors():
+    data_dir = os.path.join("path", "to", "data")
+    with pytest.raises(WelliesConfigurationError):
+        wl.LinkData(
+            data_dir, "link", {"source": "/path/to/link", "dedup": True}
+        )
+    with pytest.raises(WelliesConfigurationError):
+        wl.RsyncData(
+            data_dir,
+            "rsync_data",
+            {"source": "/dir", "dedup": {"mode": "symlink"}},
+        )
+
+
+def test_retry_policy():
+    assert wl.retry_policy({}) is None
+    assert wl.retry_policy({"retry": 5}) == {
+        "count": 5,
+        "delay": 30,
+        "backoff": 2,
+        "exit_codes": [],
+    }
+    assert wl.retry_policy({"retry": {"delay": 10, "exit_codes": 255}}) == {
+        "count": 3,
+        "delay": 10,
+        "backoff": 2,
+        "exit_codes": [255],
+    }
+
+
+def test_retry_rsync_data():
+    data_dir = os.path.join("path", "to", "data")
+    options = {
+        "type": "rsync",
+        "source": "hpc-login:/dir/to/sync",
+        "retry": {"count": 2, "delay": 5, "exit_codes": [12, 255]},
+    }
+
+    data = wl.RsyncData(data_dir, "rsync_data", options)
+    script = data.script.value
+
+    assert script.startswith("# Retry policy for transfers\n")
+    assert "local attempt=1 delay=5 rc=0" in script
+    assert 'if (( attempt > 2 )) || [[ " 12 255 " != *" $rc "* ]]' in script
+    assert (
+        "retry rsync -avzpL --partial-dir=.rsync-partial "
+        "hpc-login:/dir/to/sync  $dest_dir/"
+    ) in script
+
+
+def test_retry_ecfs_data_resumes():
+    data_dir = os.path.join("path", "to", "data")
+    options = {
+        "type": "ecfs",
+        "source": "ec:/path/to/data",
+        "files": ["file1", "file2"],
+        "retry": 3,
+    }
+
+    data = wl.ECFSData(data_dir, "ecfs_data", options)
+
+    ref_script = dedent(
+        f"""\
+        dest_dir={data_dir}/ecfs_data
+        if [[ ${{ECF_TRYNO:-1}} -eq 1 ]]; then rm -rf $dest_dir; fi
+        mkdir -p $dest_dir/.partial
+        for src in ec:/path/to/data/file1 ec:/path/to/data/file2 ; do
+            if [[ -e $dest_dir/$(basename $src) ]]; then
+                echo "$src already retrieved, skipping"
+                continue
+            fi
+            retry ecp $src $dest_dir/.partial/
+            mv $dest_dir/.partial/$(basename $src) $dest_dir/
+        done
+        rm -rf $dest_dir/.partial
+        cd $dest_dir
+    """
+    )
+    assert ref_script in data.script.value
+
+
+def test_retry_mars_data():
+    data_dir = os.path.join("path", "to", "data")
+    options = {
+        "type": "mars",
+        "request": {"class": "od", "param": "t", "target": "t.grb"},
+        "retry": 1,
+    }
+
+    data = wl.MarsData(data_dir, "mars_data", options)
+    script = data.script.value
+
+    assert "cat > request.mars << EOF" in script
+    assert "retry mars request.mars" in script
+    assert "\nmars << EOF" not in script
+
+
+def test_stage_data():
+    data_store = wl.StaticDataStore(
+        "$DATA_DIR",
+        {
+            "grids": {"type": "copy", "source": "/path/to/grids"},
+            "clim": {"type": "link", "source": "/path/to/clim"},
+        },
+    )
+    script = "\n".join(pf.Script(data_store.stage("grids")).generate_stub())
+    assert "stage_root=${SSDTMP:-${TMPDIR:-/tmp}}/wellies_data" in script
+    assert (
+        "stage_data grids $DATA_DIR/grids $DATA_DIR/.grids.deployed" in script
+    )
+    assert "flock -x 9" in script
+    assert "find" not in script
+    assert "cat $stamp 2> /dev/null || stat -L -c '%i %Y' $src" in script
+    assert "        flock -s $reader" in script
+    assert "flock -xn $old.readers true; then" in script
+    assert "ln -sfn $dest $stage_job/$name" in script
+    assert "export STAGED_DATA_DIR=$stage_job" in script
+
+    script = "\n".join(
+        pf.Script(
+            data_store.stage(["grids", "clim"], "/ssd", variable="MY_DATA")
+        ).generate_stub()
+    )
+    assert "stage_root=/ssd" in script
+    assert "stage_data clim $DATA_DIR/clim $DATA_DIR/.clim.deployed" in script
+    assert "export MY_DATA=$stage_job" in script
+
+    with pytest.raises(WelliesConfigurationError):
+        data_store.stage("missing")
+
+
+def test_telemetry_option():
+    options = {"type": "copy", "source": "/path/to/src", "telemetry": True}
+    data = wl.CopyData("/data", "grids", options)
+    script = "\n".join(data.script.generate_stub())
+    assert data.telemetry == "/data/.telemetry.jsonl"
+    assert script.index("telemetry_start=") < script.index("scp")
+    assert "telemetry_marker=$(mktemp /data/.telemetry.XXXXXXXX)" in script
+    assert "find /data/grids -type f -printf '%s %C@\\n'" in script
+    assert "ecflow_client --label=telemetry" in script
+    assert "ecflow_client --meter=throughput" in script
+    assert 'grids copy "/path/to/src"' in script
+    assert ">> /data/.telemetry.jsonl" in script
+    assert wl.task_labels(data, version="NA") == {
+        "version": "NA",
+        "telemetry": "NA",
+    }
+    assert wl.task_meters(data) == {"throughput": (0, 10000)}
+
+    options["telemetry"] = {"log": "/logs/telemetry.jsonl"}
+    data = wl.CopyData("/data", "grids", options)
+    assert ">> /logs/telemetry.jsonl" in "\n".join(data.script.generate_stub())
+
+    data = wl.CopyData("/data", "grids", {"type": "copy", "source": "/src"})
+    assert data.telemetry is None
+    assert "telemetry" not in "\n".join(data.script.generate_stub())
+    assert wl.task_labels(data, version="NA") == {"version": "NA"}
+    assert wl.task_meters(data) == {}
+
+
+@pytest.mark.skipif(shutil.which("rsync") is None, reason="rsync not found")
+def test_telemetry_bytes_moved(tmp_path):
+    # an incremental redeployment only logs the bytes it transferred
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "big.bin").write_bytes(b"0" * 4000)
+    (src / "small.bin").write_bytes(b"0" * 100)
+    data_dir = tmp_path / "data"
+    options = {"type": "rsync", "source": f"{src}/", "telemetry": True}
+    data = wl.RsyncData(str(data_dir), "grids", options)
+    script = "\n".join(data.script.generate_stub())
+    env = dict(os.environ, PATH=f"{tmp_path}:{os.environ['PATH']}")
+    (tmp_path / "ecflow_client").write_text("#!/bin/sh\n")
+    (tmp_path / "ecflow_client").chmod(0o755)
+
+    subprocess.run(
+        ["bash", "-e"], input=script, text=True, env=env, check=True
+    )
+    (src / "small.bin").write_bytes(b"1" * 200)
+    subprocess.run(
+        ["bash", "-e"], input=script, text=True, env=env, check=True
+    )
+
+    first, second = telemetry.read_log(str(data_dir / ".telemetry.jsonl"))
+    assert (first["bytes"], first["files"]) == (4100, 2)
+    assert (second["bytes"], second["files"]) == (200, 1)
+    assert (second["item_bytes"], second["item_files"]) == (4200, 2)
+    assert not list(data_dir.glob(".telemetry.*[!l]"))
+    assert sorted(os.listdir(data_dir / "grids")) == ["big.bin", "small.bin"]
+
+
+def test_mars_data_cache():
+    data_dir = os.path.join("path", "to", "data")
+    options = {
+        "type": "mars",
+        "request": {"class": "od", "param": "t", "target": "t.grb"},
+        "cache": True,
+    }
+
+    script = wl.MarsData(data_dir, "mars_data", options).script.value
+    assert f"cache_dir={wl.DEFAULT_MARS_CACHE}" in script
+    assert "mars $cache_dir/locks/$key.req" in script
+    assert f"(( total > {10 * 1024**3} )) || break" in script
+
+    options["cache"] = {"max_size": 0}
+    script = wl.MarsData(data_dir, "mars_data", options).script.value
+    assert "evict" not in script
+
+    options["cache"] = {"dir": "/cache", "max_size": "1K"}
+    options["retry"] = 2
+    script = wl.MarsData(data_dir, "mars_data", options).script.value
+    assert "cache_dir=/cache" in script
+    assert "retry mars $cache_dir/locks/$key.req" in script
+    assert "(( total > 1024 )) || break" in script
+
+    options["request"]["target"] = "t_[param].grb"
+    with pytest.raises(WelliesConfigurationError):
+        wl.MarsData(data_dir, "mars_data", options)
+
+
+def test_static_data_store_preflight():
+    data_store = wl.StaticDataStore(
+        "$DATA_DIR",
+        {
+            "grids": {"type": "rsync", "source": "hpc:/path/to/grids"},
+            "clim": {"type": "ecfs", "source": "ec:/clim", "files": "a.grb"},
+            "code": {"type": "git", "source": "repo.git", "branch": "dev"},
+            "link": {"type": "link", "source": "/path/to/link"},
+            "other": {"type": "custom"},
+        },
+    )
+
+    def runner(cmd, timeout):
+        if cmd.startswith("els"):
+            raise subprocess.CalledProcessError(1, cmd, stderr="no such file")
+        if cmd.startswith("git"):
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        return ""
+
+    report = data_store.preflight(max_workers=2, timeout=5, runner=runner)
+    assert report.checked == ["grids", "clim", "code", "link"]
+    assert report.skipped == ["other"]
+    assert [(f.name, f.command, f.error) for f in report.failures] == [
+        ("clim", "els ec:/clim/a.grb > /dev/null", "no such file"),
+        (
+            "code",
+            "git ls-remote --exit-code repo.git dev",
+            "timed out after 5s",
+        ),
+    ]
+    assert "2 failed" in str(report)
+
+    commands = []
+
+    def remote(cmd, timeout):
+        commands.append(cmd)
+        raise RuntimeError("")
+
+    report = data_store.preflight(runner=remote, host="hpc-login")
+    link = "ls -d /path/to/link > /dev/null"
+    assert f"ssh -o BatchMode=yes hpc-login '{link}'" in commands
+    assert ("link", link, "RuntimeError") in [
+        (f.name, f.command, f.error) for f in report.failures
+    ]
+
+    checks = {name: data.check_command() for name, data in data_store.items()}
+    assert checks["grids"] == (
+        "ssh -o BatchMode=yes hpc 'ls -d /path/to/grids > /dev/null'"
+    )
+    assert checks["link"] == "ls -d /path/to/link > /dev/null"
+
+
+def test_static_data_store_lazy(monkeypatch):
+    built = []
+    parse = wl.parse_data_item
+
+    def parse_data_item(data_dir, name, options):
+        built.append(name)
+        return parse(data_dir, name, options)
+
+    monkeypatch.setattr(wl, "parse_data_item", parse_data_item)
+    static_data_dict = {
+        "rsync_data": {"type": "rsync", "source": "/dir/to/sync"},
+        "link_data": {"type": "link", "source": "/path/to/link"},
+    }
+    data_store = wl.StaticDataStore("$DATA_DIR", static_data_dict)
+
+    assert list(data_store) == ["rsync_data", "link_data"]
+    assert len(data_store) == 2
+    assert "link_data" in data_store
+    assert data_store.options["link_data"]["source"] == "/path/to/link"
+    assert "'source': '/dir/to/sync'" in repr(data_store)
+    assert built == []
+
+    assert data_store["link_data"] is data_store["link_data"]
+    assert built == ["link_data"]
+    assert isinstance(data_store.static_data["rsync_data"], wl.RsyncData)
+    assert built == ["link_data", "rsync_data"]
+    with pytest.raises(TypeError):
+        data_store.static_data["other"] = data_store["link_data"]
+
+    with pytest.raises(Exception, match="not supported"):
+        wl.StaticDataStore("$DATA_DIR", {"bad": {"type": "ftp"}})
+
+
+def test_index_option():
+    options = {"type": "copy", "source": "/path/to/src", "index": True}
+    script = wl.CopyData("/data", "grids", options).script.value
+    assert "printf 'shortName\\tlevel\\tstep\\tdataDate\\tdataTime" in script
+    assert "-name '*.grib'" in script
+    assert "grib_get -p shortName,level,step,dataDate,dataTime," in script
+    assert script.index("scp") < script.index("grib_get")
+
+    options["index"] = {"type": "netcdf", "pattern": "*.nc"}
+    script = wl.CopyData("/data", "grids", options).script.value
+    assert "printf 'variable\\tfile\\n'" in script
+    assert "ncdump -h" in script
+    assert "! -name '.*' -name '*.nc' |" in script
+
+    options["index"] = {"command": "my_indexer", "keys": ["param", "date"]}
+    script = wl.CopyData("/data", "grids", options).script.value
+    assert "printf 'param\\tdate\\tfile\\n'" in script
+    assert '    my_indexer "$file"' in script
+
+    for index in [{"command": "my_indexer"}, "hdf5"]:
+        options["index"] = index
+        with pytest.raises(WelliesConfigurationError):
+            wl.CopyData("/data", "grids", options)
+
+    link = {"type": "link", "source": "/path/to/link", "index": True}
+    with pytest.raises(WelliesConfigurationError):
+        wl.LinkData("/data", "grids", link)
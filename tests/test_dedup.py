@@ -0,0 +1,45 @@
+import os
+
+from wellies import dedup
+
+
+def _write_store(store_dir, manifests, objects):
+    os.makedirs(os.path.join(store_dir, "items"))
+    for name, lines in manifests.items():
+        with open(os.path.join(store_dir, "items", name), "w") as fout:
+            fout.write("\n".join(lines) + "\n")
+    for digest, content in objects.items():
+        obj_dir = os.path.join(store_dir, "objects", digest[:2])
+        os.makedirs(obj_dir, exist_ok=True)
+        with open(os.path.join(obj_dir, digest), "w") as fout:
+            fout.write(content)
+
+
+def test_dedup_report(tmp_path):
+    store_dir = tmp_path.joinpath("store").as_posix()
+    _write_store(
+        store_dir,
+        {
+            "grids": ["aa11 100 grid.grib", "bb22 50 sub dir/land.grib"],
+            "clim": ["aa11 100 clim.grib"],
+        },
+        {"aa11": "a" * 100, "bb22": "b" * 50, "cc33": "c" * 10},
+    )
+
+    report = dedup.dedup_report(store_dir)
+
+    assert report.items == {"clim": 100, "grids": 150}
+    assert report.logical_bytes == 250
+    assert report.stored_bytes == 150
+    assert report.saved_bytes == 100
+    assert [os.path.basename(p) for p in report.orphans] == ["cc33"]
+    assert "space saved" in str(report)
+
+    assert dedup.prune_orphans(store_dir) == 10
+    assert dedup.dedup_report(store_dir).orphans == []
+
+
+def test_dedup_report_empty(tmp_path):
+    report = dedup.dedup_report(tmp_path.as_posix())
+    assert report.logical_bytes == 0
+    assert report.saved_bytes == 0
@@ -0,0 +1,154 @@
+import os
+import subprocess
+import time
+
+import pytest
+
+import wellies as wl
+from wellies import housekeeping
+
+
+def _make_item(data_dir, name, size, days_ago):
+    item_dir = os.path.join(data_dir, name)
+    os.makedirs(item_dir)
+    fpath = os.path.join(item_dir, "data.bin")
+    with open(fpath, "wb") as fout:
+        fout.write(b"0" * size)
+    stamp = time.time() - days_ago * 86400
+    os.utime(fpath, (stamp, stamp))
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    data_dir = tmp_path.joinpath("data").as_posix()
+    _make_item(data_dir, "old", 300, 40)
+    _make_item(data_dir, "recent", 200, 10)
+    _make_item(data_dir, "current", 100, 50)
+    os.makedirs(os.path.join(data_dir, ".store"))
+    os.symlink(tmp_path.as_posix(), os.path.join(data_dir, "link"))
+    return data_dir
+
+
+def test_parse_size():
+    assert housekeeping.parse_size(1024) == 1024
+    assert housekeeping.parse_size("2K") == 2048
+    assert housekeeping.parse_size("1.5G") == 1.5 * 1024**3
+    with pytest.raises(ValueError):
+        housekeeping.parse_size("lots")
+
+
+def test_scan_data_dir(data_dir):
+    usages = housekeeping.scan_data_dir(data_dir)
+    assert [usage.name for usage in usages] == ["current", "old", "recent"]
+    assert [usage.size for usage in usages] == [100, 300, 200]
+    assert round(usages[1].age()) == 40
+
+
+def test_select_evictions(data_dir):
+    usages = housekeeping.scan_data_dir(data_dir)
+
+    def names(evicted):
+        return [usage.name for usage in evicted]
+
+    assert names(housekeeping.select_evictions(usages)) == []
+    assert names(housekeeping.select_evictions(usages, quota=500)) == [
+        "current",
+    ]
+    assert names(
+        housekeeping.select_evictions(usages, quota=150, protected=["current"])
+    ) == ["old", "recent"]
+    assert names(housekeeping.select_evictions(usages, max_age=30)) == [
+        "current",
+        "old",
+    ]
+
+
+def test_evict(data_dir):
+    evicted = housekeeping.evict(
+        data_dir, quota=300, protected=["current"], dry_run=True
+    )
+    assert [usage.name for usage in evicted] == ["old"]
+    assert os.path.exists(os.path.join(data_dir, "old"))
+
+    housekeeping.evict(data_dir, quota=300, protected=["current"])
+    assert sorted(os.listdir(data_dir)) == [
+        ".store",
+        "current",
+        "link",
+        "recent",
+    ]
+
+
+def _make_store(data_dir, items):
+    # one object per item, with the manifest of the item
+    store_dir = os.path.join(data_dir, ".store")
+    for name in items:
+        digest = f"{len(name):064x}"
+        obj = os.path.join(store_dir, "objects", digest[:2], digest)
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        os.link(os.path.join(data_dir, name, "data.bin"), obj)
+        os.makedirs(os.path.join(store_dir, "items"), exist_ok=True)
+        with open(os.path.join(store_dir, "items", name), "w") as fout:
+            fout.write(f"{digest} 1 data.bin\n")
+    return store_dir
+
+
+def _objects(store_dir):
+    objects_dir = os.path.join(store_dir, "objects")
+    return sorted(f for _, _, files in os.walk(objects_dir) for f in files)
+
+
+def test_evict_dedup_store(data_dir):
+    store_dir = _make_store(data_dir, ["old", "recent"])
+    housekeeping.evict(data_dir, quota=300, protected=["current"])
+    assert os.listdir(os.path.join(store_dir, "items")) == ["recent"]
+    assert _objects(store_dir) == [f"{len('recent'):064x}"]
+
+
+def test_housekeeping_task_script(data_dir):
+    # the task evicts the same items as the python API, and cleans the store
+    store_dir = _make_store(data_dir, ["old", "recent"])
+    data_store = wl.StaticDataStore(data_dir, {})
+    task = wl.DataHousekeepingTask(
+        data_store, quota=300, data_dir=data_dir, keep=["current"]
+    )
+    script = "\n".join(task.script.generate_stub())
+    subprocess.run(["bash", "-e"], input=script, text=True, check=True)
+    assert sorted(os.listdir(data_dir)) == [
+        ".store",
+        "current",
+        "link",
+        "recent",
+    ]
+    assert os.listdir(os.path.join(store_dir, "items")) == ["recent"]
+    assert _objects(store_dir) == [f"{len('recent'):064x}"]
+
+
+def test_housekeeping_task(tmp_path):
+    data_store = wl.StaticDataStore(
+        "$DATA_DIR",
+        {
+            "grids": {"type": "copy", "source": "/path/to/grids"},
+            "clim": {"type": "link", "source": "/path/to/clim"},
+        },
+    )
+    task = wl.DataHousekeepingTask(
+        data_store, quota="2G", max_age=30, keep=["prefetch"]
+    )
+    script = "\n".join(task.script.generate_stub())
+    assert "quota=2147483648" in script
+    assert "store_dir=$DATA_DIR/.store" in script
+    assert "max_age=2592000" in script
+    assert 'protected=" clim grids prefetch "' in script
+
+    task = wl.DataHousekeepingTask(data_store, max_age=1.5)
+    script = "\n".join(task.script.generate_stub())
+    assert "max_age=129600" in script
+    subprocess.run(["bash", "-n"], input=script, text=True, check=True)
+
+    with pytest.raises(ValueError):
+        wl.DataHousekeepingTask(data_store)
+    with pytest.raises(ValueError, match="max_age"):
+        wl.DataHousekeepingTask(data_store, max_age="a month")
+    with pytest.raises(ValueError, match="max_age"):
+        wl.DataHousekeepingTask(data_store, max_age=0)
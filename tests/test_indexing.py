@@ -0,0 +1,84 @@
+import os
+import subprocess
+
+import pytest
+
+from wellies import data
+from wellies import indexing
+
+
+@pytest.fixture
+def item_dir(tmp_path):
+    item_dir = tmp_path.joinpath("grids")
+    item_dir.mkdir()
+    item_dir.joinpath("an.grib").write_bytes(b"GRIB1111GRIB22")
+    item_dir.joinpath(".index.tsv").write_text(
+        "shortName\tlevel\tstep\toffset\tlength\tfile\n"
+        "2t\t0\t0\t0\t8\tan.grib\n"
+        "tp\t0\t6\t8\t6\tan.grib\n"
+        "tp\t0\t12\t8\t6\tan.grib\n"
+    )
+    return item_dir.as_posix()
+
+
+def test_data_index(item_dir):
+    index = indexing.DataIndex(item_dir)
+    assert len(index) == 3
+    assert index.keys == ["shortName", "level", "step"]
+
+    entry = index.get(shortName="tp", level=0, step=6)
+    assert entry.file == os.path.join(item_dir, "an.grib")
+    assert (entry.offset, entry.length) == (8, 6)
+    assert index.read(entry) == b"GRIB22"
+
+    assert len(index.find(shortName="tp")) == 2
+    assert index.find(shortName="tp", level=0, step=24) == []
+    with pytest.raises(KeyError):
+        index.get(shortName="tp")
+    with pytest.raises(KeyError):
+        index.find(param="tp")
+
+
+def test_data_index_without_offsets(tmp_path):
+    tmp_path.joinpath("f.nc").write_bytes(b"CDF")
+    tmp_path.joinpath(".index.tsv").write_text(
+        "variable\tfile\nt\tf.nc\ncrs\tf.nc\n"
+    )
+    index = indexing.DataIndex(tmp_path.as_posix())
+    entry = index.get(variable="t")
+    assert entry.offset is None
+    assert index.read(entry) == b"CDF"
+
+
+NCDUMP_HEADER = """netcdf f {
+dimensions:
+\ttime = 2 ;
+variables:
+\tfloat t(time) ;
+\t\tt:units = "K" ;
+\tint64 time(time) ;
+\tuint64 count(time) ;
+\tint crs ;
+
+// global attributes:
+\t\t:Conventions = "CF-1.8" ;
+}
+"""
+
+
+def test_netcdf_index_script(tmp_path):
+    bin_dir = tmp_path.joinpath("bin")
+    bin_dir.mkdir()
+    ncdump = bin_dir.joinpath("ncdump")
+    ncdump.write_text(f"#!/bin/bash\ncat <<'EOF'\n{NCDUMP_HEADER}EOF\n")
+    ncdump.chmod(0o755)
+    item_dir = tmp_path.joinpath("fields")
+    item_dir.mkdir()
+    item_dir.joinpath("f.nc").write_bytes(b"CDF")
+    script = data.index_script(tmp_path.as_posix(), "fields", "netcdf")
+    env = dict(os.environ, PATH=f"{bin_dir}:{os.environ['PATH']}")
+    subprocess.run(["bash", "-eu", "-c", str(script)], check=True, env=env)
+
+    index = indexing.DataIndex(item_dir.as_posix())
+    variables = [entry.keys["variable"] for entry in index]
+    assert variables == ["t", "time", "count", "crs"]
@@ -1,3 +1,5 @@
+import pytest
+
 from wellies import mars
 
 req = dict(
@@ -158,3 +160,58 @@ EOF
     print(request)
     print(request_check)
     assert request == request_check
+
+
+def test_canonical_request():
+    canonical = mars.canonical_request(("retrieve", req))
+    same = mars.canonical_request(
+        (
+            "RETRIEVE",
+            {k.lower(): str(v).lower() for k, v in reversed(req.items())}
+            | {"time": ["0", "6", "12", "18"], "target": "other.grb"},
+        )
+    )
+    assert canonical == same
+    assert canonical.startswith("retrieve,\n  class=ce,\n  database=")
+    assert "target" not in canonical
+
+    canonical = mars.canonical_request(
+        ("retrieve", {"date": "$PREFETCH_YMD", "param": "T"})
+    )
+    assert canonical == "retrieve,\n  date=$PREFETCH_YMD,\n  param=t"
+
+
+def test_cached_retrieve():
+    script = str(
+        mars.CachedRetrieve(req, "/cache", max_size=100, target="dis.grb")
+    )
+    assert "key=$(sha256sum << EOF | cut -d ' ' -f 1\nretrieve,\n" in script
+    assert 'target="$cached.tmp"' in script
+    assert "mars $cache_dir/locks/$key.req" in script
+    assert 'ln -f $cached "dis.grb"' in script
+    assert "(( total > 100 )) || break" in script
+    assert "    chmod a-w $cached" in script
+
+    script = str(mars.CachedRetrieve(req, "/cache", target="dis.grb"))
+    assert f"(( total > {10 * 1024**3} )) || break" in script
+    script = str(
+        mars.CachedRetrieve(req, "/cache", max_size=0, target="dis.grb")
+    )
+    assert "evict" not in script
+
+    with pytest.raises(ValueError):
+        mars.CachedRetrieve(req, "/cache")
+    with pytest.raises(ValueError):
+        mars.CachedRetrieve(req, "/cache", target="dis_[step].grb")
+
+
+def test_cached_retrieve_relative_dates():
+    for date in (-1, "-1/to/-5", "0", ["20240101", "yesterday"]):
+        with pytest.raises(ValueError, match="absolute dates"):
+            mars.CachedRetrieve(
+                {"param": "t", "date": date}, "/cache", target="t.grb"
+            )
+    for date in (20240101, "20240101/to/20240110/by/1", "$YMD", "2024-01-01"):
+        mars.CachedRetrieve(
+            {"param": "t", "DATE": date}, "/cache", target="t.grb"
+        )
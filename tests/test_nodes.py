@@ -86,3 +86,184 @@ def test_ecfvarstask_creation_host_submitargs_parentvars(wlhost, contextname):
     for var in t1.parent.variables:
         assert var.name in default_vars.keys()
         assert var.value == default_vars[var.name]
+
+
+def test_prefetch_data_family(wlhost):
+    static_data = {
+        "fc_inputs": {
+            "type": "mars",
+            "request": {"date": "$PREFETCH_YMD", "target": "fc.grb"},
+        },
+    }
+    with pf.Suite("s1", host=wlhost.host):
+        family = wl.PrefetchDataFamily(
+            static_data, prefetch_dir="/prefetch", lookahead=3
+        )
+
+    assert [t.name for t in family.executable_children] == [
+        "fc_inputs",
+        "clean",
+    ]
+    script = "\n".join(family.fc_inputs.script.generate_stub())
+    assert "for offset in $(seq 0 3); do" in script
+    assert (
+        'export PREFETCH_YMD=$(date -d "$YMD + $((offset * 1)) day" +%Y%m%d)'
+        in script
+    )
+    assert "dest_dir=/prefetch/$PREFETCH_YMD/fc_inputs" in script
+    assert "date=$PREFETCH_YMD" in script
+    assert script.endswith(
+        'touch "$marker"\nfi\nif (( offset == 0 )); then\n'
+        "    # the data of the current cycle is ready\n"
+        "    ecflow_client --event=ready\nfi\ndone"
+    )
+
+    ready = family.ready("fc_inputs")
+    assert ready.fullname == "/s1/prefetch_data/fc_inputs:ready"
+    with pf.Suite("s2", host=wlhost.host):
+        family = wl.PrefetchDataFamily(static_data, prefetch_dir="/prefetch")
+        forecast = pf.Task("forecast", triggers=family.ready("fc_inputs"))
+    assert forecast.triggers is not None
+
+    clean = "\n".join(family.clean.script.generate_stub())
+    assert "(( date < $YMD ))" in clean
+    assert family.path("fc_inputs") == "/prefetch/$YMD/fc_inputs"
+
+
+def test_prefetch_data_family_lookahead(wlhost):
+    with pytest.raises(ValueError):
+        with pf.Suite("s1", host=wlhost.host):
+            wl.PrefetchDataFamily({}, lookahead=0)
+    for option in ({"targets": ["hpc-b"]}, {"batch": True}):
+        with pytest.raises(ValueError, match="not supported"):
+            with pf.Suite("s1", host=wlhost.host):
+                wl.PrefetchDataFamily({}, **option)
+
+
+def test_deploy_data_family_fanout(wlhost):
+    data_store = wl.StaticDataStore(
+        "$DATA_DIR",
+        {
+            "grids": {"type": "copy", "source": "/path/to/grids"},
+            "clim": {"type": "ecfs", "source": "ec:/path/to/clim"},
+        },
+    )
+    with pf.Suite("s1", host=wlhost.host):
+        family = wl.DeployDataFamily(
+            data_store,
+            targets={"hpc-b": None, "hpc-c": "/scratch/data", "hpc-d": None},
+            fanout=2,
+        )
+
+    distribute = family.distribute
+    assert [t.name for t in distribute.executable_children] == [
+        "hpc_b",
+        "hpc_c",
+        "hpc_d",
+    ]
+    variables = {v.name: v.value for v in distribute.hpc_d.variables}
+    assert variables == {"SCHOST": "hpc-b"}
+    assert not list(distribute.hpc_b.variables)
+
+    script = "\n".join(distribute.hpc_c.script.generate_stub())
+    assert "dest_dir=/scratch/data" in script
+    assert (
+        'rsync -a -e "$ssh_cmd" $DATA_DIR/.grids.deployed hpc-c:$dest_dir/'
+        in script
+    )
+    deploy = "\n".join(family.grids.script.generate_stub())
+    assert deploy.endswith(
+        "date +%s.%N > $DATA_DIR/.grids.deployed.$$\n"
+        "mv -f $DATA_DIR/.grids.deployed.$$ $DATA_DIR/.grids.deployed"
+    )
+    assert "ControlPath=$control" in script
+    assert (
+        'rsync -a --delete -e "$ssh_cmd" $DATA_DIR/grids hpc-c:$dest_dir/'
+        in script
+    )
+
+    with pytest.raises(ValueError):
+        with pf.Suite("s1", host=wlhost.host):
+            wl.DeployDataFamily(data_store, targets=["hpc-b"], fanout=0)
+
+
+def test_deploy_data_family_batch(wlhost, monkeypatch):
+    data_store = wl.StaticDataStore(
+        "$DATA_DIR",
+        {
+            "clim": {"type": "link", "source": "/path/to/clim"},
+            "masks": {"type": "link", "source": "/path/to/masks"},
+            "own_args": {
+                "type": "link",
+                "source": "/path/to/own",
+                "submit_arguments": "serial",
+            },
+            "grids": {"type": "copy", "source": "/path/to/grids"},
+            "big": {"type": "copy", "source": "/path/to/big"},
+        },
+    )
+    with pf.Suite("s1", host=wlhost.host):
+        family = wl.DeployDataFamily(data_store, batch=True)
+    assert [t.name for t in family.executable_children] == [
+        "own_args",
+        "grids",
+        "big",
+        "batch",
+    ]
+    labels = {label.name for label in family.batch.labels}
+    assert labels == {"version", "clim", "masks"}
+    script = "\n".join(family.batch.script.generate_stub())
+    assert "(( $(jobs -rp | wc -l) >= 8 ))" in script
+    assert "ecflow_client --label=clim running || true" in script
+    assert ') > >(sed "s/^/[masks] /") 2>&1 &' in script
+    assert "ln -sfn /path/to/clim $dest_dir" in script
+
+    def plan(self):
+        return wl.data.DataDeploymentPlan(
+            [
+                wl.data.DataItemPlan(name, data.options["type"], size)
+                for name, size, data in [
+                    ("clim", 0, data_store["clim"]),
+                    ("masks", 0, data_store["masks"]),
+                    ("own_args", 0, data_store["own_args"]),
+                    ("grids", 1000, data_store["grids"]),
+                    ("big", 10**9, data_store["big"]),
+                ]
+            ]
+        )
+
+    monkeypatch.setattr(wl.StaticDataStore, "plan", plan)
+    with pf.Suite("s1", host=wlhost.host):
+        family = wl.DeployDataFamily(
+            data_store,
+            batch=True,
+            batch_threshold=10**6,
+            batch_parallel=2,
+            batch_probe=True,
+        )
+    assert [t.name for t in family.executable_children] == [
+        "own_args",
+        "big",
+        "batch",
+    ]
+    script = "\n".join(family.batch.script.generate_stub())
+    assert "(( $(jobs -rp | wc -l) >= 2 ))" in script
+    assert "batch_pids[grids]=$!" in script
+
+    # without probing, only the static options are used
+    def no_plan(self):
+        raise AssertionError("the sources must not be probed")
+
+    monkeypatch.setattr(wl.StaticDataStore, "plan", no_plan)
+    data_store["grids"].options["size"] = "500K"
+    data_store["big"].options["batch"] = True
+    data_store["clim"].options["batch"] = False
+    with pf.Suite("s1", host=wlhost.host):
+        family = wl.DeployDataFamily(
+            data_store, batch=True, batch_threshold=10**6
+        )
+    assert [t.name for t in family.executable_children] == [
+        "clim",
+        "own_args",
+        "batch",
+    ]
@@ -0,0 +1,57 @@
+import json
+
+import pytest
+
+from wellies import telemetry
+
+
+@pytest.fixture
+def telemetry_log(tmp_path):
+    records = [
+        {
+            "name": "grids",
+            "type": "ecfs",
+            "source": "ec:/grids",
+            "bytes": 4000000,
+            "files": 2,
+            "seconds": 2.0,
+        },
+        {
+            "name": "grids",
+            "type": "ecfs",
+            "source": "ec:/grids",
+            "bytes": 4000000,
+            "files": 2,
+            "seconds": 6.0,
+        },
+        {
+            "name": "clim",
+            "type": "copy",
+            "source": "/clim",
+            "bytes": 3000000,
+            "files": 1,
+            "seconds": 0.5,
+        },
+    ]
+    path = tmp_path.joinpath("telemetry.jsonl")
+    lines = [json.dumps(record) for record in records]
+    path.write_text("\n".join(lines) + '\n{"name": "trunc')
+    return path.as_posix()
+
+
+def test_summarise(telemetry_log):
+    records = telemetry.read_log(telemetry_log)
+    assert len(records) == 3
+
+    by_type = telemetry.summarise(records)
+    assert by_type["ecfs"].runs == 2
+    assert by_type["ecfs"].bytes == 8000000
+    assert by_type["ecfs"].throughput == 1000000
+    assert by_type["copy"].throughput == 6000000
+
+    by_source = telemetry.summarise(records, key="source")
+    assert sorted(by_source) == ["/clim", "ec:/grids"]
+
+    table = telemetry.format_summary(by_type, "type").splitlines()
+    assert table[0].startswith("type")
+    assert table[1].startswith("ecfs")
@@ -1,5 +1,7 @@
 # flake8: noqa
 import os
+import shutil
+import subprocess
 from functools import partial
 from textwrap import dedent
 
@@ -7,7 +9,9 @@ import pyflow as pf
 import pytest
 
 import wellies as wl
+from wellies import scripts
 from wellies import tools
+from wellies.exceptions import WelliesConfigurationError
 
 
 def test_tool_store(custom_script_file):
@@ -70,6 +74,411 @@ def test_tool_store(custom_script_file):
     assert toolstore.depends("myenv2") == ["python3"]
 
 
+def test_tool_store_dependency_resolution():
+    tools_dict = {
+        "modules": {
+            "python3": {"version": 3.8},
+            "toolbox": {"version": "new", "depends": "python3"},
+        },
+        "env_variables": {
+            "PYTHONPATH": {"value": "/path/to/bin", "depends": "python3"},
+        },
+        "environments": {
+            "localbin": {
+                "type": "folder",
+                "depends": ["toolbox", "PYTHONPATH"],
+            },
+        },
+    }
+    toolstore = tools.ToolStore("/path/to/lib", tools_dict)
+
+    assert toolstore.closure("localbin") == [
+        "python3",
+        "toolbox",
+        "PYTHONPATH",
+        "localbin",
+    ]
+    assert toolstore.depends("localbin") == [
+        "toolbox",
+        "python3",
+        "PYTHONPATH",
+    ]
+    assert list(toolstore.tool_script("load", "localbin")) == [
+        "python3",
+        "toolbox",
+        "PYTHONPATH",
+        "localbin",
+    ]
+    load = toolstore.load(["localbin", "toolbox"])
+    assert len(load) == 4  # python3 and toolbox loaded together
+
+    toolstore.add_tool("extra", tools.EnvVarTool("extra", "X", "1"))
+    toolstore.add_tool(
+        "python3", tools.EnvVarTool("python3", "Y", "1", depends="extra")
+    )
+    assert toolstore.closure("toolbox") == ["extra", "python3", "toolbox"]
+
+
+def test_tool_store_interned_scripts():
+    tools_dict = {
+        "modules": {
+            "python3": {"version": 3.8},
+            "toolbox": {"version": "new", "depends": "python3"},
+        },
+    }
+    toolstore = tools.ToolStore("/path/to/lib", tools_dict)
+
+    load = toolstore.load(["toolbox"])
+    assert isinstance(load, list)
+    assert toolstore.load("toolbox") is not load
+    assert toolstore.load("toolbox") == load
+    stub = load.generate_stub()
+    assert stub == pf.Script.generate_list_scripts(list(load))
+    assert toolstore.load("toolbox").generate_stub() == stub
+
+    task = pf.Task("t1", script=[load, "echo done"])
+    assert "module load python3/3.8 toolbox/new" in str(task.script)
+    assert str(task.script).endswith("echo done")
+
+    # pyflow keeps a reference to the list: extending a task script built
+    # from a load must not leak into the other tasks
+    script = pf.Script(toolstore.load("toolbox"))
+    script += "echo extended"
+    assert "echo extended" in str(script)
+    assert "echo extended" not in str(pf.Script(toolstore.load("toolbox")))
+    load.append("echo appended")
+    assert load.generate_stub()[-1] == "echo appended"
+    assert toolstore.load("toolbox").generate_stub() == stub
+
+    unload = toolstore.unload("toolbox")
+    assert toolstore.unload(["toolbox"]) == unload
+    unload_stub = "\n".join(unload.generate_stub())
+    assert "None" not in unload_stub
+    assert unload_stub.index("module unload toolbox") < unload_stub.index(
+        "module unload python3"
+    )
+
+    toolstore.add_tool("toolbox", tools.EnvVarTool("toolbox", "X", "1"))
+    assert toolstore.load("toolbox") != load
+
+
+def test_tool_store_coalesced_modules():
+    tools_dict = {
+        "modules": {
+            "python3": {"version": 3.8},
+            "a": {"version": 1, "modulefiles": "/mf", "depends": "python3"},
+            "b": {"version": 2, "modulefiles": "/mf"},
+        },
+        "env_variables": {
+            "X": {"value": 1, "depends": "a"},
+            "Y": {"value": 2, "depends": "b"},
+        },
+    }
+    toolstore = tools.ToolStore("/path/to/lib", tools_dict)
+
+    load = toolstore.load(["X", "Y"]).generate_stub()
+    assert load.count("module use /mf") == 1
+    assert "module unload python3 a || true" in load
+    assert "module load python3/3.8 a/1" in load
+    assert load.index("export X=1") < load.index("module load b/2")
+    assert "module purge" not in load
+
+    load = toolstore.load(["a", "b"], purge=True).generate_stub()
+    assert "module purge" in load
+    assert "module load python3/3.8 a/1 b/2" in load
+    with pytest.raises(ValueError):
+        toolstore.load("X", purge=True)
+
+
+def test_tool_store_stamp():
+    tools_dict = {
+        "modules": {"python3": {"version": 3.8}},
+        "environments": {
+            "myenv": {
+                "type": "venv",
+                "depends": "python3",
+                "extra_packages": ["numpy"],
+                "stamp": True,
+            },
+            "custom": {"type": "custom", "setup": "echo", "stamp": True},
+        },
+    }
+    toolstore = tools.ToolStore("/path/to/lib", tools_dict)
+    stamp = toolstore.definition_hash("myenv")
+    assert stamp == tools.ToolStore(
+        "/path/to/lib", tools_dict
+    ).definition_hash("myenv")
+
+    setup = pf.Script.generate_list_scripts(toolstore.setup("myenv"))
+    assert "stamp_file=/path/to/lib/myenv/.wellies_stamp" in setup
+    assert f"stamp={stamp}" in setup
+    assert "python3 -m venv /path/to/lib/myenv" in setup
+    assert setup[-1] == "fi"
+    assert "None" not in setup
+    assert None not in toolstore.setup("myenv")
+
+    # the content of the lockfile is part of the stamp
+    tools_dict["environments"]["locked"] = {
+        "type": "venv",
+        "depends": "python3",
+        "lockfile": "/path/to/req.lock",
+        "stamp": True,
+    }
+    toolstore = tools.ToolStore("/path/to/lib", tools_dict)
+    setup = pf.Script.generate_list_scripts(toolstore.setup("locked"))
+    assert "stamp=$stamp-$(sha256sum /path/to/req.lock | cut -c 1-16)" in setup
+
+    tools_dict["modules"]["python3"]["version"] = 3.9
+    toolstore = tools.ToolStore("/path/to/lib", tools_dict)
+    assert toolstore.definition_hash("myenv") != stamp
+
+    with pytest.raises(WelliesConfigurationError, match="stamp"):
+        toolstore.setup("custom")
+
+
+def _run_pack(tmp_path):
+    command = tmp_path / "fake-pack"
+    command.write_text('#!/bin/bash\necho packed >> "$4"\n')
+    command.chmod(0o755)
+    script = pf.TemplateScript(
+        tools.pack_env,
+        COMMAND=str(command),
+        ENV_DIR=str(tmp_path / "env"),
+        ARCHIVE=str(tmp_path / "env.tar.gz"),
+    )
+    subprocess.run(
+        ["bash", "-eu", "-c", str(script)],
+        check=True,
+    )
+    return (tmp_path / "env.tar.gz").read_text().count("packed")
+
+
+def test_pack_skipped_when_stamp_matches(tmp_path):
+    (tmp_path / "env").mkdir()
+    # without stamp, the environment is packed on every deployment
+    assert _run_pack(tmp_path) == 1
+    assert _run_pack(tmp_path) == 1
+    stamp = tmp_path / "env.tar.gz.stamp"
+    first = stamp.read_text()
+    (tmp_path / "env" / ".wellies_stamp").write_text("abc\n")
+    assert _run_pack(tmp_path) == 1
+    assert stamp.read_text() == "abc\n" != first
+    # unchanged stamp, the archive and its stamp are kept
+    mtime = (tmp_path / "env.tar.gz").stat().st_mtime_ns
+    _run_pack(tmp_path)
+    assert (tmp_path / "env.tar.gz").stat().st_mtime_ns == mtime
+    (tmp_path / "env" / ".wellies_stamp").write_text("def\n")
+    _run_pack(tmp_path)
+    assert stamp.read_text() == "def\n"
+
+
+def test_packed_environment():
+    tools_dict = {
+        "modules": {"conda": {"version": "default"}},
+        "environments": {
+            "myenv": {
+                "type": "conda",
+                "depends": "conda",
+                "extra_packages": ["numpy"],
+                "pack": {"unpack_dir": "/node/local"},
+            },
+            "myvenv": {"type": "venv", "pack": True},
+            "custom": {"type": "custom", "setup": "echo", "pack": True},
+        },
+    }
+    with pytest.raises(WelliesConfigurationError, match="pack"):
+        tools.ToolStore("/path/to/lib", tools_dict)
+    del tools_dict["environments"]["custom"]
+    toolstore = tools.ToolStore("/path/to/lib", tools_dict)
+
+    load = toolstore.load("myenv").generate_stub()
+    assert "if [[ ${USE_ENV_PACK:-1} == 0 ]]; then" in load
+    assert "conda activate /path/to/lib/myenv" in load
+    assert "unpack_root=/node/local" in load
+    assert "        $unpack_dir/bin/conda-unpack" in load
+    assert "    flock -s $unpack_reader" in load
+    pack = pf.Script.generate_list_scripts([toolstore["myvenv"].pack_script])
+    assert (
+        "    venv-pack -p /path/to/lib/myvenv "
+        "-o /path/to/lib/myvenv.tar.gz.tmp "
+        "--format tar.gz --force"
+    ) in pack
+
+    assert "unpack_dir=$unpack_root/myenv.$unpack_key" in load
+
+    with pf.Suite("s1"):
+        family = tools.DeployToolsFamily(toolstore)
+    assert "USE_ENV_PACK" in [v.name for v in family.myenv.variables]
+    pack = str(family.myenv.pack.script)
+    assert "module load conda/default" in pack
+    assert "conda-pack -p /path/to/lib/myenv" in pack
+
+
+def test_snapshot_environment():
+    tools_dict = {
+        "modules": {"python3": {"version": 3.8}},
+        "env_variables": {"X": {"value": 1, "depends": "python3"}},
+        "environments": {
+            "myenv": {"type": "venv", "depends": "python3"},
+            "snap": {"type": "snapshot", "tools": ["myenv", "X"]},
+        },
+    }
+    toolstore = tools.ToolStore("/path/to/lib", tools_dict)
+    digest = toolstore["snap"].scripts["load"][0].template_values["HASH"]
+    snapshot = f"/path/to/lib/snap/{digest}.sh"
+
+    load = toolstore.load("snap").generate_stub()
+    assert f"if [[ -f {snapshot} ]]; then" in load
+    assert f"    source {snapshot}" in load
+    assert "source /path/to/lib/myenv/bin/activate" in load
+    assert load[-1] == "fi"
+
+    setup = pf.Script.generate_list_scripts(toolstore.setup("snap"))
+    assert f"snapshot=/path/to/lib/snap/{digest}.sh" in setup
+    assert "source /path/to/lib/myenv/bin/activate" in setup
+    assert "mv -f $snapshot.tmp $snapshot" in setup
+
+    tools_dict["modules"]["python3"]["version"] = 3.9
+    toolstore = tools.ToolStore("/path/to/lib", tools_dict)
+    load = toolstore.load("snap").generate_stub()
+    assert f"if [[ -f {snapshot} ]]; then" not in load
+
+
+def test_tool_store_usage():
+    tools_dict = {
+        "modules": {"python3": {"version": 3.8}, "cdo": {"version": 2}},
+        "packages": {"mypkg": {"type": "git", "source": "/path/to/src"}},
+        "environments": {
+            "myenv": {
+                "type": "venv",
+                "depends": "python3",
+                "packages": ["mypkg"],
+            },
+            "other": {"type": "venv", "depends": "python3"},
+        },
+    }
+    toolstore = tools.ToolStore("/path/to/lib", tools_dict)
+    with pf.Suite("s1"):
+        family = tools.DeployToolsFamily(toolstore)
+        toolstore.load("mypkg")
+        toolstore.load(["mypkg", "cdo"])
+        used = tools.DeployToolsFamily(toolstore, name="used", used_only=True)
+
+    assert toolstore.used_tools() == ["python3", "cdo", "mypkg", "myenv"]
+    report = toolstore.usage_report()
+    assert report.loads == {"mypkg": 2, "cdo": 1}
+    assert report.unused == ["other"]
+    assert "other: unused" in str(report)
+
+    assert "other" in family._nodes
+    assert "other" not in used._nodes
+    assert "mypkg" in used.myenv.packages._nodes
+
+    # deployment tasks do not count as uses
+    assert toolstore.usage_report().loads == {"mypkg": 2, "cdo": 1}
+
+
+def test_shared_packages():
+    wheel_pkg = {"type": "git", "source": "/path/to/src", "wheel_cache": True}
+    tools_dict = {
+        "modules": {"python3": {"version": 3.8}, "py311": {"version": 3.11}},
+        "packages": {
+            "mypkg": wheel_pkg,
+            "other": {"type": "git", "source": "/path/to/other"},
+        },
+        "environments": {
+            "env1": {
+                "type": "venv",
+                "depends": "python3",
+                "packages": ["mypkg", "other"],
+            },
+            "env2": {
+                "type": "system_venv",
+                "depends": "python3",
+                "packages": ["mypkg", "other"],
+            },
+            "env3": {
+                "type": "venv",
+                "depends": "py311",
+                "packages": ["mypkg"],
+            },
+        },
+    }
+    toolstore = tools.ToolStore("/path/to/lib", tools_dict)
+    assert toolstore.shared_packages() == {
+        ("mypkg", ("python3",)): ["env1", "env2"]
+    }
+    assert toolstore.shared_packages(["env1", "env3"]) == {}
+
+    assert toolstore["mypkg"].shares_builds
+    assert not toolstore["other"].shares_builds
+    build = pf.Script.generate_list_scripts(
+        tools.shared_wheel_script("mypkg", wheel_pkg, "/path/to/lib")
+    )
+    assert (
+        "python3 -m pip wheel --no-deps --wheel-dir $wheel_dir.tmp.$$ ."
+        in (build)
+    )
+    assert "pip install $wheel_dir/*.whl" not in build
+    assert "ecflow_client --label=version ${commit:0:12}" in build
+
+    with pf.Suite("s1"):
+        family = tools.DeployToolsFamily(toolstore)
+    shared = family.shared_packages
+    assert [task.name for task in shared.executable_children] == ["mypkg"]
+    script = str(shared.mypkg.script)
+    assert "module load python3/3.8" in script
+    assert "git clone" in script
+    assert "other" in family.env1.packages._nodes
+    assert "mypkg" in family.env3.packages._nodes
+    # the package tasks look up the wheel under the commit the build used,
+    # the peeled commit of an annotated tag
+    lookup = (
+        'commit=$(git ls-remote /path/to/src HEAD "HEAD^{}" '
+        '| awk -v ref="HEAD" \''
+    )
+    assert lookup in script
+    assert lookup in str(family.env1.packages.mypkg.script)
+
+    # the builds for each interpreter run concurrently in their own directory
+    tools_dict["environments"]["env4"] = {
+        "type": "venv",
+        "depends": "py311",
+        "packages": ["mypkg"],
+    }
+    toolstore = tools.ToolStore("/path/to/lib", tools_dict)
+    with pf.Suite("s2"):
+        family = tools.DeployToolsFamily(toolstore)
+    shared = family.shared_packages
+    assert [task.name for task in shared.executable_children] == [
+        "mypkg",
+        "mypkg_2",
+    ]
+    assert "/path/to/lib/build/shared/mypkg/mypkg" in str(shared.mypkg.script)
+    assert "/path/to/lib/build/shared/mypkg_2/mypkg" in str(
+        shared.mypkg_2.script
+    )
+
+
+def test_tool_store_dependency_errors():
+    tools_dict = {
+        "env_variables": {
+            "a": {"value": "1", "depends": "b"},
+            "b": {"value": "2", "depends": "c"},
+            "c": {"value": "3", "depends": "a"},
+            "d": {"value": "4", "depends": "missing"},
+        },
+    }
+    toolstore = tools.ToolStore("/path/to/lib", tools_dict)
+
+    with pytest.raises(WelliesConfigurationError, match="a -> b -> c -> a"):
+        toolstore.load("a")
+    with pytest.raises(WelliesConfigurationError, match="b -> c -> a -> b"):
+        toolstore.depends("b")
+    with pytest.raises(WelliesConfigurationError, match="missing"):
+        toolstore.setup("d")
+
+
 class BaseToolScriptsTest:
     lib_dir = "/path/to/lib"
 
@@ -160,6 +569,84 @@ class TestEnvToolsScripts(BaseToolScriptsTest):
 
         self._run(test_target, expected, tools_config)
 
+    def test_uv_venv(self, tools_config):
+        test_target = "myenv1"
+        options = tools_config["environments"][test_target]
+        options["installer"] = "uv"
+        options["cache_dir"] = "/path/to/uv/cache"
+        extra_pkgs = " ".join(options["extra_packages"])
+        env_dir = f"{self.lib_dir}/{test_target}"
+
+        expected = {
+            "load": [f"source {env_dir}/bin/activate"],
+            "unload": ["deactivate"],
+            "setup": [
+                f"rm -rf {env_dir}",
+                "export UV_CACHE_DIR=/path/to/uv/cache",
+                "    uv venv --seed --python $(command -v python3)  "
+                f"--system-site-packages {env_dir}",
+                f"    python3 -m venv {env_dir}  --system-site-packages",
+                f"    uv pip install {extra_pkgs}",
+                f"    pip install {extra_pkgs}",
+            ],
+        }
+
+        self._run(test_target, expected, tools_config)
+
+    def test_venv_lockfile(self, tools_config):
+        test_target = "anemoi_venv"
+        options = tools_config["environments"][test_target]
+        options["lockfile"] = "/path/to/requirements.lock"
+
+        expected = {
+            "setup": [
+                f"python3 -m venv {self.lib_dir}/{test_target}",
+                "pip install --no-deps -r /path/to/requirements.lock",
+            ],
+        }
+        self._run(test_target, expected, tools_config)
+
+        options["installer"] = "uv"
+        expected = {
+            "setup": [
+                "    uv pip sync /path/to/requirements.lock",
+                "    pip install --no-deps -r /path/to/requirements.lock",
+            ],
+        }
+        self._run(test_target, expected, tools_config)
+
+    def test_venv_precompile(self, tools_config):
+        test_target = "anemoi_venv"
+        options = tools_config["environments"][test_target]
+        options["precompile"] = {"workers": 4, "unchecked_hash": True}
+        python = f"{self.lib_dir}/{test_target}/bin/python3"
+
+        expected = {
+            "setup": [
+                f"python3 -m venv {self.lib_dir}/{test_target}",
+                'compile_options="-q -j 4"',
+                'compile_options="$compile_options -f --invalidation-mode '
+                'unchecked-hash"',
+                f'{python} -m compileall $compile_options $({python} -c "$purelib")',
+            ],
+        }
+        self._run(test_target, expected, tools_config)
+
+        options["precompile"] = {"unchecked": True}
+        with pytest.raises(WelliesConfigurationError, match="precompile"):
+            self._get_tool_parser()(name=test_target, options=options)
+
+    def test_venv_installer_errors(self, tools_config):
+        options = tools_config["environments"]["myenv1"]
+        options["installer"] = "poetry"
+        with pytest.raises(WelliesConfigurationError, match="installer"):
+            self._get_tool_parser()(name="myenv1", options=options)
+
+        options["installer"] = "uv"
+        options["lockfile"] = "/path/to/requirements.lock"
+        with pytest.raises(WelliesConfigurationError, match="lockfile"):
+            self._get_tool_parser()(name="myenv1", options=options)
+
     @pytest.mark.xfail(reason="pure venv not implemented")
     def test_rsync_venv(self, tools_config):
         test_target = "venv"
@@ -290,6 +777,38 @@ class TestEnvToolsScripts(BaseToolScriptsTest):
 
         self._run(test_target, expected, tools_config)
 
+    def test_conda_lockfile(self, tools_config):
+        test_target = "conda_pkgs"
+        options = tools_config["environments"][test_target]
+        del options["extra_packages"]
+        options["conda_cmd"] = "/path/to/bin/micromamba"
+        options["lockfile"] = "/path/to/conda-linux-64.lock"
+        build_dir = f"{self.lib_dir}/build/{test_target}"
+
+        expected = {
+            "load": [f"conda activate {self.lib_dir}/{test_target}"],
+            "setup": [
+                "scp /path/to/conda-linux-64.lock  $dest_dir/",
+                f"rm -rf {self.lib_dir}/{test_target}",
+                "/path/to/bin/micromamba create --file "
+                f"{build_dir}/conda-linux-64.lock "
+                f"-p {self.lib_dir}/{test_target}",
+            ],
+        }
+
+        self._run(test_target, expected, tools_config)
+
+    def test_conda_cmd_errors(self, tools_config):
+        options = tools_config["environments"]["conda_pkgs"]
+        options["conda_cmd"] = "pip install"
+        with pytest.raises(WelliesConfigurationError, match="conda_cmd"):
+            self._get_tool_parser()(name="conda_pkgs", options=options)
+
+        options["conda_cmd"] = "mamba"
+        options["lockfile"] = "/path/to/conda-linux-64.lock"
+        with pytest.raises(WelliesConfigurationError, match="lockfile"):
+            self._get_tool_parser()(name="conda_pkgs", options=options)
+
     def test_custom_env(self, tools_config):
         test_target = "customenv"
         expected = {
@@ -444,3 +963,123 @@ class TestPackageToolScripts(BaseToolScriptsTest):
         }
 
         self._run(test_target, expected, tools_config)
+
+    def test_package_precompile(self, tools_config):
+        test_target = "mypkg"
+        tools_config["packages"][test_target]["precompile"] = True
+
+        expected = {
+            "setup": [
+                "# Post-script",
+                'compile_options="-q -j 0"',
+                'python3 -c "$dist_dirs" mypkg \\',
+                "    | xargs -r -d '\\n' python3 -m compileall "
+                "$compile_options -l",
+            ],
+        }
+        self._run(test_target, expected, tools_config)
+
+        tools_config["packages"][test_target]["precompile"] = {
+            "distribution": "my-pkg"
+        }
+        expected["setup"][2] = 'python3 -c "$dist_dirs" my-pkg \\'
+        self._run(test_target, expected, tools_config)
+
+    def test_git_wheel_cache(self, tools_config):
+        test_target = "earthkit"
+        pkg_src = tools_config["packages"][test_target]["source"]
+        options = tools_config["packages"][test_target]
+        del options["post_script"]
+        options["wheel_cache"] = {"dir": "/path/to/wheels"}
+
+        expected = {
+            "load": None,
+            "unload": None,
+            "setup": [
+                "wheel_root=/path/to/wheels/earthkit",
+                f'commit=$(git ls-remote {pkg_src} develop "develop^{{}}" '
+                '| awk -v ref="develop" \'',
+                "if ls $wheel_dir/*.whl > /dev/null 2>&1; then",
+                "git clone $giturl --branch $gitbranch --single-branch --depth 1 $dest_dir",
+                "python3 -m pip wheel --no-deps --wheel-dir $wheel_dir.tmp.$$ .",
+                "pip install $wheel_dir/*.whl",
+                "ecflow_client --label=version ${commit:0:12}",
+            ],
+        }
+
+        self._run(test_target, expected, tools_config)
+
+    def test_wheel_cache_errors(self, tools_config):
+        options = tools_config["packages"]["earthkit"]
+        options["wheel_cache"] = True
+        with pytest.raises(WelliesConfigurationError, match="post_script"):
+            wl.tools.parse_package(self.lib_dir, "earthkit", options)
+
+        options = tools_config["packages"]["myremotepkg"]
+        options["wheel_cache"] = True
+        with pytest.raises(WelliesConfigurationError, match="git"):
+            wl.tools.parse_package(self.lib_dir, "myremotepkg", options)
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="git not found")
+def test_wheel_cache_annotated_tag(tmp_path):
+    # the cache lookup must find the commit checked out by the build, which
+    # is not the sha of an annotated tag
+    repo = tmp_path / "repo"
+    git = ["git", "-C", str(repo), "-c", "user.name=a", "-c", "user.email=a"]
+    subprocess.run(["git", "init", "-q", str(repo)], check=True)
+    commit = ["commit", "-q", "--allow-empty", "-m", "1"]
+    subprocess.run(git + commit, check=True)
+    # a branch only matching the tag by suffix, on another commit
+    subprocess.run(git + ["branch", "old/1.0"], check=True)
+    subprocess.run(git + commit, check=True)
+    subprocess.run(git + ["tag", "-a", "1.0", "-m", "1.0"], check=True)
+    subprocess.run(git + ["branch", "1.0.x"], check=True)
+    commit = subprocess.run(
+        git + ["rev-parse", "HEAD"], capture_output=True, text=True
+    ).stdout.strip()
+
+    for branch in ("1.0", "1.0.x", "HEAD"):
+        options = {"type": "git", "source": str(repo), "branch": branch}
+        values = tools._wheel_cache_values(
+            "pkg", {**options, "wheel_cache": True}
+        )
+        values["CACHE_DIR"] = str(tmp_path / "wheels")
+        head = pf.TemplateScript(scripts.wheel_cache_head_script, **values)
+        script = "\n".join(head.generate_stub()) + "\n:\nfi\necho $commit"
+        ret = subprocess.run(
+            ["bash", "-e"], input=script, capture_output=True, text=True
+        )
+        assert ret.stdout.splitlines()[-1] == commit
+
+
+def test_tool_store_preflight(tools_config):
+    tools_config["environments"]["bin"]["depends"].append("missing")
+    toolstore = tools.ToolStore("/path/to/lib", tools_config)
+
+    commands = []
+
+    def runner(cmd, timeout):
+        commands.append(cmd)
+        if "earthkit-data" in cmd:
+            raise subprocess.CalledProcessError(2, cmd, stderr="not found\n")
+        return ""
+
+    report = toolstore.preflight(runner=runner)
+
+    assert "bash -lc 'module is-avail python3/3.10.10-01'" in commands
+    assert (
+        "bash -lc 'module use /path/to/modulefiles && "
+        "module is-avail privatemodule/default'"
+    ) in commands
+    assert "ls -d /path/to/pkg/src > /dev/null" in commands
+    assert (
+        "git ls-remote --exit-code "
+        "ssh://git.ecmwf.int/cefl/condaenvs.git master"
+    ) in commands
+    assert "pypath" in report.skipped
+    assert not report.ok
+    assert [(f.name, f.error) for f in report.failures] == [
+        ("earthkit", "not found"),
+        ("bin", "unknown dependency missing"),
+    ]
@@ -43,10 +43,12 @@ from .config import parse_submit_arguments
 from .config import parse_yaml_files
 from .config import substitute_variables
 from .data import DeployDataFamily
+from .data import PrefetchDataFamily
 from .data import StaticDataStore
 from .deployment import deploy_suite
 from .hosts import EcflowServer
 from .hosts import get_host
+from .housekeeping import DataHousekeepingTask
 from .log_archiving import ArchivedRepeatFamily
 from .tasks import EcfResourcesTask
 from .tools import DeployToolsFamily
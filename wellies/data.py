@@ -1,13 +1,27 @@
+import math
 import os
+import re
+import shlex
+import subprocess
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from dataclasses import field
+from types import MappingProxyType
+from typing import Callable
 from typing import Dict
+from typing import List
 from typing import Optional
+from typing import Union
 
 import pyflow as pf
 
 from wellies import deprecated
+from wellies import housekeeping
 from wellies import mars
 from wellies import scripts
 from wellies.config import parse_yaml_files
+from wellies.exceptions import WelliesConfigurationError
 
 
 def process_file_or_string(entry):
@@ -24,7 +38,248 @@ def process_file_or_string(entry):
     return script
 
 
+def source_targets(options: dict) -> List[str]:
+    """Returns the list of source paths of a data item, joining the `source`
+    option with each entry of `files` if given."""
+    tgt = options["source"]
+    files = options.get("files")
+    if files is not None:
+        if not isinstance(files, list):
+            files = [files]
+        return [os.path.join(tgt, f) for f in files]
+    return [tgt]
+
+
+def retry_policy(options: dict) -> Optional[dict]:
+    """Returns the normalised retry policy of a data item, or None if the
+    item does not define one.
+
+    The `retry` option can be a number of retries or a mapping with keys
+    `count` (number of retries, default 3), `delay` (seconds before the first
+    retry, default 30), `backoff` (delay multiplier, default 2) and
+    `exit_codes` (exit codes worth retrying, by default all of them).
+    """
+    retry = options.get("retry")
+    if not retry:
+        return None
+    if not isinstance(retry, dict):
+        retry = {"count": retry}
+    policy = {
+        "count": int(retry.get("count", 3)),
+        "delay": int(retry.get("delay", 30)),
+        "backoff": int(retry.get("backoff", 2)),
+        "exit_codes": retry.get("exit_codes", []),
+    }
+    if not isinstance(policy["exit_codes"], list):
+        policy["exit_codes"] = [policy["exit_codes"]]
+    return policy
+
+
+def telemetry_log(data_dir: str, options: dict) -> Optional[str]:
+    """Returns the path of the JSON-lines telemetry log of a data item, or
+    None if its `telemetry` option is not set.
+
+    The option is either a boolean, logging to `.telemetry.jsonl` in the data
+    directory, or a dictionary with a `log` entry.
+    """
+    telemetry = options.get("telemetry")
+    if not telemetry:
+        return None
+    default = os.path.join(data_dir, ".telemetry.jsonl")
+    if isinstance(telemetry, dict):
+        return telemetry.get("log", default)
+    return default
+
+
+INDEX_FILTERS = {
+    "grib": r"\( -name '*.grib' -o -name '*.grib2' -o -name '*.grb' "
+    r"-o -name '*.grb2' \)",
+    "netcdf": r"\( -name '*.nc' -o -name '*.nc4' \)",
+}
+DEFAULT_GRIB_INDEX_KEYS = [
+    "shortName",
+    "level",
+    "step",
+    "dataDate",
+    "dataTime",
+]
+
+
+def index_script(
+    data_dir: str, name: str, index: Union[bool, str, dict]
+) -> pf.TemplateScript:
+    """Returns the script building the sidecar index of a data item, see
+    [wellies.indexing][].
+
+    The `index` option is either "grib", "netcdf" (or true, for grib), or a
+    dictionary with a `type` entry and optionally the `keys` to index and a
+    `pattern` selecting the files. Custom indexers are given as a `command`
+    printing one line of `keys` values per field of the file passed as
+    argument.
+    """
+    if not isinstance(index, dict):
+        index = {"type": "grib" if index is True else index}
+    itype = index.get("type", "custom" if "command" in index else "grib")
+    if itype == "grib":
+        keys = index.get("keys", DEFAULT_GRIB_INDEX_KEYS)
+        columns = keys + ["offset", "length"]
+    elif itype == "netcdf":
+        keys = columns = ["variable"]
+    elif itype == "custom":
+        if "command" not in index or "keys" not in index:
+            raise WelliesConfigurationError(
+                f"custom index of {name} needs a command and keys"
+            )
+        keys = columns = index["keys"]
+    else:
+        raise WelliesConfigurationError(
+            f"index type for {name} must be 'grib', 'netcdf' or 'custom'"
+        )
+    if "pattern" in index:
+        file_filter = f"-name '{index['pattern']}'"
+    else:
+        file_filter = INDEX_FILTERS.get(itype, "")
+    return pf.TemplateScript(
+        scripts.index_script,
+        DIR=data_dir,
+        NAME=name,
+        TYPE=itype,
+        KEYS=keys,
+        HEADER="\\t".join(columns),
+        FILTER=file_filter,
+        COMMAND=index.get("command"),
+    )
+
+
+def task_labels(data: "StaticData", **labels) -> dict:
+    """Returns the labels of a task deploying a data item, adding the
+    `telemetry` label if the item records telemetry."""
+    if data.telemetry:
+        labels["telemetry"] = "NA"
+    return labels
+
+
+# upper bound of the throughput meter, in MB/s
+THROUGHPUT_METER_MAX = 10000
+
+
+def task_meters(data: "StaticData") -> dict:
+    """Returns the meters of a task deploying a data item: the `throughput`
+    meter, in MB/s, if the item records telemetry."""
+    if data.telemetry:
+        return {"throughput": (0, THROUGHPUT_METER_MAX)}
+    return {}
+
+
+def _split_remote(path: str):
+    """Splits a `host:/path` rsync-like source into its host and path parts.
+    Host is None for local paths."""
+    match = re.match(r"^([\w.@-]+):(.*)$", path)
+    if match is None:
+        return None, path
+    return match.group(1), match.group(2)
+
+
+def _du_command(targets: List[str]) -> str:
+    hosts = {_split_remote(tgt)[0] for tgt in targets}
+    paths = " ".join(_split_remote(tgt)[1] for tgt in targets)
+    cmd = f"du -scbL {paths} | tail -n 1"
+    host = hosts.pop() if len(hosts) == 1 else None
+    if host is not None:
+        cmd = f"ssh -o BatchMode=yes {host} '{cmd}'"
+    return cmd
+
+
+def _ls_command(targets: List[str]) -> str:
+    hosts = {_split_remote(tgt)[0] for tgt in targets}
+    paths = " ".join(_split_remote(tgt)[1] for tgt in targets)
+    cmd = f"ls -d {paths} > /dev/null"
+    host = hosts.pop() if len(hosts) == 1 else None
+    if host is not None:
+        cmd = f"ssh -o BatchMode=yes {host} '{cmd}'"
+    return cmd
+
+
+def run_metadata_command(cmd: str, timeout: float = 60) -> str:
+    """Runs a metadata command on the local shell and returns its output.
+
+    Raises
+    ------
+    subprocess.CalledProcessError
+        If the command returns a non-zero exit code.
+    subprocess.TimeoutExpired
+        If the command does not finish within `timeout` seconds.
+    """
+    result = subprocess.run(
+        cmd,
+        shell=True,
+        capture_output=True,
+        text=True,
+        timeout=timeout,
+        check=True,
+    )
+    return result.stdout
+
+
+def deployed_stamp(data_dir: str, name: str) -> str:
+    """Returns the path of the file stamping each deployment of an item, next
+    to the item, read by the jobs staging it."""
+    return os.path.join(data_dir, f".{name}.deployed")
+
+
+def dedup_options(
+    data_dir: str, name: str, options: dict, moves_data: bool = True
+) -> Optional[dict]:
+    """Returns the values of the deduplication scripts of an item, or None if
+    the item does not have the `dedup` option.
+
+    Raises
+    ------
+    WelliesConfigurationError
+        If the item does not hold a copy of the data or the mode is invalid.
+    """
+    dedup = options.get("dedup")
+    if not dedup:
+        return None
+    if not moves_data:
+        raise WelliesConfigurationError(
+            f"dedup option not supported for {name}: "
+            "item does not hold a copy of the data"
+        )
+    if not isinstance(dedup, dict):
+        dedup = {}
+    if dedup.get("mode", "hardlink") not in ("hardlink", "reflink"):
+        raise WelliesConfigurationError(
+            f"dedup mode for {name} must be 'hardlink' or 'reflink'"
+        )
+    return dict(
+        DIR=data_dir,
+        NAME=name,
+        STORE=dedup.get("store", os.path.join(data_dir, ".store")),
+        MODE=dedup.get("mode", "hardlink"),
+    )
+
+
+def error_message(err: Exception) -> str:
+    """Returns the last line of an error message, or the type of the error
+    if its message is empty."""
+    lines = str(err).strip().splitlines()
+    return lines[-1] if lines else type(err).__name__
+
+
+def rsync_in_place(options: dict) -> bool:
+    """Whether the rsync options of an item update the files in place,
+    instead of writing new files renamed over the old ones."""
+    rsync_options = options.get("rsync_options", "")
+    return "--inplace" in rsync_options or "--append" in rsync_options
+
+
 class StaticData:
+    moves_data = True
+    # whether retrieving the item again may write into the files of the
+    # previous deployment, instead of removing or replacing them
+    writes_in_place = True
+
     def __init__(self, data_dir: str, name: str, script: str, options: dict):
         self.name = name
         self.options = options
@@ -33,6 +288,33 @@ class StaticData:
         post_script = process_file_or_string(options.get("post_script", None))
 
         script_list = []
+        retry = retry_policy(options)
+        if retry is not None:
+            script_list.extend(
+                [
+                    "# Retry policy for transfers",
+                    pf.TemplateScript(
+                        scripts.retry_function,
+                        COUNT=retry["count"],
+                        DELAY=retry["delay"],
+                        BACKOFF=retry["backoff"],
+                        EXIT_CODES=retry["exit_codes"],
+                    ),
+                    "",
+                ]
+            )
+
+        dedup = dedup_options(data_dir, name, options, self.moves_data)
+        in_place = self.writes_in_place or pre_script or post_script
+        if dedup and in_place:
+            script_list.extend(
+                [
+                    "# Copy the files shared with the content-hash store",
+                    pf.TemplateScript(scripts.dedup_unlink_script, **dedup),
+                    "",
+                ]
+            )
+
         if pre_script:
             script_list.extend(
                 [
@@ -42,6 +324,12 @@ class StaticData:
                 ]
             )
 
+        self.telemetry = telemetry_log(data_dir, options)
+        if self.telemetry:
+            script_list.append(
+                pf.TemplateScript(scripts.telemetry_start_script, DIR=data_dir)
+            )
+
         script_list.extend(
             [
                 "# Main script for retrieving data",
@@ -49,6 +337,25 @@ class StaticData:
                 script,
             ]
         )
+        if self.telemetry:
+            source = options.get("source", options.get("type", "custom"))
+            if isinstance(source, list):
+                source = source[0]
+            script_list.extend(
+                [
+                    "# Record transfer telemetry",
+                    pf.TemplateScript(
+                        scripts.telemetry_script,
+                        DIR=data_dir,
+                        NAME=name,
+                        TYPE=options.get("type", "custom"),
+                        SOURCE=source,
+                        LOG=self.telemetry,
+                        METER_MAX=THROUGHPUT_METER_MAX,
+                    ),
+                    "",
+                ]
+            )
         if post_script:
             script_list.extend(
                 [
@@ -58,8 +365,45 @@ class StaticData:
                 ]
             )
 
+        index = options.get("index")
+        if index:
+            if not self.moves_data:
+                raise WelliesConfigurationError(
+                    f"index option not supported for {name}: "
+                    "item does not hold a copy of the data"
+                )
+            script_list.extend(
+                [
+                    "# Index the fields of the data files",
+                    index_script(data_dir, name, index),
+                    "",
+                ]
+            )
+
+        if dedup:
+            script_list.extend(
+                [
+                    "# Deduplicate files against the content-hash store",
+                    pf.TemplateScript(scripts.dedup_script, **dedup),
+                ]
+            )
+
         self.script = pf.Script(script_list)
 
+    def size_command(self) -> Optional[str]:
+        """Returns a cheap metadata command printing the number of bytes the
+        item will transfer, or None if it can not be known in advance."""
+        return None
+
+    def parse_size(self, output: str) -> int:
+        """Parses the output of `size_command` into a number of bytes."""
+        return int(output.strip().splitlines()[-1].split()[0])
+
+    def check_command(self) -> Optional[str]:
+        """Returns a cheap metadata command failing if the source of the item
+        does not exist, or None if it can not be checked in advance."""
+        return None
+
 
 class CustomData(StaticData):
     def __init__(self, data_dir, name, options):
@@ -69,15 +413,8 @@ class CustomData(StaticData):
 
 class RsyncData(StaticData):
     def __init__(self, data_dir, name, options):
-        tgt = options["source"]
-        files = options.get("files")
-        if files is not None:
-            if not isinstance(files, list):
-                files = [files]
-            files = [os.path.join(tgt, f) for f in files]
-            tgt = files
-        else:
-            tgt = [tgt]
+        tgt = source_targets(options)
+        self.writes_in_place = rsync_in_place(options)
 
         script = pf.TemplateScript(
             scripts.rsync_script,
@@ -85,35 +422,46 @@ class RsyncData(StaticData):
             NAME=name,
             TARGET=tgt,
             RSYNC_OPTIONS=options.get("rsync_options", "-avzpL"),
+            RETRY=retry_policy(options) is not None,
         )
         super().__init__(data_dir, name, script, options)
 
+    def size_command(self):
+        return _du_command(source_targets(self.options))
+
+    def check_command(self):
+        return _ls_command(source_targets(self.options))
+
 
 class CopyData(StaticData):
+    writes_in_place = False
+
     def __init__(self, data_dir, name, options):
-        tgt = options["source"]
-        files = options.get("files")
-        if files is not None:
-            if not isinstance(files, list):
-                files = [files]
-            files = [os.path.join(tgt, f) for f in files]
-            tgt = files
-        else:
-            tgt = [tgt]
+        tgt = source_targets(options)
 
         script = pf.TemplateScript(
             scripts.copy_script,
             DIR=data_dir,
             NAME=name,
             TARGET=tgt,
+            RETRY=retry_policy(options) is not None,
         )
         super().__init__(data_dir, name, script, options)
 
+    def size_command(self):
+        return _du_command(source_targets(self.options))
+
+    def check_command(self):
+        return _ls_command(source_targets(self.options))
+
 
 class GitData(StaticData):
     def __init__(self, data_dir, name, options):
         files = options.get("files")
         build_dir = options.get("build_dir")
+        retry = retry_policy(options) is not None
+        # git checkouts replace the files, rsync may update them in place
+        self.writes_in_place = files is not None and rsync_in_place(options)
         if files is None:
             target = data_dir if build_dir is None else build_dir
             script = pf.TemplateScript(
@@ -122,6 +470,7 @@ class GitData(StaticData):
                 NAME=name,
                 URL=options["source"],
                 BRANCH=options.get("branch"),
+                RETRY=retry,
             )
         else:
             if build_dir is None:
@@ -136,6 +485,7 @@ class GitData(StaticData):
                     NAME=name,
                     URL=options["source"],
                     BRANCH=options.get("branch"),
+                    RETRY=retry,
                 ),
                 pf.TemplateScript(
                     scripts.rsync_script,
@@ -143,6 +493,7 @@ class GitData(StaticData):
                     NAME=name,
                     TARGET=files,
                     RSYNC_OPTIONS=options.get("rsync_options", "-avzpL"),
+                    RETRY=retry,
                 ),
                 "echo 'cleaning build directory'",
                 f"rm -rf {build_dir}/{name}",
@@ -150,30 +501,38 @@ class GitData(StaticData):
 
         super().__init__(data_dir, name, script, options)
 
+    def check_command(self):
+        ref = self.options.get("branch") or "HEAD"
+        return f"git ls-remote --exit-code {self.options['source']} {ref}"
+
 
 class ECFSData(StaticData):
-    def __init__(self, data_dir, name, options):
-        tgt = options["source"]
+    writes_in_place = False
 
-        files = options.get("files")
-        if files is not None:
-            if not isinstance(files, list):
-                files = [files]
-            files = [os.path.join(tgt, f) for f in files]
-            tgt = files
-        else:
-            tgt = [tgt]
+    def __init__(self, data_dir, name, options):
+        tgt = source_targets(options)
 
         script = pf.TemplateScript(
             scripts.ecfs_script,
             DIR=data_dir,
             NAME=name,
             TARGET=tgt,
+            RETRY=retry_policy(options) is not None,
         )
         super().__init__(data_dir, name, script, options)
 
+    def size_command(self):
+        paths = " ".join(source_targets(self.options))
+        return f"els -l {paths} | awk '{{s+=$5}} END {{print s+0}}'"
+
+    def check_command(self):
+        paths = " ".join(source_targets(self.options))
+        return f"els {paths} > /dev/null"
+
 
 class LinkData(StaticData):
+    moves_data = False
+
     def __init__(self, data_dir, name, options):
         script = pf.TemplateScript(
             scripts.link_script,
@@ -183,6 +542,12 @@ class LinkData(StaticData):
         )
         super().__init__(data_dir, name, script, options)
 
+    def check_command(self):
+        return _ls_command([self.options["source"]])
+
+
+DEFAULT_MARS_CACHE = "${XDG_CACHE_HOME:-$HOME/.cache}/wellies/mars"
+
 
 class MarsData(StaticData):
     def __init__(self, data_dir, name, options):
@@ -190,10 +555,64 @@ class MarsData(StaticData):
             f"dest_dir={os.path.join(data_dir, name)}",
             "mkdir -p $dest_dir",
             "cd $dest_dir",
-            mars.Retrieve(options["request"]),
         ]
+        cache = options.get("cache")
+        if cache:
+            if not isinstance(cache, dict):
+                cache = {}
+            command = "mars" if retry_policy(options) is None else "retry mars"
+            try:
+                script.append(
+                    mars.CachedRetrieve(
+                        options["request"],
+                        cache.get("dir", DEFAULT_MARS_CACHE),
+                        max_size=housekeeping.parse_size(
+                            cache.get("max_size", mars.DEFAULT_CACHE_SIZE)
+                        ),
+                        command=command,
+                    )
+                )
+            except ValueError as err:
+                raise WelliesConfigurationError(
+                    f"Invalid cache option for {name}: {err}"
+                )
+        elif retry_policy(options) is None:
+            script.append(mars.Retrieve(options["request"]))
+        else:
+            # requests are written to a file as a here-document can only be
+            # read once, and reruns skip retrievals that already completed
+            script.extend(
+                [
+                    "if [[ ${ECF_TRYNO:-1} -eq 1 ]]; then "
+                    "rm -f .retrieved; fi",
+                    "if [[ ! -f .retrieved ]]; then",
+                    mars.Retrieve(
+                        options["request"], command="cat > request.mars"
+                    ),
+                    "retry mars request.mars",
+                    "touch .retrieved",
+                    "fi",
+                ]
+            )
         super().__init__(data_dir, name, script, options)
 
+    def size_command(self):
+        request = {
+            k: v
+            for k, v in self.options["request"].items()
+            if k.lower() != "target"
+        }
+        return str(mars.List(request, output="cost"))
+
+    def parse_size(self, output):
+        match = re.search(r"Total\s*:\s*([\d,]+)", output)
+        if match is None:
+            raise ValueError(f"Could not find MARS cost in output: {output}")
+        return int(match.group(1).replace(",", ""))
+
+    def check_command(self):
+        return self.size_command()
+
 
 @deprecated(
     "Use parse_data_item instead. This function will be removed in a future releases."  # noqa: E501
@@ -202,34 +621,203 @@ def parse_static_data_item(data_dir, name, options):
     return parse_data_item(data_dir, name, options)
 
 
+DATA_TYPES = {
+    "rsync": RsyncData,
+    "copy": CopyData,
+    "git": GitData,
+    "ecfs": ECFSData,
+    "link": LinkData,
+    "mars": MarsData,
+    "custom": CustomData,
+}
+
+
 def parse_data_item(data_dir, name, options):
     type = options["type"]
-    if type == "rsync":
-        data = RsyncData(data_dir, name, options)
-    elif type == "copy":
-        data = CopyData(data_dir, name, options)
-    elif type == "git":
-        data = GitData(data_dir, name, options)
-    elif type == "ecfs":
-        data = ECFSData(data_dir, name, options)
-    elif type == "link":
-        data = LinkData(data_dir, name, options)
-    elif type == "mars":
-        data = MarsData(data_dir, name, options)
-    elif type == "custom":
-        data = CustomData(data_dir, name, options)
-    else:
+    if type not in DATA_TYPES:
         raise Exception(f"Static data type {type} not supported")
-    return data
+    return DATA_TYPES[type](data_dir, name, options)
+
+
+# Rough sustained throughput (bytes/s) and fixed latency (s) per data type,
+# used to turn transfer volumes into time estimates.
+DEFAULT_BANDWIDTH = {
+    "rsync": 50e6,
+    "copy": 50e6,
+    "ecfs": 20e6,
+    "mars": 10e6,
+    "git": 10e6,
+}
+DEFAULT_OVERHEAD = {
+    "ecfs": 60,
+    "mars": 120,
+}
+
+
+def _walltime(seconds: float) -> str:
+    seconds = int(math.ceil(seconds))
+    return "{:02d}:{:02d}:{:02d}".format(
+        seconds // 3600, (seconds % 3600) // 60, seconds % 60
+    )
+
 
+@dataclass
+class DataItemPlan:
+    """Estimated cost of deploying one static data item."""
 
-class StaticDataStore:
+    name: str
+    type: str
+    bytes: Optional[int] = None
+    seconds: Optional[float] = None
+    submit_arguments: dict = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+@dataclass
+class DataDeploymentPlan:
+    """Estimated cost of deploying a whole [wellies.StaticDataStore][]."""
+
+    items: List[DataItemPlan]
+    parallelism: int = 1
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(it.bytes for it in self.items if it.bytes)
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(it.seconds for it in self.items if it.seconds)
+
+    @property
+    def unknown(self) -> List[str]:
+        return [it.name for it in self.items if it.bytes is None]
+
+    def __str__(self) -> str:
+        lines = [f"{'item':<30} {'type':<8} {'size (MB)':>12} {'time':>10}"]
+        for it in self.items:
+            size = "?" if it.bytes is None else f"{it.bytes / 1e6:.1f}"
+            time = "?" if it.seconds is None else _walltime(it.seconds)
+            line = f"{it.name:<30} {it.type:<8} {size:>12} {time:>10}"
+            if it.error:
+                line += f"  ({it.error})"
+            lines.append(line)
+        lines.append(
+            f"{'total':<39} {self.total_bytes / 1e6:>12.1f} "
+            f"{_walltime(self.total_seconds):>10}"
+        )
+        lines.append(f"suggested parallelism: {self.parallelism}")
+        return "\n".join(lines)
+
+
+@dataclass
+class PreflightFailure:
+    """A source that failed its pre-flight check."""
+
+    name: str
+    command: str
+    error: str
+
+
+@dataclass
+class PreflightReport:
+    """Outcome of the pre-flight checks of a store."""
+
+    checked: List[str] = field(default_factory=list)
+    skipped: List[str] = field(default_factory=list)
+    failures: List[PreflightFailure] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.failures
+
+    def __str__(self) -> str:
+        lines = [
+            f"{len(self.checked)} checked, {len(self.skipped)} skipped, "
+            f"{len(self.failures)} failed"
+        ]
+        for failure in self.failures:
+            lines.append(f"{failure.name}: {failure.error}")
+            if failure.command:
+                lines.append(f"    {failure.command}")
+        return "\n".join(lines)
+
+
+def run_preflight(
+    checks: Dict[str, Optional[str]],
+    max_workers: int = 8,
+    timeout: float = 60,
+    runner: Optional[Callable[[str, float], str]] = None,
+    host: Optional[str] = None,
+) -> PreflightReport:
+    """Runs check commands concurrently and collects their failures.
+
+    Parameters
+    ----------
+    checks : dict
+        Mapping of names to the command checking them, None if they can not
+        be checked.
+    max_workers : int, optional
+        Maximum number of commands running at the same time, by default 8.
+    timeout : float, optional
+        Timeout in seconds for each command, by default 60.
+    runner : callable, optional
+        Function running a command, raising an exception if it fails,
+        by default [wellies.data.run_metadata_command][].
+    host : str, optional
+        Host the commands are run on through `ssh`, by default None to run
+        them on the local host.
+
+    Returns
+    -------
+    PreflightReport
+        The checked and skipped names and all the failures.
+    """
+    runner = runner or run_metadata_command
+    report = PreflightReport()
+
+    def check(cmd):
+        if host is not None:
+            cmd = f"ssh -o BatchMode=yes {host} {shlex.quote(cmd)}"
+        try:
+            runner(cmd, timeout)
+        except subprocess.CalledProcessError as err:
+            output = (err.stderr or err.stdout or "").strip()
+            if output:
+                return output.splitlines()[-1]
+            return f"exit code {err.returncode}"
+        except subprocess.TimeoutExpired:
+            return f"timed out after {timeout}s"
+        except Exception as err:
+            return error_message(err)
+        return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for name, cmd in checks.items():
+            if cmd is None:
+                report.skipped.append(name)
+            else:
+                report.checked.append(name)
+                futures[name] = (cmd, executor.submit(check, cmd))
+        for name, (cmd, future) in futures.items():
+            error = future.result()
+            if error is not None:
+                report.failures.append(PreflightFailure(name, cmd, error))
+    return report
+
+
+class StaticDataStore(Mapping):
     def __init__(self, data_dir: str, static_data_dict: dict):
         """
         The StaticDataStore contains a set of static data items and their
         associated scripts to be used to deploy the items when running the
         suite.
 
+        Items are built on first access and then reused, so that inspecting
+        a store, or using a few of its items, does not build the scripts of
+        all of them. `options` gives access to the configuration of the items
+        without building them.
+
         Parameters
         ----------
         data_dir (str):
@@ -238,20 +826,215 @@ class StaticDataStore:
             A dictionary containing the names of the static data items as
             keys and their deployment options as values.
         """
-        self.static_data = {}
-        for name, options in static_data_dict.items():
-            data = parse_data_item(data_dir, name, options)
-            self.static_data[name] = data
+        self.dir = data_dir
+        self.options = dict(static_data_dict)
+        self._items = {}
+        for name, options in self.options.items():
+            if options["type"] not in DATA_TYPES:
+                raise Exception(
+                    f"Static data type {options['type']} not supported"
+                )
 
     def __getitem__(self, item):
-        return self.static_data[item]
+        if item not in self._items:
+            self._items[item] = parse_data_item(
+                self.dir, item, self.options[item]
+            )
+        return self._items[item]
+
+    def __iter__(self):
+        return iter(self.options)
+
+    def __len__(self):
+        return len(self.options)
+
+    def __contains__(self, item):
+        return item in self.options
 
     def __repr__(self) -> str:
-        items = str({name: it.options for name, it in self.items()})
-        return f"StaticDataStore: {items}"
+        return f"StaticDataStore: {self.options}"
+
+    @property
+    def static_data(self) -> Mapping:
+        """All the items of the store, building the ones not built yet. The
+        mapping is read-only: items are added by creating a new store."""
+        return MappingProxyType(dict(self.items()))
+
+    def stage(
+        self,
+        names: Union[List[str], str],
+        cache_dir: str = "${SSDTMP:-${TMPDIR:-/tmp}}/wellies_data",
+        variable: str = "STAGED_DATA_DIR",
+    ) -> list:
+        """
+        Returns a script staging data items into node-local storage, to be
+        used in tasks the same way as [wellies.ToolStore.load][].
+
+        The cache is shared by all the jobs running on a node: each item is
+        copied once, under a lock, and later jobs reuse it. A new copy is
+        staged after each deployment of the item by
+        [wellies.DeployDataFamily][], as told by the stamp file the deploy
+        task writes next to the item, and the previous copies are removed
+        once no running job has staged them. Once staged, the items are
+        available in `${variable}/<name>`, a directory of links to the copies
+        staged by the job, which stay in place until the job exits.
+
+        Parameters
+        ----------
+        names : str or list of str
+            The items to stage.
+        cache_dir : str, optional
+            The node-local cache directory, by default under `$SSDTMP` or
+            `$TMPDIR`.
+        variable : str, optional
+            The variable exported with the directory of the staged items, by
+            default "STAGED_DATA_DIR".
+
+        Returns
+        -------
+        list : a list of scripts to stage the items
+        """
+        if not isinstance(names, list):
+            names = [names]
+        items = []
+        for name in names:
+            if name not in self:
+                raise WelliesConfigurationError(
+                    f"Can not stage {name}: not in the static data store"
+                )
+            data = self[name]
+            items.append(
+                (
+                    name,
+                    os.path.join(data.dir, name),
+                    deployed_stamp(data.dir, name),
+                )
+            )
+        return [
+            "# stage static data into node-local storage",
+            pf.TemplateScript(
+                scripts.stage_script,
+                CACHE_DIR=cache_dir,
+                ITEMS=items,
+                VARIABLE=variable,
+            ),
+        ]
+
+    def plan(
+        self,
+        bandwidth: Optional[Dict[str, float]] = None,
+        overhead: Optional[Dict[str, float]] = None,
+        max_parallel: int = 8,
+        timeout: float = 60,
+        runner: Optional[Callable[[str, float], str]] = None,
+    ) -> DataDeploymentPlan:
+        """Estimates the volume and time needed to deploy every item of the
+        store, without transferring any data.
+
+        Sizes are gathered with cheap metadata calls (`du` for rsync and copy
+        sources, `els` for ECFS and `mars list` for MARS requests). Items
+        whose size can not be known in advance (git, custom) are reported
+        with unknown size.
+
+        Parameters
+        ----------
+        bandwidth : dict, optional
+            Throughput in bytes per second per data type, updating
+            `DEFAULT_BANDWIDTH`.
+        overhead : dict, optional
+            Fixed latency in seconds per data type, updating
+            `DEFAULT_OVERHEAD`.
+        max_parallel : int, optional
+            Upper bound for the suggested number of concurrent tasks,
+            by default 8.
+        timeout : float, optional
+            Timeout in seconds for each metadata call, by default 60.
+        runner : callable, optional
+            Function running a metadata command and returning its output,
+            by default [wellies.data.run_metadata_command][].
+
+        Returns
+        -------
+        DataDeploymentPlan
+            The estimated size, time and suggested `submit_arguments` of each
+            item along with a suggested parallelism.
+        """
+        bandwidth = {**DEFAULT_BANDWIDTH, **(bandwidth or {})}
+        overhead = {**DEFAULT_OVERHEAD, **(overhead or {})}
+        runner = runner or run_metadata_command
+
+        items = []
+        for name, data in self.items():
+            dtype = data.options.get("type", "custom")
+            item = DataItemPlan(name, dtype)
+            if not data.moves_data:
+                item.bytes = 0
+            else:
+                cmd = data.size_command()
+                if cmd is not None:
+                    try:
+                        item.bytes = data.parse_size(runner(cmd, timeout))
+                    except Exception as err:
+                        item.error = error_message(err)
+            if item.bytes is not None:
+                item.seconds = overhead.get(dtype, 5)
+                if item.bytes and dtype in bandwidth:
+                    item.seconds += item.bytes / bandwidth[dtype]
+                item.submit_arguments = {
+                    "time": _walltime(max(600, 2 * item.seconds))
+                }
+            items.append(item)
+
+        plan = DataDeploymentPlan(items)
+        longest = max((it.seconds or 0 for it in items), default=0)
+        if longest > 0:
+            plan.parallelism = max(
+                1,
+                min(
+                    max_parallel,
+                    len(items),
+                    math.ceil(plan.total_seconds / longest),
+                ),
+            )
+        return plan
+
+    def preflight(
+        self,
+        max_workers: int = 8,
+        timeout: float = 60,
+        runner: Optional[Callable[[str, float], str]] = None,
+        host: Optional[str] = None,
+    ) -> PreflightReport:
+        """Checks that the source of every item exists before the suite is
+        deployed, with cheap metadata calls run in parallel (`ls` for rsync,
+        copy and link sources, through `ssh` for `host:/path` sources, `els`
+        for ECFS, `git ls-remote` for git branches and `mars list` for MARS
+        requests). Custom items are skipped.
 
-    def items(self):
-        return self.static_data.items()
+        The checks run on the host generating the suite unless `host` is
+        given. Paths local to the host running the deploy tasks, and its
+        credentials for ECFS, git or MARS, are only checked through `host`.
+
+        Parameters
+        ----------
+        max_workers : int, optional
+            Maximum number of checks running at the same time, by default 8.
+        timeout : float, optional
+            Timeout in seconds for each check, by default 60.
+        runner : callable, optional
+            Function running a check command, by default
+            [wellies.data.run_metadata_command][].
+        host : str, optional
+            Host running the deploy tasks, on which the checks are run
+            through `ssh`, by default None to run them locally.
+
+        Returns
+        -------
+        PreflightReport
+            All the failed checks.
+        """
+        checks = {name: data.check_command() for name, data in self.items()}
+        return run_preflight(checks, max_workers, timeout, runner, host)
 
     @classmethod
     def from_yamls(cls, config_files: list, data_dir=None):
@@ -272,6 +1055,12 @@ class DeployDataFamily(pf.AnchorFamily):
         data_store: StaticDataStore,
         submit_arguments: Optional[Dict] = None,
         name: str = "deploy_data",
+        targets: Optional[Union[List[str], Dict[str, str]]] = None,
+        fanout: int = 2,
+        batch: bool = False,
+        batch_threshold: Optional[int] = None,
+        batch_parallel: int = 8,
+        batch_probe: bool = False,
         **kwargs,
     ):
         """Defines "static_data" family contaning all tasks needed to deploy
@@ -285,23 +1074,325 @@ class DeployDataFamily(pf.AnchorFamily):
         submit_arguments : dict, optional
             An saubmit argument mapping to configure each task submit
             arguments, by default None
+        targets : list or dict, optional
+            Secondary hosts the data is distributed to once deployed on the
+            running host. Either a list of host names, the data being copied
+            to the same directory, or a mapping of host names to their data
+            directory. By default None, no distribution.
+        fanout : int, optional
+            Number of hosts each host distributes the data to, by default 2.
+        batch : bool, optional
+            Whether to deploy cheap items concurrently in a single "batch"
+            task instead of one task each, by default False. Cheap items are
+            the ones not moving any data, such as links, the ones with the
+            `batch: true` option and the ones whose `size` option is below
+            `batch_threshold`. Items with their own `submit_arguments` or
+            with `batch: false` are never batched.
+        batch_threshold : int, optional
+            Size in bytes under which an item is considered cheap. By default
+            None, only items not moving any data or with `batch: true` are
+            batched.
+        batch_parallel : int, optional
+            Maximum number of items deployed at the same time in the batch
+            task, by default 8.
+        batch_probe : bool, optional
+            Whether to estimate the size of the items without a `size` option
+            with [wellies.StaticDataStore.plan][], by default False. The
+            estimate runs metadata commands on the host generating the
+            suite, so it needs access to the data sources.
         """
         super().__init__(name=name, **kwargs)
 
         if submit_arguments is None:
             submit_arguments = {}
 
+        batched = {}
+        if batch:
+            batched = self.batched_items(
+                data_store, batch_threshold, batch_probe
+            )
+
         with self:
-            has_tasks = False
+            deploy_tasks = []
             for dataset, data in data_store.items():
-                has_tasks = True
-                pf.Task(
-                    name=dataset,
-                    submit_arguments=data.options.get(
-                        "submit_arguments", submit_arguments
-                    ),
-                    script=data.script,
-                    labels={"version": "NA"},
+                if dataset not in batched:
+                    deploy_tasks.append(
+                        self.deploy_task(dataset, data, submit_arguments)
+                    )
+            if batched:
+                deploy_tasks.append(
+                    self.batch_task(batched, submit_arguments, batch_parallel)
                 )
-            if not has_tasks:
+            if not deploy_tasks:
                 self.defstatus = pf.state.complete
+            elif targets:
+                self.distribute_family(
+                    data_store, targets, fanout, submit_arguments, deploy_tasks
+                )
+
+    def deploy_task(
+        self, name: str, data: StaticData, submit_arguments: Dict
+    ) -> pf.Task:
+        """Creates the task deploying one data item of the store."""
+        return pf.Task(
+            name=name,
+            submit_arguments=data.options.get(
+                "submit_arguments", submit_arguments
+            ),
+            script=[data.script, self.stamp_script(name, data)],
+            labels=task_labels(data, version="NA"),
+            meters=task_meters(data),
+        )
+
+    def stamp_script(self, name: str, data: StaticData) -> pf.TemplateScript:
+        """Creates the script stamping the deployment of an item, for the
+        jobs staging it, see [wellies.StaticDataStore.stage][]."""
+        return pf.TemplateScript(
+            scripts.deployed_stamp_script,
+            STAMP=deployed_stamp(data.dir, name),
+        )
+
+    def batched_items(
+        self,
+        data_store: StaticDataStore,
+        threshold: Optional[int],
+        probe: bool = False,
+    ) -> Dict[str, StaticData]:
+        """Selects the cheap items of the store to deploy in a single task.
+        Nothing is batched if there are less than two cheap items."""
+        sizes = {}
+        for name, data in data_store.items():
+            if "size" in data.options:
+                sizes[name] = housekeeping.parse_size(data.options["size"])
+        if probe and threshold is not None:
+            for item in data_store.plan().items:
+                sizes.setdefault(item.name, item.bytes)
+        batched = {}
+        for name, data in data_store.items():
+            choice = data.options.get("batch")
+            if "submit_arguments" in data.options or choice is False:
+                continue
+            size = 0 if not data.moves_data or choice else sizes.get(name)
+            if size is not None and size <= (threshold or 0):
+                batched[name] = data
+        return batched if len(batched) > 1 else {}
+
+    def batch_task(
+        self,
+        items: Dict[str, StaticData],
+        submit_arguments: Dict,
+        parallel: int,
+    ) -> pf.Task:
+        """Creates the task deploying several items concurrently, each in a
+        background subshell. The status of each item is reported in a label
+        named after it, and the task fails if any item failed."""
+        script = [
+            pf.TemplateScript(scripts.batch_head_script, PARALLEL=parallel)
+        ]
+        labels = {"version": "NA"}
+        meters = {}
+        for name, data in items.items():
+            label = re.sub(r"\W", "_", name)
+            labels[label] = "NA"
+            labels.update(task_labels(data))
+            meters.update(task_meters(data))
+            script.extend(
+                [
+                    pf.TemplateScript(
+                        scripts.batch_item_start_script, LABEL=label
+                    ),
+                    data.script,
+                    self.stamp_script(name, data),
+                    pf.TemplateScript(
+                        scripts.batch_item_end_script, NAME=name, LABEL=label
+                    ),
+                ]
+            )
+        script.append(scripts.batch_tail_script)
+        return pf.Task(
+            name="batch",
+            submit_arguments=submit_arguments,
+            script=script,
+            labels=labels,
+            meters=meters,
+        )
+
+    def distribute_family(
+        self,
+        data_store: StaticDataStore,
+        targets: Union[List[str], Dict[str, str]],
+        fanout: int,
+        submit_arguments: Dict,
+        deploy_tasks: List[pf.Task],
+    ) -> pf.Family:
+        """Creates the family distributing the deployed data to secondary
+        hosts.
+
+        Hosts are arranged in a tree rooted on the running host, each host
+        pushing the data with rsync to at most `fanout` hosts once it has
+        received it. Each task runs on the source host, by setting its
+        `SCHOST` variable, and reuses a single ssh connection for all the
+        items.
+        """
+        if fanout < 1:
+            raise ValueError("fanout must be at least 1")
+        if not isinstance(targets, dict):
+            targets = {host: None for host in targets}
+        items = [(name, data.dir) for name, data in data_store.items()]
+        hosts = [None] + list(targets)
+        tasks = {}
+        trigger = deploy_tasks[0].complete
+        for task in deploy_tasks[1:]:
+            trigger = trigger & task.complete
+        with pf.Family("distribute", triggers=trigger) as family:
+            for index, host in enumerate(hosts[1:], start=1):
+                source = hosts[(index - 1) // fanout]
+                variables = {}
+                if source is not None:
+                    variables["SCHOST"] = source
+                task = pf.Task(
+                    name=re.sub(r"\W", "_", host),
+                    submit_arguments=submit_arguments,
+                    script=pf.TemplateScript(
+                        scripts.fanout_script,
+                        TARGET=host,
+                        ITEMS=[
+                            (
+                                name,
+                                targets.get(source) or data_dir,
+                                targets[host] or data_dir,
+                            )
+                            for name, data_dir in items
+                        ],
+                    ),
+                    variables=variables,
+                    labels={"item": "NA"},
+                )
+                if source is not None:
+                    task.triggers = tasks[source].complete
+                tasks[host] = task
+        return family
+
+
+class PrefetchDataFamily(DeployDataFamily):
+    def __init__(
+        self,
+        static_data: dict,
+        prefetch_dir: str = "$DATA_DIR/prefetch",
+        lookahead: int = 1,
+        step: int = 1,
+        ymd: str = "YMD",
+        submit_arguments: Optional[Dict] = None,
+        name: str = "prefetch_data",
+        **kwargs,
+    ):
+        """Family fetching the time-dependent inputs of the next cycles while
+        the current cycle is running, taking data latency off the critical
+        path of the suite.
+
+        It is meant to be placed inside a repeated family, next to the tasks
+        consuming the data. Each task fetches one item for the dates `ymd`,
+        `ymd + step`, ..., `ymd + lookahead * step` into
+        `prefetch_dir/<date>/<name>`, skipping the dates already prefetched
+        on a previous cycle. The current cycle is only fetched on the first
+        cycle of the suite, or if its prefetch failed. Each task sets its
+        `ready` event as soon as the data of the current cycle is available,
+        see [wellies.PrefetchDataFamily.ready][]. Items should refer to their
+        date with the `$PREFETCH_YMD` shell variable, for instance in a MARS
+        request. A `clean` task removes the prefetched data of past dates.
+
+        Parameters
+        ----------
+        static_data : dict
+            A dictionary with the names of the data items as keys and their
+            deployment options as values, as for [wellies.StaticDataStore][].
+        prefetch_dir : str, optional
+            Root directory of the prefetched data, by default
+            "$DATA_DIR/prefetch".
+        lookahead : int, optional
+            Number of cycles to fetch ahead, by default 1.
+        step : int, optional
+            Number of days between two cycles, by default 1.
+        ymd : str, optional
+            Name of the repeat variable holding the current cycle date,
+            by default "YMD".
+        submit_arguments : dict, optional
+            A submit argument mapping to configure each task submit
+            arguments, by default None
+
+        Raises
+        ------
+        ValueError
+            If lookahead is lower than 1, or if `targets` or `batch` are
+            given: distributed and batched items would not be fetched for
+            the prefetched dates.
+        """
+        if lookahead < 1:
+            raise ValueError("lookahead must be at least 1")
+        for option in ("targets", "batch"):
+            if kwargs.get(option):
+                raise ValueError(
+                    f"{option} option not supported by PrefetchDataFamily"
+                )
+        self.prefetch_dir = prefetch_dir
+        self.lookahead = lookahead
+        self.step = step
+        self.ymd = ymd
+        data_store = StaticDataStore(
+            os.path.join(prefetch_dir, "$PREFETCH_YMD"), static_data
+        )
+        super().__init__(
+            data_store,
+            submit_arguments=submit_arguments,
+            name=name,
+            **kwargs,
+        )
+        with self:
+            pf.Task(
+                name="clean",
+                submit_arguments=submit_arguments or {},
+                script=pf.TemplateScript(
+                    scripts.prefetch_clean_script,
+                    DIR=prefetch_dir,
+                    YMD=self.ymd,
+                ),
+            )
+
+    def deploy_task(self, name, data, submit_arguments):
+        script = [
+            f"# Prefetch {name} for this cycle and the next "
+            f"{self.lookahead} cycle(s)",
+            pf.TemplateScript(
+                scripts.prefetch_script,
+                DIR=self.prefetch_dir,
+                NAME=name,
+                LOOKAHEAD=self.lookahead,
+                STEP=self.step,
+                YMD=self.ymd,
+            ),
+            data.script,
+            scripts.prefetch_tail_script,
+        ]
+        return pf.Task(
+            name=name,
+            submit_arguments=data.options.get(
+                "submit_arguments", submit_arguments
+            ),
+            script=script,
+            labels=task_labels(data, prefetched="NA"),
+            meters=task_meters(data),
+            events=["ready"],
+        )
+
+    def ready(self, name: str) -> pf.Event:
+        """Returns the event set by the task prefetching item `name` once
+        the data of the current cycle is available, for the consuming tasks
+        to trigger on. The task itself completes after fetching the next
+        cycles."""
+        return self._nodes[name].ready
+
+    def path(self, name: str, ymd: str = None) -> str:
+        """Returns the directory where item `name` is prefetched for a date,
+        by default the date of the current cycle."""
+        ymd = ymd or f"${self.ymd}"
+        return os.path.join(self.prefetch_dir, ymd, name)
@@ -0,0 +1,118 @@
+"""Reporting tools for the content-hash store used by static data items
+deployed with the `dedup` option.
+
+The store is laid out as follows:
+
+- `objects/<xx>/<sha256>`: one file per distinct content, hard linked (or
+  reflinked) into every item holding that content.
+- `items/<name>`: manifest of item `name`, one `<sha256> <size> <path>` line
+  per file.
+"""
+
+import os
+import sys
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Dict
+from typing import List
+
+
+@dataclass
+class DedupReport:
+    """Summary of the space used and saved by a content-hash store."""
+
+    items: Dict[str, int] = field(default_factory=dict)
+    logical_bytes: int = 0
+    stored_bytes: int = 0
+    orphans: List[str] = field(default_factory=list)
+
+    @property
+    def saved_bytes(self) -> int:
+        return self.logical_bytes - self.stored_bytes
+
+    def __str__(self) -> str:
+        lines = [f"{'item':<30} {'size (MB)':>12}"]
+        for name, size in sorted(self.items.items()):
+            lines.append(f"{name:<30} {size / 1e6:>12.1f}")
+        lines.append(f"{'logical size':<30} {self.logical_bytes / 1e6:>12.1f}")
+        lines.append(f"{'stored size':<30} {self.stored_bytes / 1e6:>12.1f}")
+        lines.append(f"{'space saved':<30} {self.saved_bytes / 1e6:>12.1f}")
+        if self.orphans:
+            lines.append(f"{len(self.orphans)} unreferenced objects")
+        return "\n".join(lines)
+
+
+def read_manifests(store_dir: str) -> Dict[str, List[tuple]]:
+    """Reads all item manifests of a store.
+
+    Returns
+    -------
+    dict
+        Mapping of item names to lists of `(hash, size, path)` entries.
+    """
+    manifests = {}
+    items_dir = os.path.join(store_dir, "items")
+    if not os.path.isdir(items_dir):
+        return manifests
+    for name in sorted(os.listdir(items_dir)):
+        if name.endswith(".tmp"):
+            continue
+        entries = []
+        with open(os.path.join(items_dir, name)) as fin:
+            for line in fin:
+                digest, size, path = line.rstrip("\n").split(" ", 2)
+                entries.append((digest, int(size), path))
+        manifests[name] = entries
+    return manifests
+
+
+def dedup_report(store_dir: str) -> DedupReport:
+    """Computes the space saved by a content-hash store.
+
+    Parameters
+    ----------
+    store_dir : str
+        Root of the store, by default `$DATA_DIR/.store` on the data host.
+
+    Returns
+    -------
+    DedupReport
+        Logical size of each item, total logical and stored sizes, and the
+        store objects no item refers to anymore.
+    """
+    report = DedupReport()
+    sizes = {}
+    for name, entries in read_manifests(store_dir).items():
+        report.items[name] = sum(size for _, size, _ in entries)
+        for digest, size, _ in entries:
+            sizes[digest] = size
+    report.logical_bytes = sum(report.items.values())
+    report.stored_bytes = sum(sizes.values())
+
+    objects_dir = os.path.join(store_dir, "objects")
+    if os.path.isdir(objects_dir):
+        for root, _, files in os.walk(objects_dir):
+            for fname in files:
+                if fname not in sizes:
+                    report.orphans.append(os.path.join(root, fname))
+    return report
+
+
+def prune_orphans(store_dir: str) -> int:
+    """Removes the store objects no manifest refers to anymore.
+
+    Returns
+    -------
+    int
+        The number of bytes released.
+    """
+    released = 0
+    for path in dedup_report(store_dir).orphans:
+        if os.stat(path).st_nlink == 1:
+            released += os.path.getsize(path)
+        os.remove(path)
+    return released
+
+
+if __name__ == "__main__":
+    print(dedup_report(sys.argv[1]))
@@ -0,0 +1,229 @@
+"""Housekeeping of the suite data directory.
+
+Nothing in [wellies.data][] ever removes data items, so `$DATA_DIR` keeps
+growing with items that are not referenced by the suite anymore. The functions
+below track the size and last access of each item directory and evict the
+least recently used ones under a quota or an age limit, while the
+[wellies.DataHousekeepingTask][] does the same from within the suite.
+"""
+
+import os
+import re
+import shutil
+import time
+from dataclasses import dataclass
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Union
+
+import pyflow as pf
+
+from wellies import dedup
+from wellies import scripts
+
+_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_size(size: Union[int, str]) -> int:
+    """Converts a size given as a number of bytes or as a string with a unit
+    suffix, e.g. "500G", into a number of bytes."""
+    if isinstance(size, (int, float)):
+        return int(size)
+    match = re.match(r"^\s*([\d.]+)\s*([KMGT]?)i?B?\s*$", size.upper())
+    if match is None:
+        raise ValueError(f"Invalid size: {size}")
+    return int(float(match.group(1)) * _UNITS[match.group(2)])
+
+
+@dataclass
+class DataItemUsage:
+    """Size and last access time of a data item directory."""
+
+    name: str
+    path: str
+    size: int
+    last_access: float
+
+    def age(self, now: Optional[float] = None) -> float:
+        """Days since the item was last accessed."""
+        now = time.time() if now is None else now
+        return (now - self.last_access) / 86400
+
+
+def scan_item(path: str) -> DataItemUsage:
+    """Computes the size of a data item directory and the most recent access
+    or modification time of its files.
+
+    Only files are considered, as listing the directories updates their
+    access time. Empty items fall back to the modification time of the item
+    directory.
+    """
+    size = 0
+    last_access = None
+    for root, _, files in os.walk(path):
+        for fname in files:
+            stat = os.lstat(os.path.join(root, fname))
+            last_access = max(last_access or 0, stat.st_atime, stat.st_mtime)
+            size += stat.st_size
+    if last_access is None:
+        last_access = os.lstat(path).st_mtime
+    return DataItemUsage(os.path.basename(path), path, size, last_access)
+
+
+def scan_data_dir(data_dir: str) -> List[DataItemUsage]:
+    """Returns the usage of every item directory of the data directory.
+
+    Hidden entries (such as the `.store` of deduplicated items) and symbolic
+    links (such as `link` items) are ignored.
+    """
+    usages = []
+    for name in sorted(os.listdir(data_dir)):
+        path = os.path.join(data_dir, name)
+        if name.startswith(".") or os.path.islink(path):
+            continue
+        if os.path.isdir(path):
+            usages.append(scan_item(path))
+    return usages
+
+
+def select_evictions(
+    usages: List[DataItemUsage],
+    quota: Optional[Union[int, str]] = None,
+    max_age: Optional[float] = None,
+    protected: Iterable[str] = (),
+    now: Optional[float] = None,
+) -> List[DataItemUsage]:
+    """Selects the items to evict, least recently used first.
+
+    Items not accessed for more than `max_age` days are always evicted. Then,
+    while the total size of all items is above `quota`, the least recently
+    used items are evicted. Protected items are never evicted but count
+    towards the quota.
+
+    Parameters
+    ----------
+    usages : list of DataItemUsage
+        Usage of every item of the data directory.
+    quota : int or str, optional
+        Maximum total size, in bytes or with a unit suffix ("500G").
+    max_age : float, optional
+        Maximum number of days since the last access of an item.
+    protected : list of str, optional
+        Names of the items that must be kept, usually the names of a
+        [wellies.StaticDataStore][].
+    now : float, optional
+        Reference time, by default the current time.
+    """
+    protected = set(protected)
+    total = sum(usage.size for usage in usages)
+    quota = None if quota is None else parse_size(quota)
+    candidates = sorted(
+        (usage for usage in usages if usage.name not in protected),
+        key=lambda usage: usage.last_access,
+    )
+    evicted = []
+    for usage in candidates:
+        too_old = max_age is not None and usage.age(now) > max_age
+        over_quota = quota is not None and total > quota
+        if too_old or over_quota:
+            evicted.append(usage)
+            total -= usage.size
+    return evicted
+
+
+def evict(
+    data_dir: str,
+    quota: Optional[Union[int, str]] = None,
+    max_age: Optional[float] = None,
+    protected: Iterable[str] = (),
+    dry_run: bool = False,
+    store_dir: Optional[str] = None,
+) -> List[DataItemUsage]:
+    """Evicts data items from the data directory, see
+    [select_evictions][wellies.housekeeping.select_evictions]. The manifests
+    of the evicted items are removed from the deduplication store, by default
+    `data_dir/.store`, and so are the store objects no item refers to
+    anymore.
+
+    Returns
+    -------
+    list of DataItemUsage
+        The evicted items, or the ones that would be evicted if `dry_run`.
+    """
+    evicted = select_evictions(
+        scan_data_dir(data_dir), quota, max_age, protected
+    )
+    if dry_run or not evicted:
+        return evicted
+    store_dir = store_dir or os.path.join(data_dir, ".store")
+    for usage in evicted:
+        shutil.rmtree(usage.path)
+        manifest = os.path.join(store_dir, "items", usage.name)
+        if os.path.exists(manifest):
+            os.remove(manifest)
+    if os.path.isdir(store_dir):
+        dedup.prune_orphans(store_dir)
+    return evicted
+
+
+class DataHousekeepingTask(pf.Task):
+    def __init__(
+        self,
+        data_store,
+        quota: Optional[Union[int, str]] = None,
+        max_age: Optional[float] = None,
+        keep: Iterable[str] = (),
+        data_dir: str = "$DATA_DIR",
+        store_dir: Optional[str] = None,
+        name: str = "housekeeping",
+        **kwargs,
+    ):
+        """Task evicting the data items of the data directory that are not
+        referenced by a [wellies.StaticDataStore][], least recently used
+        first, under a quota or an age limit.
+
+        Parameters
+        ----------
+        data_store : StaticDataStore
+            The store whose items are never evicted.
+        quota : int or str, optional
+            Maximum total size of the data directory, in bytes or with a unit
+            suffix ("500G").
+        max_age : float, optional
+            Maximum number of days since the last access of an item.
+        keep : list of str, optional
+            Extra item directories that must never be evicted.
+        data_dir : str, optional
+            The data directory, by default "$DATA_DIR".
+        store_dir : str, optional
+            The deduplication store, by default "<data_dir>/.store". The
+            manifests of the evicted items are removed from it, and so are
+            the objects no item refers to anymore.
+
+        Raises
+        ------
+        ValueError
+            If neither quota nor max_age is given, or if max_age is not a
+            positive number of days.
+        """
+        if quota is None and max_age is None:
+            raise ValueError("Either quota or max_age must be given")
+        max_age_seconds = 0
+        if max_age is not None:
+            try:
+                max_age_seconds = int(float(max_age) * 86400)
+            except (TypeError, ValueError):
+                raise ValueError(f"Invalid max_age: {max_age!r}")
+            if max_age_seconds <= 0:
+                raise ValueError(f"max_age must be positive: {max_age!r}")
+        protected = sorted(set(data_store.keys()) | set(keep))
+        script = pf.TemplateScript(
+            scripts.evict_script,
+            DIR=data_dir,
+            STORE=store_dir or os.path.join(data_dir, ".store"),
+            QUOTA=0 if quota is None else parse_size(quota),
+            MAX_AGE_SECONDS=max_age_seconds,
+            PROTECTED=protected,
+        )
+        super().__init__(name=name, script=script, **kwargs)
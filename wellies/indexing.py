@@ -0,0 +1,110 @@
+"""Access to the sidecar indexes of static data items deployed with the
+`index` option.
+
+The index of an item is a tab-separated file, `<item>/.index.tsv`, with a
+header line and one line per field. The last column is the `file` holding
+the field, relative to the item directory. The `offset` and `length` columns,
+if present, locate the field in the file. All the other columns are the keys
+identifying the field.
+"""
+
+import os
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+INDEX_FILE = ".index.tsv"
+LOCATION_COLUMNS = ("file", "offset", "length")
+
+
+@dataclass
+class IndexEntry:
+    """Location of a field in the files of a data item."""
+
+    file: str
+    offset: Optional[int] = None
+    length: Optional[int] = None
+    keys: Dict[str, str] = field(default_factory=dict)
+
+
+class DataIndex:
+    def __init__(self, item_dir: str):
+        """
+        Index of the fields of a data item, read once from its sidecar index
+        file. Lookups with all the keys are a dictionary access.
+
+        Parameters
+        ----------
+        item_dir : str
+            The directory of the data item, e.g. `$DATA_DIR/<name>`.
+        """
+        self.dir = item_dir
+        self.entries: List[IndexEntry] = []
+        self._lookup: Dict[Tuple[str, ...], List[IndexEntry]] = {}
+        with open(os.path.join(item_dir, INDEX_FILE)) as fin:
+            columns = fin.readline().rstrip("\n").split("\t")
+            self.keys = [c for c in columns if c not in LOCATION_COLUMNS]
+            for line in fin:
+                values = dict(zip(columns, line.rstrip("\n").split("\t")))
+                entry = IndexEntry(
+                    os.path.join(item_dir, values["file"]),
+                    _int_or_none(values.get("offset")),
+                    _int_or_none(values.get("length")),
+                    {k: values.get(k, "") for k in self.keys},
+                )
+                self.entries.append(entry)
+                key = tuple(entry.keys[k] for k in self.keys)
+                self._lookup.setdefault(key, []).append(entry)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self) -> Iterator[IndexEntry]:
+        return iter(self.entries)
+
+    def find(self, **keys) -> List[IndexEntry]:
+        """Returns the entries matching the given keys. The lookup is a
+        dictionary access when all the keys of the index are given, and a
+        scan of the entries otherwise."""
+        keys = {k: str(v) for k, v in keys.items()}
+        unknown = set(keys) - set(self.keys)
+        if unknown:
+            raise KeyError(f"Keys not in index: {sorted(unknown)}")
+        if len(keys) == len(self.keys):
+            key = tuple(keys[k] for k in self.keys)
+            return list(self._lookup.get(key, []))
+        return [
+            entry
+            for entry in self.entries
+            if all(entry.keys[k] == v for k, v in keys.items())
+        ]
+
+    def get(self, **keys) -> IndexEntry:
+        """Returns the single entry matching the given keys.
+
+        Raises
+        ------
+        KeyError
+            If no entry or several entries match.
+        """
+        entries = self.find(**keys)
+        if len(entries) != 1:
+            raise KeyError(f"{len(entries)} entries match {keys}")
+        return entries[0]
+
+    def read(self, entry: IndexEntry) -> bytes:
+        """Reads the bytes of a field, or of the whole file if the index does
+        not locate fields within files."""
+        with open(entry.file, "rb") as fin:
+            if entry.offset is None:
+                return fin.read()
+            fin.seek(entry.offset)
+            return fin.read(entry.length if entry.length is not None else -1)
+
+
+def _int_or_none(value: Optional[str]) -> Optional[int]:
+    return None if value in (None, "") else int(value)
@@ -1,5 +1,9 @@
+import re
+
 from pyflow import Script
 
+RELATIVE_DATE = re.compile(r"^(-?\d{1,7}|today|yesterday|tomorrow)$")
+
 
 def _resolve(k, v):
     if isinstance(v, list):
@@ -64,3 +68,150 @@ class List(Request):
     def __init__(self, req, command="mars", **kwargs):
         req = {**req, **kwargs}
         super().__init__(("list", req), command=command)
+
+
+def canonical_request(request) -> str:
+    """Returns a canonical form of a request, identical for requests
+    retrieving the same fields whatever the order or case of their keys and
+    values. The `target` is excluded.
+
+    Keys are lowercased and sorted, and values are rendered as in the MARS
+    request by `_resolve`, lowercased unless they are quoted or contain a
+    shell variable.
+    """
+    action, values = request
+    lines = [action.lower()]
+    for k, v in sorted((k.lower(), v) for k, v in values.items()):
+        if k == "target":
+            continue
+        v = _resolve(k, v)
+        if not v.startswith('"') and "$" not in v:
+            v = v.lower()
+        lines.append(f"  {k}={v}")
+    return ",\n".join(lines)
+
+
+def relative_dates(request) -> list:
+    """Returns the dates of a request given relatively to the day the request
+    is run, such as `-1` or `yesterday`, which identify different fields from
+    one day to the next. Dates held in shell variables are not relative."""
+    action, values = request
+    relative = []
+    for k, v in values.items():
+        if k.lower() != "date":
+            continue
+        tokens = _resolve(k, v).lower().split("/")
+        for i, token in enumerate(tokens):
+            if i > 0 and tokens[i - 1] == "by":
+                continue
+            if RELATIVE_DATE.match(token.strip()):
+                relative.append(token.strip())
+    return relative
+
+
+# default bound of the MARS cache, in bytes
+DEFAULT_CACHE_SIZE = 10 * 1024**3
+
+
+class CachedRetrieve(Script):
+    def __init__(
+        self,
+        req,
+        cache_dir,
+        max_size=DEFAULT_CACHE_SIZE,
+        command="mars",
+        **kwargs,
+    ):
+        """Retrieval going through a content-addressed cache shared between
+        suites.
+
+        The canonical form of the request is hashed at run time, once shell
+        variables are expanded. On a miss the request is retrieved into the
+        cache, on a hit the cached file is used. In both cases, the target is
+        hard linked to the cached file, or symbolically linked if the cache
+        is on another filesystem. The cached files are made read-only, so
+        that a tool writing into a target fails instead of changing the
+        file of every suite linked to it. Once `max_size` bytes are
+        exceeded, the least recently used files are evicted.
+
+        Parameters
+        ----------
+        req : dict
+            The retrieve request, with a single `target` file.
+        cache_dir : str
+            The cache directory.
+        max_size : int, optional
+            Maximum size of the cache in bytes, by default 10 GiB, or 0 for
+            no limit.
+        command : str, optional
+            The command running the request file, by default "mars".
+
+        Raises
+        ------
+        ValueError
+            If the request does not have a single target file, or if its
+            dates are relative to the day it runs: the cache would serve the
+            fields of the first day forever.
+        """
+        req = {**req, **kwargs}
+        target = [v for k, v in req.items() if k.lower() == "target"]
+        if len(target) != 1:
+            raise ValueError("Cached retrievals need a single target")
+        target = str(target[0])
+        if "[" in target:
+            raise ValueError(
+                f"Cached retrievals can not split target {target} into "
+                "several files"
+            )
+        values = {k: v for k, v in req.items() if k.lower() != "target"}
+        relative = relative_dates(("retrieve", values))
+        if relative:
+            raise ValueError(
+                f"Cached retrievals need absolute dates, got {relative}: use "
+                "a shell variable such as $YMD instead"
+            )
+        canonical = canonical_request(("retrieve", values))
+        request = _process_request(
+            ("retrieve", {**values, "target": "$cached.tmp"})
+        )
+        script = f"""
+cache_dir={cache_dir}
+mkdir -p $cache_dir/objects $cache_dir/locks
+key=$(sha256sum << EOF | cut -d ' ' -f 1
+{canonical}
+EOF
+)
+cached=$cache_dir/objects/$key
+(
+    flock -x 9
+    if [[ -f $cached ]]; then
+        echo "MARS cache hit: $key"
+    else
+        echo "MARS cache miss: $key"
+        cat > $cache_dir/locks/$key.req << EOF
+{request}
+EOF
+        rm -f $cached.tmp
+        {command} $cache_dir/locks/$key.req
+        mv $cached.tmp $cached
+    fi
+    touch $cached
+    chmod a-w $cached
+) 9> $cache_dir/locks/$key
+ln -f $cached "{target}" 2> /dev/null || ln -sfn $cached "{target}"
+"""
+        if max_size:
+            script += f"""(
+    flock -x 9
+    total=$(du -sb $cache_dir/objects | cut -f 1)
+    find $cache_dir/objects -type f ! -name '*.tmp' -printf '%T@ %s %p\\n' \\
+        | sort -n | while read stamp size path; do
+        (( total > {max_size} )) || break
+        [[ $path == $cached ]] && continue
+        echo "MARS cache eviction: $(basename $path)"
+        rm -f $path
+        total=$((total - size))
+    done
+) 9> $cache_dir/locks/evict
+"""
+        super().__init__(script)
@@ -10,37 +10,97 @@ def update_label_version():
     )
 
 
+retry_function = """
+retry() {
+    local attempt=1 delay={{ DELAY }} rc=0
+    while true; do
+        "$@" && return 0 || rc=$?
+        if (( attempt > {{ COUNT }} )){% if EXIT_CODES %} || [[ " {{ EXIT_CODES | join(' ') }} " != *" $rc "* ]]{% endif %}; then
+            echo "$1 failed with exit code $rc after $attempt attempt(s)"
+            return $rc
+        fi
+        echo "$1 failed with exit code $rc, retrying in ${delay}s"
+        sleep $delay
+        attempt=$((attempt + 1))
+        delay=$((delay * {{ BACKOFF }}))
+    done
+}
+"""
+
 git_script = """
 dest_dir={{ DIR }}/{{ NAME }}
+{%- if RETRY %}
+if [[ ${ECF_TRYNO:-1} -eq 1 ]]; then rm -rf $dest_dir; fi
+{%- else %}
 rm -rf $dest_dir
+{%- endif %}
 giturl={{ URL }}
 gitbranch={{ BRANCH }}
+{%- if RETRY %}
+git_fetch() {
+    if [[ -d $dest_dir/.git ]]; then
+        git -C $dest_dir fetch --depth 1 origin $gitbranch && git -C $dest_dir checkout -f FETCH_HEAD
+    else
+        rm -rf $dest_dir && git clone $giturl --branch $gitbranch --single-branch --depth 1 $dest_dir
+    fi
+}
+retry git_fetch
+{%- else %}
 git clone $giturl --branch $gitbranch --single-branch --depth 1 $dest_dir
+{%- endif %}
 cd $dest_dir
 
 """
 
 rsync_script = """
 dest_dir={{ DIR }}/{{ NAME }}
-rsync {{ RSYNC_OPTIONS }} {% for item in TARGET %}{{ item }} {% endfor %} $dest_dir/
+{% if RETRY %}retry {% endif %}rsync {{ RSYNC_OPTIONS }}{% if RETRY %} --partial-dir=.rsync-partial{% endif %} {% for item in TARGET %}{{ item }} {% endfor %} $dest_dir/
 cd $dest_dir
 
 """
 
 copy_script = """
 dest_dir={{ DIR }}/{{ NAME }}
+{%- if RETRY %}
+if [[ ${ECF_TRYNO:-1} -eq 1 ]]; then rm -rf $dest_dir; fi
+mkdir -p $dest_dir/.partial
+for src in {% for item in TARGET %}{{ item }} {% endfor %}; do
+    if [[ -e $dest_dir/$(basename $src) ]]; then
+        echo "$src already retrieved, skipping"
+        continue
+    fi
+    retry scp $src $dest_dir/.partial/
+    mv $dest_dir/.partial/$(basename $src) $dest_dir/
+done
+rm -rf $dest_dir/.partial
+{%- else %}
 rm -rf $dest_dir
 mkdir -p $dest_dir
 scp {% for item in TARGET %}{{ item }} {% endfor %} $dest_dir/
+{%- endif %}
 cd $dest_dir
 
 """
 
 ecfs_script = """
 dest_dir={{ DIR }}/{{ NAME }}
+{%- if RETRY %}
+if [[ ${ECF_TRYNO:-1} -eq 1 ]]; then rm -rf $dest_dir; fi
+mkdir -p $dest_dir/.partial
+for src in {% for item in TARGET %}{{ item }} {% endfor %}; do
+    if [[ -e $dest_dir/$(basename $src) ]]; then
+        echo "$src already retrieved, skipping"
+        continue
+    fi
+    retry ecp $src $dest_dir/.partial/
+    mv $dest_dir/.partial/$(basename $src) $dest_dir/
+done
+rm -rf $dest_dir/.partial
+{%- else %}
 rm -rf $dest_dir
 mkdir -p $dest_dir
 ecp {% for item in TARGET %}{{ item }} {% endfor %} $dest_dir/
+{%- endif %}
 cd $dest_dir
 
 """
@@ -59,5 +119,323 @@ cd $dest_dir
 
 """
 
+prefetch_script = """
+for offset in $(seq 0 {{ LOOKAHEAD }}); do
+export PREFETCH_YMD=$(date -d "${{ YMD }} + $((offset * {{ STEP }})) day" +%Y%m%d)
+marker={{ DIR }}/$PREFETCH_YMD/.{{ NAME }}.prefetched
+if [[ -f $marker ]]; then
+    echo "{{ NAME }} already prefetched for $PREFETCH_YMD"
+else
+ecflow_client --label=prefetched $PREFETCH_YMD
+("""
+
+prefetch_tail_script = """)
+touch "$marker"
+fi
+if (( offset == 0 )); then
+    # the data of the current cycle is ready
+    ecflow_client --event=ready
+fi
+done"""
+
+prefetch_clean_script = """
+mkdir -p {{ DIR }}
+for dir in {{ DIR }}/*/; do
+    date=$(basename $dir)
+    if [[ $date =~ ^[0-9]{8}$ ]] && (( date < ${{ YMD }} )); then
+        echo "removing stale prefetched data $dir"
+        rm -rf $dir
+    fi
+done
+"""
+
+stage_script = """
+stage_root={{ CACHE_DIR }}
+mkdir -p $stage_root/.jobs
+# directory of the links to the copies staged by this job, locked until the
+# job exits, and removal of the directories of the finished jobs
+{
+    flock -x 9
+    for lock in $stage_root/.jobs/*.lock; do
+        if [[ -f $lock ]] && flock -xn $lock true; then
+            rm -rf ${lock%.lock} $lock
+        fi
+    done
+    stage_job=$(mktemp -u $stage_root/.jobs/XXXXXXXX)
+    exec {stage_lock}> $stage_job.lock
+    flock -x $stage_lock
+    mkdir $stage_job
+} 9> $stage_root/.jobs/.lock
+stage_data() {
+    local name=$1 src=$2 stamp=$3
+    # a new copy is staged for each deployment of the item
+    local key=$({ cat $stamp 2> /dev/null || stat -L -c '%i %Y' $src; } | cksum | cut -d ' ' -f 1)
+    local dest=$stage_root/.$name.$key
+    local reader old suffix
+    {
+        flock -x 9
+        if [[ ! -f $dest/.staged ]]; then
+            echo "staging $src into $dest"
+            rm -rf $dest.tmp
+            mkdir -p $dest.tmp
+            cp -rL $src/. $dest.tmp/
+            touch $dest.tmp/.staged
+            mv -T $dest.tmp $dest
+        fi
+        ln -sfn $dest $stage_job/$name
+        # read lock on the copy, held until the job exits
+        exec {reader}> $dest.readers
+        flock -s $reader
+        # remove the previous copies no running job has staged
+        for old in $stage_root/.$name.*; do
+            suffix=${old#$stage_root/.$name.}
+            if [[ -d $old && $old != $dest && $suffix =~ ^[0-9]+$ ]] && flock -xn $old.readers true; then
+                echo "removing stale staged copy $old"
+                rm -rf $old $old.readers
+            fi
+        done
+    } 9> $stage_root/.$name.lock
+}
+{%- for name, src, stamp in ITEMS %}
+stage_data {{ name }} {{ src }} {{ stamp }}
+{%- endfor %}
+export {{ VARIABLE }}=$stage_job
+"""
+
+deployed_stamp_script = """
+# stamp the deployment, for the jobs staging the item
+date +%s.%N > {{ STAMP }}.$$
+mv -f {{ STAMP }}.$$ {{ STAMP }}
+"""
+
+fanout_script = """
+control=$(mktemp -u /tmp/ssh-XXXXXXXX)
+ssh_cmd="ssh -o BatchMode=yes -o ControlMaster=auto -o ControlPath=$control -o ControlPersist=60"
+{%- for name, src, dest in ITEMS %}
+dest_dir={{ dest }}
+ecflow_client --label=item {{ name }}
+$ssh_cmd {{ TARGET }} "mkdir -p $dest_dir"
+rsync -a --delete -e "$ssh_cmd" {{ src }}/{{ name }} {{ TARGET }}:$dest_dir/
+if [[ -f {{ src }}/.{{ name }}.deployed ]]; then
+    rsync -a -e "$ssh_cmd" {{ src }}/.{{ name }}.deployed {{ TARGET }}:$dest_dir/
+fi
+{%- endfor %}
+$ssh_cmd -O exit {{ TARGET }} || true
+"""
+
+telemetry_start_script = """
+telemetry_start=$(date +%s.%N)
+mkdir -p {{ DIR }}
+telemetry_marker=$(mktemp {{ DIR }}/.telemetry.XXXXXXXX)
+"""
+
+telemetry_script = """
+telemetry_seconds=$(awk -v t0=$telemetry_start -v t1=$(date +%s.%N) 'BEGIN {printf "%.3f", t1 - t0}')
+# files written by this run, changed after the marker, and whole item
+telemetry_since=$(find $telemetry_marker -printf '%T@')
+rm -f $telemetry_marker
+read telemetry_bytes telemetry_files telemetry_item_bytes telemetry_item_files < <(find {{ DIR }}/{{ NAME }} -type f -printf '%s %C@\\n' 2>/dev/null \\
+    | awk -v t=$telemetry_since '{s += $1; n++} $2 >= t {m += $1; k++} END {print m + 0, k + 0, s + 0, n + 0}')
+telemetry_rate=$(awk -v b=$telemetry_bytes -v t=$telemetry_seconds 'BEGIN {printf "%.1f", (t > 0 ? b / t / 1e6 : 0)}')
+ecflow_client --label=telemetry "$telemetry_bytes bytes, $telemetry_files files moved in ${telemetry_seconds}s ($telemetry_rate MB/s), item of $telemetry_item_bytes bytes, $telemetry_item_files files" || true
+ecflow_client --meter=throughput $(awk -v r=$telemetry_rate 'BEGIN {printf "%d", (r < {{ METER_MAX }} ? r : {{ METER_MAX }})}') || true
+mkdir -p $(dirname {{ LOG }})
+printf '{"name": "%s", "type": "%s", "source": "%s", "date": "%s", "bytes": %d, "files": %d, "seconds": %s, "item_bytes": %d, "item_files": %d}\\n' \\
+    {{ NAME }} {{ TYPE }} "{{ SOURCE }}" $(date -u +%Y-%m-%dT%H:%M:%SZ) $telemetry_bytes $telemetry_files $telemetry_seconds $telemetry_item_bytes $telemetry_item_files >> {{ LOG }}
+"""
+
+batch_head_script = """
+# Deploy items concurrently
+declare -A batch_pids
+batch_failed=0
+batch_slot() {
+    while (( $(jobs -rp | wc -l) >= {{ PARALLEL }} )); do
+        sleep 1
+    done
+}
+"""
+
+batch_item_start_script = """
+batch_slot
+(
+ecflow_client --label={{ LABEL }} running || true
+"""
+
+batch_item_end_script = """
+) > >(sed "s/^/[{{ NAME }}] /") 2>&1 &
+batch_pids[{{ LABEL }}]=$!
+"""
+
+batch_tail_script = """
+for label in "${!batch_pids[@]}"; do
+    if wait ${batch_pids[$label]}; then
+        ecflow_client --label=$label complete || true
+    else
+        ecflow_client --label=$label failed || true
+        batch_failed=$((batch_failed + 1))
+    fi
+done
+if (( batch_failed > 0 )); then
+    echo "$batch_failed item(s) failed to deploy"
+    exit 1
+fi
+"""
+
+wheel_cache_head_script = """
+wheel_root={{ CACHE_DIR }}/{{ NAME }}
+interpreter=$(python3 -c 'import sys, sysconfig; print(sysconfig.get_config_var("SOABI") or sys.implementation.cache_tag)')
+wheel_key() {
+    echo "{{ URL }} $1 $interpreter" | sha256sum | cut -c 1-16
+}
+# commit of the branch or tag, peeled as checked out by git clone --branch
+commit=$(git ls-remote {{ URL }} {{ BRANCH }} "{{ BRANCH }}^{}" | awk -v ref="{{ BRANCH }}" '
+    $2 == "refs/heads/" ref {head = $1}
+    $2 == "refs/tags/" ref "^{}" {peeled = $1}
+    $2 == "refs/tags/" ref {tag = $1}
+    $2 == ref {exact = $1}
+    END {print head != "" ? head : peeled != "" ? peeled : tag != "" ? tag : exact}')
+wheel_dir=$wheel_root/$(wheel_key ${commit:-unknown})
+if ls $wheel_dir/*.whl > /dev/null 2>&1; then
+    echo "Reusing the {{ NAME }} wheel built for commit $commit and $interpreter"
+else
+"""
+
+wheel_cache_build_script = """
+commit=$(git rev-parse HEAD)
+wheel_dir=$wheel_root/$(wheel_key $commit)
+rm -rf $wheel_dir.tmp.$$
+python3 -m pip wheel --no-deps --wheel-dir $wheel_dir.tmp.$$ .
+mkdir -p $wheel_root
+mv -T $wheel_dir.tmp.$$ $wheel_dir 2> /dev/null || rm -rf $wheel_dir.tmp.$$
+fi
+"""
+
+wheel_cache_install_script = """
+pip install --no-deps --force-reinstall $wheel_dir/*.whl
+pip install $wheel_dir/*.whl
+"""
+
+wheel_cache_tail_script = (
+    wheel_cache_build_script
+    + wheel_cache_install_script
+    + """ecflow_client --label=version ${commit:0:12}
+"""
+)
+
 set_clear_event = """ecflow_client --alter change event {{ EVENT }} {{ ACTION }} {{ SUITE_PATH }}
 """
+
+dedup_script = """
+store_dir={{ STORE }}
+item_dir={{ DIR }}/{{ NAME }}
+manifest=$store_dir/items/{{ NAME }}
+mkdir -p $store_dir/objects $store_dir/items
+: > $manifest.tmp
+find $item_dir/ -type f -print0 | while IFS= read -r -d '' file; do
+    hash=$(sha256sum "$file" | cut -d ' ' -f 1)
+    obj=$store_dir/objects/${hash:0:2}/$hash
+    mkdir -p $(dirname $obj)
+{%- if MODE == "reflink" %}
+    if [[ ! -e $obj ]]; then
+        cp --reflink=auto "$file" "$obj.$$" && mv -n "$obj.$$" "$obj"
+        rm -f "$obj.$$"
+    fi
+    cp --reflink=always "$obj" "$file.$$" 2>/dev/null && mv -f "$file.$$" "$file" || ln -f "$obj" "$file"
+    rm -f "$file.$$"
+{%- else %}
+    ln "$file" "$obj" 2>/dev/null || true
+    if [[ ! "$file" -ef "$obj" ]]; then
+        ln -f "$obj" "$file"
+    fi
+{%- endif %}
+    chmod a-w "$obj"
+    echo "$hash $(stat -c %s "$obj") ${file#$item_dir/}" >> $manifest.tmp
+done
+mv -f $manifest.tmp $manifest
+echo "{{ NAME }}: $(wc -l < $manifest) files registered in $store_dir"
+"""
+
+dedup_unlink_script = """
+manifest={{ STORE }}/items/{{ NAME }}
+if [[ -f $manifest ]]; then
+    while read -r hash size file; do
+        obj={{ STORE }}/objects/${hash:0:2}/$hash
+        file="{{ DIR }}/{{ NAME }}/$file"
+        if [[ "$file" -ef "$obj" ]]; then
+            cp -p "$obj" "$file.$$" && chmod u+w "$file.$$"
+            mv -f "$file.$$" "$file"
+        fi
+    done < $manifest
+fi
+"""
+
+evict_script = """
+data_dir={{ DIR }}
+store_dir={{ STORE }}
+quota={{ QUOTA }}
+max_age={{ MAX_AGE_SECONDS }}
+protected=" {{ PROTECTED | join(' ') }} "
+now=$(date +%s)
+# sizes and totals as in wellies.housekeeping.scan_data_dir: the files of
+# the item directories, without the hidden entries and the links
+total=0
+listing=$(mktemp)
+for dir in $data_dir/*/; do
+    dir=${dir%/}
+    name=$(basename $dir)
+    if [[ -L $dir ]]; then
+        continue
+    fi
+    read last size < <(find $dir ! -type d -printf '%s %A@ %T@\\n' | awk '
+        {s += $1; if ($2 > l) l = $2; if ($3 > l) l = $3}
+        END {printf "%d %d\\n", l, s}')
+    if (( last == 0 )); then
+        last=$(stat -c %Y $dir)
+    fi
+    total=$((total + size))
+    if [[ $protected != *" $name "* ]]; then
+        echo "$last $size $name" >> $listing
+    fi
+done
+echo "$data_dir items use $total bytes"
+evicted=0
+while read last size name; do
+    age=$(( (now - last) / 86400 ))
+    if (( max_age > 0 && now - last > max_age )) || (( quota > 0 && total > quota )); then
+        echo "evicting $name ($size bytes, last accessed $age days ago)"
+        rm -rf $data_dir/$name
+        rm -f $store_dir/items/$name
+        total=$((total - size))
+        evicted=$((evicted + 1))
+    fi
+done < <(sort -n $listing)
+rm -f $listing
+# remove the deduplicated objects no item refers to anymore
+if (( evicted > 0 )) && [[ -d $store_dir/objects ]]; then
+    referenced=$(mktemp)
+    cat $store_dir/items/* 2> /dev/null | cut -d ' ' -f 1 | sort -u > $referenced
+    find $store_dir/objects -type f -links 1 -regextype posix-extended -regex '.*/[0-9a-f]{64}' -printf '%f %p\\n' \\
+        | sort | join -v 1 - $referenced | cut -d ' ' -f 2 | xargs -r rm -f
+    rm -f $referenced
+fi
+"""
+
+index_script = """
+item_dir={{ DIR }}/{{ NAME }}
+index=$item_dir/.index.tsv
+printf '{{ HEADER }}\\tfile\\n' > $index.tmp
+cd $item_dir
+find . -type f ! -name '.*' {{ FILTER }} | sort | sed 's|^\\./||' | while read file; do
+{%- if TYPE == "grib" %}
+    grib_get -p {{ KEYS | join(',') }},offset,totalLength "$file" \\
+{%- elif TYPE == "netcdf" %}
+    ncdump -h "$file" | awk '/^variables:/ {v = 1; next} /^}/ {v = 0} v && /^\\t[a-z]+[0-9]* / {sub(/\\(.*/, "", $2); print $2}' \\
+{%- else %}
+    {{ COMMAND }} "$file" \\
+{%- endif %}
+        | awk -v f="$file" -v OFS='\\t' '{$1 = $1; print $0, f}'
+done >> $index.tmp
+mv -f $index.tmp $index
+echo "{{ NAME }}: $(($(wc -l < $index) - 1)) fields indexed"
+cd -
+"""
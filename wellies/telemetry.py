@@ -0,0 +1,95 @@
+"""Aggregation of the transfer telemetry recorded by static data items
+deployed with the `telemetry` option.
+
+Each deployment appends one JSON record per item to the telemetry log, by
+default `$DATA_DIR/.telemetry.jsonl`, with the fields `name`, `type`,
+`source`, `date`, `bytes` and `files` written by the run, `seconds`, and
+`item_bytes` and `item_files` of the whole item.
+"""
+
+import json
+import sys
+from dataclasses import dataclass
+from typing import Dict
+from typing import List
+
+
+@dataclass
+class ThroughputSummary:
+    """Transfer volume and time accumulated over several runs."""
+
+    runs: int = 0
+    bytes: int = 0
+    files: int = 0
+    seconds: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """Average throughput in bytes per second."""
+        return self.bytes / self.seconds if self.seconds > 0 else 0.0
+
+
+def read_log(path: str) -> List[dict]:
+    """Reads the records of a telemetry log, skipping truncated lines."""
+    records = []
+    with open(path) as fin:
+        for line in fin:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+
+def summarise(
+    records: List[dict], key: str = "type"
+) -> Dict[str, ThroughputSummary]:
+    """Aggregates telemetry records.
+
+    Parameters
+    ----------
+    records : list of dict
+        Telemetry records, as returned by
+        [read_log][wellies.telemetry.read_log].
+    key : str, optional
+        The record field to group by, e.g. "type", "source" or "name",
+        by default "type".
+
+    Returns
+    -------
+    dict
+        Mapping of each value of `key` to its accumulated volume and time.
+    """
+    summary = {}
+    for record in records:
+        item = summary.setdefault(record.get(key, ""), ThroughputSummary())
+        item.runs += 1
+        item.bytes += record.get("bytes", 0)
+        item.files += record.get("files", 0)
+        item.seconds += record.get("seconds", 0.0)
+    return summary
+
+
+def format_summary(
+    summary: Dict[str, ThroughputSummary], title: str = ""
+) -> str:
+    """Renders a summary as a table, slowest throughput first."""
+    lines = [
+        f"{title:<40} {'runs':>6} {'size (MB)':>12} {'time (s)':>10} "
+        f"{'MB/s':>8}"
+    ]
+    for name, item in sorted(
+        summary.items(), key=lambda entry: entry[1].throughput
+    ):
+        lines.append(
+            f"{name:<40} {item.runs:>6} {item.bytes / 1e6:>12.1f} "
+            f"{item.seconds:>10.1f} {item.throughput / 1e6:>8.1f}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    records = read_log(sys.argv[1])
+    for key in ("type", "source"):
+        print(format_summary(summarise(records, key), key))
+        print()
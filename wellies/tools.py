@@ -1,5 +1,10 @@
+import hashlib
+import itertools
 import os
+from dataclasses import dataclass
+from dataclasses import field
 from os import path
+from typing import Callable
 from typing import Dict
 from typing import List
 from typing import Optional
@@ -9,6 +14,7 @@ import pyflow as pf
 
 from wellies import data
 from wellies import scripts
+from wellies.exceptions import WelliesConfigurationError
 
 module_use = """
 module use {{ MODULEFILES }}
@@ -24,6 +30,20 @@ module_unload = """
 module unload {{ NAME }}
 """
 
+module_load_many = """
+{%- for modulefiles in MODULEFILES %}
+module use {{ modulefiles }}
+{%- endfor %}
+set +ux
+{%- if PURGE %}
+module purge
+{%- else %}
+module unload {{ NAMES | join(' ') }} || true
+{%- endif %}
+module load {{ MODULES | join(' ') }}
+set -ux
+"""
+
 env_path_load = """
 export {{ NAME }}={{ VALUE }}:${{ '{'}}{{ NAME }}:-}
 """
@@ -62,6 +82,230 @@ rm -rf {{ ENV_DIR }}
 {{ CONDA_CMD }} create -p {{ ENV_DIR }} {{ PACKAGES }}
 """
 
+uv_venv_create = """
+{%- if CACHE_DIR %}
+export UV_CACHE_DIR={{ CACHE_DIR }}
+{%- endif %}
+if command -v uv > /dev/null; then
+    uv venv --seed --python $(command -v python3) {{ OPTIONS }} {{ ENV_DIR }}
+else
+    echo "uv not found, falling back to venv and pip"
+    python3 -m venv {{ ENV_DIR }} {{ OPTIONS }}
+fi
+"""
+
+uv_pip_install = """
+if command -v uv > /dev/null; then
+{%- if LOCKFILE %}
+    uv pip sync {{ LOCKFILE }}
+{%- else %}
+    uv pip install {{ PACKAGES }}
+{%- endif %}
+else
+{%- if LOCKFILE %}
+    pip install --no-deps -r {{ LOCKFILE }}
+{%- else %}
+    pip install {{ PACKAGES }}
+{%- endif %}
+fi
+"""
+
+stamp_check = """
+stamp_file={{ ROOT }}/.wellies_stamp
+stamp={{ HASH }}
+{%- for file in FILES %}
+stamp=$stamp-$(sha256sum {{ file }} | cut -c 1-16)
+{%- endfor %}
+if [[ -f $stamp_file && $(cat $stamp_file) == $stamp ]]; then
+    echo "{{ NAME }} is up to date, skipping setup"
+else
+"""
+
+stamp_write = """
+mkdir -p {{ ROOT }}
+echo $stamp > $stamp_file
+fi
+"""
+
+pack_env = """
+pack_stamp={{ ENV_DIR }}/.wellies_stamp
+if [[ -f {{ ARCHIVE }} && -f $pack_stamp ]] && cmp -s $pack_stamp {{ ARCHIVE }}.stamp; then
+    echo "{{ ARCHIVE }} matches the stamp of {{ ENV_DIR }}, skipping pack"
+else
+    rm -f {{ ARCHIVE }}.tmp
+    {{ COMMAND }} -p {{ ENV_DIR }} -o {{ ARCHIVE }}.tmp --format tar.gz --force
+    # environments without stamp get a new version on every pack
+    cat $pack_stamp > {{ ARCHIVE }}.stamp.tmp 2> /dev/null || date +%s.%N > {{ ARCHIVE }}.stamp.tmp
+    mv -f {{ ARCHIVE }}.tmp {{ ARCHIVE }}
+    mv -f {{ ARCHIVE }}.stamp.tmp {{ ARCHIVE }}.stamp
+fi
+"""
+
+packed_load = """
+unpack_root={{ UNPACK_DIR }}
+unpack_key=$({ cat {{ ARCHIVE }}.stamp 2> /dev/null || stat -c %Y {{ ARCHIVE }}; } | cksum | cut -d ' ' -f 1)
+unpack_dir=$unpack_root/{{ NAME }}.$unpack_key
+mkdir -p $unpack_root
+{
+    flock -x 9
+    if [[ ! -f $unpack_dir/.unpacked ]]; then
+        rm -rf $unpack_dir
+        mkdir -p $unpack_dir
+        tar -xzf {{ ARCHIVE }} -C $unpack_dir
+{%- if CONDA %}
+        $unpack_dir/bin/conda-unpack
+{%- endif %}
+        touch $unpack_dir/.unpacked
+    fi
+    # read lock on the environment, held until the job exits
+    exec {unpack_reader}> $unpack_dir.readers
+    flock -s $unpack_reader
+    # remove the previous archives no running job has loaded
+    for unpack_old in $unpack_root/{{ NAME }}.*; do
+        unpack_suffix=${unpack_old#$unpack_root/{{ NAME }}.}
+        if [[ -d $unpack_old && $unpack_old != $unpack_dir && $unpack_suffix =~ ^[0-9]+$ ]] && flock -xn $unpack_old.readers true; then
+            rm -rf $unpack_old $unpack_old.readers
+        fi
+    done
+} 9> $unpack_root/.{{ NAME }}.lock
+set +ux
+source $unpack_dir/bin/activate
+set -ux
+{%- if not CONDA %}
+export LD_LIBRARY_PATH=$unpack_dir/lib:${LD_LIBRARY_PATH:=}
+{%- endif %}
+"""
+
+snapshot_head = """
+snapshot={{ DIR }}/{{ HASH }}.sh
+mkdir -p {{ DIR }}
+set +x
+declare -A snapshot_before
+while IFS= read -r -d '' var; do
+    snapshot_before[${var%%=*}]=${var#*=}
+done < <(env -0)
+set -x
+"""
+
+snapshot_tail = """
+set +x
+{
+for var in $(compgen -e); do
+    case $var in PWD|OLDPWD|SHLVL|_|ECF_*) continue ;; esac
+    before=${snapshot_before[$var]-}
+    if [[ ${snapshot_before[$var]+set} != set || $before != "${!var}" ]]; then
+        printf 'export %s=%q\\n' $var "${!var}"
+    fi
+done
+for var in "${!snapshot_before[@]}"; do
+    [[ $var =~ ^[A-Za-z_][A-Za-z0-9_]*$ ]] || continue
+    [[ -v $var ]] || printf 'unset %s\\n' $var
+done
+} > $snapshot.tmp
+set -x
+mv -f $snapshot.tmp $snapshot
+echo "environment snapshot written to $snapshot"
+"""
+
+snapshot_load = """
+if [[ -f {{ DIR }}/{{ HASH }}.sh ]]; then
+    source {{ DIR }}/{{ HASH }}.sh
+else
+    echo "no snapshot of {{ NAME }} for this definition, loading its tools"
+"""
+
+precompile_script = """
+compile_options="-q -j {{ WORKERS }}"
+{%- if UNCHECKED %}
+compile_options="$compile_options -f --invalidation-mode unchecked-hash"
+{%- endif %}
+{%- if DISTRIBUTION %}
+dist_dirs='import importlib.metadata as m, sys
+for d in sorted({f.locate().parent for f in m.files(sys.argv[1]) or ()
+                 if f.suffix == ".py"}):
+    print(d)'
+{{ PYTHON }} -c "$dist_dirs" {{ DISTRIBUTION }} \\
+    | xargs -r -d '\\n' {{ PYTHON }} -m compileall $compile_options -l
+{%- else %}
+purelib='import sysconfig; print(sysconfig.get_paths()["purelib"])'
+{{ PYTHON }} -m compileall $compile_options $({{ PYTHON }} -c "$purelib")
+{%- endif %}
+"""
+
+DEFAULT_UNPACK_DIR = "${SSDTMP:-${TMPDIR:-/tmp}}/wellies_envs"
+
+INSTALLERS = ("pip", "uv")
+CONDA_COMMANDS = ("conda", "mamba", "micromamba")
+
+DEFAULT_WHEEL_CACHE = "${XDG_CACHE_HOME:-$HOME/.cache}/wellies/wheels"
+
+
+def module_check_command(
+    module_name: str, version: str, modulefiles: str = None
+) -> str:
+    """Returns a command failing if a module is not available, run in a login
+    shell to get the `module` function."""
+    cmd = f"module is-avail {module_name}/{version}"
+    if modulefiles:
+        cmd = f"module use {modulefiles} && {cmd}"
+    return f"bash -lc '{cmd}'"
+
+
+def precompile(
+    name: str,
+    options: Union[bool, Dict[str, any]],
+    python: str = "python3",
+    distribution: str = None,
+) -> Optional[pf.TemplateScript]:
+    """
+    Creates a script byte-compiling the site-packages of a python
+    environment, in parallel, or None if `options` is not set. If a
+    distribution is given, only the directories of its installed python files
+    are compiled. The options are `true`, or a dictionary with:
+
+    - `workers`: the number of parallel workers, by default 0 (all the cores)
+    - `unchecked_hash`: whether to write unchecked hash-based pycs, which are
+      never checked against their sources, by default False
+    - `distribution`: the name of the installed distribution, when compiling
+      a single one, by default the given distribution
+
+    Parameters
+    ----------
+    name: str
+        name of the tool
+    options: bool or dict
+        the `precompile` option of the tool
+    python: str
+        the python interpreter of the environment (default: python3)
+    distribution: str
+        the installed distribution to compile (default: the whole
+        site-packages)
+
+    Raises
+    ------
+    WelliesConfigurationError
+        If the options are not valid.
+    """
+    if not options:
+        return None
+    if not isinstance(options, dict):
+        options = {}
+    allowed = {"workers", "unchecked_hash"}
+    if distribution:
+        allowed.add("distribution")
+    unknown = set(options) - allowed
+    if unknown:
+        raise WelliesConfigurationError(
+            f"unknown precompile options for {name}: {sorted(unknown)}"
+        )
+    return pf.TemplateScript(
+        precompile_script,
+        PYTHON=python,
+        WORKERS=options.get("workers", 0),
+        UNCHECKED=options.get("unchecked_hash", False),
+        DISTRIBUTION=options.get("distribution", distribution),
+    )
+
 
 def deploy_package_script(
     package: str,
@@ -84,16 +328,126 @@ def deploy_package_script(
     """
     build_dir = build_dir or os.path.join(lib_dir, "build", "${ENV_NAME:-" "}")
     data_installer = data.parse_data_item(build_dir, package, options)
+    if options.get("wheel_cache"):
+        script = cached_wheel_script(package, options, data_installer)
+    else:
+        script = [
+            data_installer.script,
+            scripts.update_label_version(),
+        ]
+    compile_script = precompile(
+        package, options.get("precompile"), distribution=package
+    )
+    if compile_script:
+        script.extend(["# Byte-compile the package", compile_script])
+
+    return script
+
+
+def cached_wheel_script(
+    package: str, options: Dict[str, any], data_installer: data.StaticData
+) -> list:
+    """
+    Creates a script that installs a git package from a wheel cached for its
+    commit and the interpreter of the environment. The package is only cloned
+    and built if the cache has no such wheel. The cache directory is given by
+    the `dir` entry of the `wheel_cache` option, by default
+    `${XDG_CACHE_HOME:-$HOME/.cache}/wellies/wheels`.
+
+    Parameters
+    ----------
+    package: str
+        name of the package
+    options: dict
+        dictionary of options for the package
+    data_installer: StaticData
+        the data item cloning the package
 
-    script = [
+    Raises
+    ------
+    WelliesConfigurationError
+        If the package is not a git package or has a post_script.
+    """
+    values = _wheel_cache_values(package, options)
+    return [
+        "# Install from the wheel cached for this commit and interpreter",
+        pf.TemplateScript(scripts.wheel_cache_head_script, **values),
         data_installer.script,
-        scripts.update_label_version(),
+        pf.TemplateScript(scripts.wheel_cache_tail_script, **values),
     ]
 
-    return script
+
+def shared_wheel_script(
+    package: str,
+    options: Dict[str, any],
+    lib_dir: str = "$LIB_DIR",
+    build_name: str = None,
+) -> list:
+    """
+    Creates a script that builds the wheel of a git package in the wheel
+    cache, without installing it, so that the environments sharing the
+    interpreter of the build install the cached wheel instead of building
+    the package again. The package is cloned in
+    lib_dir/build/shared/<build_name>, so that the builds of the same package
+    for different interpreters can run concurrently.
+
+    Parameters
+    ----------
+    package: str
+        name of the package
+    options: dict
+        dictionary of options for the package, with the `wheel_cache` option
+    lib_dir: str
+        directory where to build the package (default: $LIB_DIR)
+    build_name: str
+        name of the build directory, unique for each build (default: the
+        package name)
+
+    Raises
+    ------
+    WelliesConfigurationError
+        If the package is not a git package or has a post_script.
+    """
+    values = _wheel_cache_values(package, options)
+    build_dir = os.path.join(lib_dir, "build", "shared", build_name or package)
+    data_installer = data.parse_data_item(build_dir, package, options)
+    return [
+        "# Build the wheel once for all the environments of this interpreter",
+        pf.TemplateScript(scripts.wheel_cache_head_script, **values),
+        data_installer.script,
+        pf.TemplateScript(scripts.wheel_cache_build_script, **values),
+        "ecflow_client --label=version ${commit:0:12}",
+    ]
+
+
+def _wheel_cache_values(package: str, options: Dict[str, any]) -> dict:
+    if options.get("type") != "git":
+        raise WelliesConfigurationError(
+            f"wheel_cache option of {package} requires a git package"
+        )
+    if options.get("post_script"):
+        raise WelliesConfigurationError(
+            f"wheel_cache option of {package} can not be used with a "
+            "post_script: the package is installed from its wheel"
+        )
+    cache = options["wheel_cache"]
+    if not isinstance(cache, dict):
+        cache = {}
+    return dict(
+        NAME=package,
+        URL=options["source"],
+        BRANCH=options.get("branch") or "HEAD",
+        CACHE_DIR=cache.get("dir", DEFAULT_WHEEL_CACHE),
+    )
 
 
 class Tool:
+    # directory holding the setup stamp, None if the tool can not be stamped
+    root = None
+    # command packing the tool into an archive, None if it can not be packed
+    pack_command = None
+    pack_script = None
+
     def __init__(
         self,
         name: str,
@@ -134,6 +488,72 @@ class Tool:
         self.scripts["unload"] = unload
         self.scripts["setup"] = setup
 
+    def check_command(self) -> Optional[str]:
+        """Returns a cheap command failing if the tool, or the source it is
+        installed from, does not exist, or None if it can not be checked."""
+        return None
+
+    def use_pack(self, unpack_dir: str = DEFAULT_UNPACK_DIR):
+        """
+        Makes the tool load from a relocatable archive of its environment,
+        `<root>.tar.gz`, written by `pack_script` with a copy of the setup stamp
+        of the tool, `<root>.tar.gz.stamp`. The archive is unpacked once per
+        node and stamp of the archive in `unpack_dir`. Tasks with the
+        `USE_ENV_PACK` variable set to 0, such as deployment tasks, still load
+        the environment itself.
+
+        Parameters
+        ----------
+        unpack_dir : str, optional
+            Node-local directory the archive is unpacked in, by default
+            `${SSDTMP:-${TMPDIR:-/tmp}}/wellies_envs`.
+
+        Raises
+        ------
+        WelliesConfigurationError
+            If the tool can not be packed.
+        """
+        if self.pack_command is None or self.root is None:
+            raise WelliesConfigurationError(
+                f"pack option not supported for {self.name}"
+            )
+        conda = self.pack_command == "conda-pack"
+        archive = f"{self.root}.tar.gz"
+        self.pack_script = pf.TemplateScript(
+            pack_env,
+            COMMAND=self.pack_command,
+            ENV_DIR=self.root,
+            ARCHIVE=archive,
+        )
+        load = pf.TemplateScript(
+            packed_load,
+            NAME=self.name,
+            ARCHIVE=archive,
+            UNPACK_DIR=unpack_dir,
+            CONDA=conda,
+        )
+        self.scripts["load"] = [
+            "if [[ ${USE_ENV_PACK:-1} == 0 ]]; then",
+            self.scripts["load"],
+            "else",
+            load,
+            "fi",
+        ]
+        if conda:
+            self.scripts["unload"] = [
+                "if [[ ${USE_ENV_PACK:-1} == 0 ]]; then",
+                self.scripts["unload"],
+                "else",
+                "source $CONDA_PREFIX/bin/deactivate",
+                "fi",
+            ]
+
+    def setup_steps(self) -> tuple:
+        """Returns the script fetching the inputs of the setup, or None, the
+        fetched files whose content the setup depends on, and the script
+        building the tool."""
+        return None, [], self.scripts["setup"]
+
 
 class ModuleTool(Tool):
     def __init__(
@@ -161,12 +581,17 @@ class ModuleTool(Tool):
         options: dict
             dictionary of options for the tool
         """
+        self.module_name = module_name
+        self.version = version
         load = pf.TemplateScript(
             module_load, NAME=module_name, VERSION=version
         )
         unload = pf.TemplateScript(module_unload, NAME=module_name)
         super().__init__(name, depends, load, unload, options=options)
 
+    def check_command(self):
+        return module_check_command(self.module_name, self.version)
+
 
 class PrivateModuleTool(Tool):
     def __init__(
@@ -197,6 +622,9 @@ class PrivateModuleTool(Tool):
         options: dict
             dictionary of options for the tool
         """
+        self.module_name = module_name
+        self.version = version
+        self.modulefiles = modulefiles
         load = pf.TemplateScript(
             module_use + module_load,
             NAME=module_name,
@@ -206,6 +634,14 @@ class PrivateModuleTool(Tool):
         unload = pf.TemplateScript(module_unload, NAME=module_name)
         super().__init__(name, depends, load, unload, options=options)
 
+    def check_command(self):
+        return module_check_command(
+            self.module_name, self.version, self.modulefiles
+        )
+
+
+MODULE_TOOLS = (ModuleTool, PrivateModuleTool)
+
 
 class EnvVarTool(Tool):
     def __init__(
@@ -285,9 +721,13 @@ class FolderTool(EnvVarTool):
         super().__init__(
             name, "PATH", folder_path, setup, depends, options=options
         )
+        self.root = folder_path
 
 
 class PackageTool(Tool):
+    # whether the package can be built once for several environments
+    shares_builds = False
+
     def __init__(self, name: str, lib_dir: str, options: Dict[str, any]):
         """
         Package tool that installs a user package in an environment.
@@ -305,11 +745,19 @@ class PackageTool(Tool):
         """
         depends = options.get("depends", [])
         build_dir = options.get("build_dir")
+        self.lib_dir = lib_dir
         setup = deploy_package_script(name, options, lib_dir, build_dir)
         super().__init__(name, depends, setup=setup, options=options)
+        self.shares_builds = bool(options.get("wheel_cache"))
+
+    def check_command(self):
+        source = data.parse_data_item(self.lib_dir, self.name, self.options)
+        return source.check_command()
 
 
 class VirtualEnvTool(Tool):
+    pack_command = "venv-pack"
+
     def __init__(
         self,
         name: str,
@@ -318,6 +766,10 @@ class VirtualEnvTool(Tool):
         extra_packages: Union[str, List[str]] = [],
         depends: List[str] = [],
         options: Dict[str, any] = {},
+        installer: str = "pip",
+        lockfile: str = None,
+        cache_dir: str = None,
+        precompile_options: Union[bool, Dict[str, any]] = False,
     ):
         """
         A tool that creates a python virtual environment and sets the right
@@ -336,6 +788,18 @@ class VirtualEnvTool(Tool):
             A list of dependencies for the tool, by default [].
         options : Dict[str], optional
             A dictionary of options for the tool, by default {}.
+        installer : str, optional
+            The installer creating the environment and installing the extra
+            packages, "pip" or "uv", by default "pip". With "uv", setup falls
+            back to pip when uv is not available.
+        lockfile : str, optional
+            A pinned requirements file (e.g. from `uv pip compile`) installed
+            instead of `extra_packages`, by default None.
+        cache_dir : str, optional
+            The package cache of uv, by default the uv default cache.
+        precompile_options : bool or dict, optional
+            Whether to byte-compile the environment after its setup, see
+            [wellies.tools.precompile][], by default False.
         """
         env_root = path.join(lib_dir, name)
         load = [
@@ -348,15 +812,47 @@ class VirtualEnvTool(Tool):
         if not isinstance(venv_options, list):
             venv_options = [venv_options]
         opts = " ".join(venv_options)
-        setup = [
-            f"rm -rf {env_root}",
-            f"python3 -m venv {env_root} {opts}",
-        ]
-        if extra_packages:
-            setup.extend(load)
-            pkgs = " ".join(extra_packages)
-            setup.append(f"pip install {pkgs}")
+        pkgs = " ".join(extra_packages)
+        if installer == "uv":
+            setup = [
+                f"rm -rf {env_root}",
+                pf.TemplateScript(
+                    uv_venv_create,
+                    ENV_DIR=env_root,
+                    OPTIONS=opts,
+                    CACHE_DIR=cache_dir,
+                ),
+            ]
+            if extra_packages or lockfile:
+                setup.extend(load)
+                setup.append(
+                    pf.TemplateScript(
+                        uv_pip_install, PACKAGES=pkgs, LOCKFILE=lockfile
+                    )
+                )
+        else:
+            setup = [
+                f"rm -rf {env_root}",
+                f"python3 -m venv {env_root} {opts}",
+            ]
+            if lockfile:
+                setup.extend(load)
+                setup.append(f"pip install --no-deps -r {lockfile}")
+            elif extra_packages:
+                setup.extend(load)
+                setup.append(f"pip install {pkgs}")
+        compile_script = precompile(
+            name, precompile_options, path.join(env_root, "bin", "python3")
+        )
+        if compile_script:
+            setup.extend(["# Byte-compile the environment", compile_script])
         super().__init__(name, depends, load, unload, setup, options=options)
+        self.root = env_root
+        self.lockfile = lockfile
+
+    def setup_steps(self):
+        files = [self.lockfile] if self.lockfile else []
+        return None, files, self.scripts["setup"]
 
 
 class SystemEnvTool(VirtualEnvTool):
@@ -368,6 +864,10 @@ class SystemEnvTool(VirtualEnvTool):
         extra_packages: Union[str, List[str]] = [],
         depends: List[str] = [],
         options: Dict[str, any] = {},
+        installer: str = "pip",
+        lockfile: str = None,
+        cache_dir: str = None,
+        precompile_options: Union[bool, Dict[str, any]] = False,
     ):
         """
         An extension of the VirtualEnvTool class that creates a python virtual
@@ -387,6 +887,16 @@ class SystemEnvTool(VirtualEnvTool):
             A list of dependencies for the tool, by default [].
         options : Dict[str], optional
             A dictionary of options for the tool, by default {}.
+        installer : str, optional
+            The installer, "pip" or "uv", by default "pip".
+        lockfile : str, optional
+            A pinned requirements file installed instead of `extra_packages`,
+            by default None.
+        cache_dir : str, optional
+            The package cache of uv, by default the uv default cache.
+        precompile_options : bool or dict, optional
+            Whether to byte-compile the environment after its setup, by
+            default False.
         """
         to_add = [" --system-site-packages"]
         if venv_options:
@@ -401,10 +911,16 @@ class SystemEnvTool(VirtualEnvTool):
             extra_packages=extra_packages,
             depends=depends,
             options=options,
+            installer=installer,
+            lockfile=lockfile,
+            cache_dir=cache_dir,
+            precompile_options=precompile_options,
         )
 
 
 class CondaEnvTool(Tool):
+    pack_command = "conda-pack"
+
     def __init__(
         self,
         name: str,
@@ -453,11 +969,14 @@ class FileCondaEnvTool(CondaEnvTool):
         conda_cmd: str = "conda",
         conda_activate_cmd: str = "conda",
         options: Dict[str, any] = {},
+        explicit: bool = False,
     ):
         """
         An extension of the CondaEnvTool class that also creates a conda
         environment in the lib directory.
-        The conda environment is created from a conda environment file.
+        The conda environment is created from a conda environment file, or
+        from an explicit lock file listing the exact packages to install
+        without solving.
         The path to the environment file is specified as a dictionary following
         the StaticData options format, for instance:
         ```yaml
@@ -487,6 +1006,9 @@ class FileCondaEnvTool(CondaEnvTool):
             The conda command to use, by default "conda".
         options : Dict[str, str], optional
             A dictionary of options for the tool, by default {}.
+        explicit : bool, optional
+            Whether the file is an explicit lock file (`@EXPLICIT`), as
+            rendered by `conda-lock render -k explicit`, by default False.
         """
         env_root = path.join(lib_dir, name)
         build_dir = options.get("build_dir", path.join(lib_dir, "build"))
@@ -496,12 +1018,15 @@ class FileCondaEnvTool(CondaEnvTool):
         env_file_path = path.join(build_dir, name, fname)
 
         setup = pf.TemplateScript(
-            conda_setup_yaml,
+            conda_setup_file if explicit else conda_setup_yaml,
             ENV_FILE=env_file_path,
             ENV_DIR=env_root,
             CONDA_CMD=conda_cmd,
         )
         setup_script = [file_setup.script, setup]
+        self.env_file = file_setup
+        self.env_file_path = env_file_path
+        self.build_script = setup
         super().__init__(
             name,
             env_root,
@@ -510,6 +1035,13 @@ class FileCondaEnvTool(CondaEnvTool):
             conda_activate_cmd,
             options=options,
         )
+        self.root = env_root
+
+    def check_command(self):
+        return self.env_file.check_command()
+
+    def setup_steps(self):
+        return self.env_file.script, [self.env_file_path], self.build_script
 
 
 class SimpleCondaEnvTool(CondaEnvTool):
@@ -554,6 +1086,41 @@ class SimpleCondaEnvTool(CondaEnvTool):
         super().__init__(
             name, env_root, setup, depends, conda_activate_cmd, options=options
         )
+        self.root = env_root
+
+
+class SnapshotTool(Tool):
+    def __init__(
+        self,
+        name: str,
+        lib_dir: str,
+        tools: List[str],
+        options: Dict[str, any] = {},
+    ):
+        """
+        A tool loading a frozen snapshot of the environment set by loading
+        other tools. The snapshot is a file of `export` and `unset` commands
+        written by the setup of the tool, once the other tools are deployed.
+        Tasks loading the tool only source that file, and fall back to
+        loading the tools when there is no snapshot for their current
+        definitions. The scripts are completed by the
+        [wellies.ToolStore][], which resolves the tools.
+
+        Parameters
+        ----------
+        name : str
+            The name of the tool.
+        lib_dir : str
+            The path to the lib directory, holding the snapshots in
+            `lib_dir/name`.
+        tools : List[str]
+            The tools loaded in the snapshot.
+        options : Dict[str], optional
+            A dictionary of options for the tool, by default {}.
+        """
+        self.snapshot_tools = tools if isinstance(tools, list) else [tools]
+        super().__init__(name, options=options)
+        self.root = path.join(lib_dir, name)
 
 
 def parse_environment(
@@ -594,11 +1161,13 @@ def parse_environment(
             venv_options=venv_options,
             extra_packages=extra_packages,
             depends=depends,
+            **venv_installer_options(name, options),
         )
     elif type == "conda" and "environment" in options:
-        if "env_file" in options or "extra_packages" in options:
+        builds = ("env_file", "extra_packages", "lockfile")
+        if any(opt in options for opt in builds):
             raise Exception(
-                "environment, file and extra_packages options cannot be used at the same time for conda"  # noqa: E501
+                "environment, file, lockfile and extra_packages options cannot be used at the same time for conda"  # noqa: E501
             )
         environment = options["environment"]
         env = CondaEnvTool(
@@ -607,6 +1176,24 @@ def parse_environment(
             depends=depends,
             conda_activate_cmd=options.get("conda_activate_cmd", "conda"),
         )
+    elif type == "conda" and "lockfile" in options:
+        if "env_file" in options or "extra_packages" in options:
+            raise WelliesConfigurationError(
+                f"lockfile option of {name} cannot be used with env_file or "
+                "extra_packages"
+            )
+        lockfile = options["lockfile"]
+        if not isinstance(lockfile, dict):
+            lockfile = {"type": "copy", "source": lockfile}
+        env = FileCondaEnvTool(
+            name,
+            lib_dir,
+            lockfile,
+            depends,
+            conda_cmd=conda_command(name, options),
+            conda_activate_cmd=options.get("conda_activate_cmd", "conda"),
+            explicit=True,
+        )
     elif type == "conda" and "env_file" in options:
         if "environment" in options:
             raise Exception(
@@ -617,7 +1204,7 @@ def parse_environment(
             lib_dir,
             options["env_file"],
             depends,
-            conda_cmd=options.get("conda_cmd", "conda"),
+            conda_cmd=conda_command(name, options),
             conda_activate_cmd=options.get("conda_activate_cmd", "conda"),
         )
     elif type == "conda" and "extra_packages" in options:
@@ -631,9 +1218,11 @@ def parse_environment(
             lib_dir,
             conda_packages,
             depends,
-            conda_cmd=options.get("conda_cmd", "conda"),
+            conda_cmd=conda_command(name, options),
             conda_activate_cmd=options.get("conda_activate_cmd", "conda"),
         )
+    elif type == "snapshot":
+        env = SnapshotTool(name, lib_dir, options["tools"])
     elif type == "custom":
         env = Tool(
             name,
@@ -652,12 +1241,88 @@ def parse_environment(
             extra_packages=extra_packages,
             depends=depends,
             options=options,
+            **venv_installer_options(name, options),
         )
     else:
         raise Exception("Environment type {} not supported".format(type))
+    pack = options.get("pack")
+    if pack:
+        env.use_pack(**(pack if isinstance(pack, dict) else {}))
     return env
 
 
+def conda_command(name: str, options: Dict[str, any]) -> str:
+    """
+    Returns the command creating a conda environment, with its arguments.
+
+    Parameters
+    ----------
+    name : str
+        The name of the environment.
+    options : dict
+        A dictionary containing the environment options.
+
+    Returns
+    -------
+    str: the `conda_cmd` option, by default "conda"
+
+    Raises
+    ------
+    WelliesConfigurationError
+        If the command is not conda, mamba or micromamba.
+    """
+    conda_cmd = options.get("conda_cmd", "conda")
+    executable = os.path.basename(conda_cmd.split()[0]) if conda_cmd else ""
+    if executable not in CONDA_COMMANDS:
+        raise WelliesConfigurationError(
+            f"conda_cmd of {name} must run one of {', '.join(CONDA_COMMANDS)}"
+        )
+    return conda_cmd
+
+
+def venv_installer_options(
+    name: str, options: Dict[str, any]
+) -> Dict[str, any]:
+    """
+    Returns the installer options of a python virtual environment.
+
+    Parameters
+    ----------
+    name : str
+        The name of the environment.
+    options : dict
+        A dictionary containing the environment options.
+
+    Returns
+    -------
+    dict: the installer, lockfile, cache_dir and precompile_options arguments
+        of the tool
+
+    Raises
+    ------
+    WelliesConfigurationError
+        If the installer is not supported or if both a lockfile and
+        extra_packages are given.
+    """
+    installer = options.get("installer", "pip")
+    if installer not in INSTALLERS:
+        raise WelliesConfigurationError(
+            f"installer of {name} must be one of {', '.join(INSTALLERS)}"
+        )
+    lockfile = options.get("lockfile")
+    if lockfile and options.get("extra_packages"):
+        raise WelliesConfigurationError(
+            f"lockfile and extra_packages options of {name} can not be used "
+            "at the same time"
+        )
+    return dict(
+        installer=installer,
+        lockfile=lockfile,
+        cache_dir=options.get("cache_dir"),
+        precompile_options=options.get("precompile", False),
+    )
+
+
 def parse_package(
     lib_dir: str, name: str, options: Dict[str, any]
 ) -> PackageTool:
@@ -731,6 +1396,55 @@ def parse_env_var(name: str, options: Dict[str, any]) -> EnvVarTool:
     return var
 
 
+def _render(script) -> str:
+    if not script:
+        return ""
+    if not isinstance(script, list):
+        script = [script]
+    return "\n".join(pf.Script.generate_list_scripts(script))
+
+
+class _SharedScripts:
+    """Scripts interned by a ToolStore, with their rendering."""
+
+    __slots__ = ("values", "stub")
+
+    def __init__(self, values):
+        self.values = tuple(values)
+        self.stub = None
+
+
+class ScriptList(list):
+    """
+    List of script fragments returned by the ToolStore. Every call returns a
+    new list that can be modified freely, while the rendering of the
+    unmodified scripts is shared by all the tasks loading the same tools and
+    only computed once.
+    """
+
+    __slots__ = ("_shared",)
+
+    def __init__(self, values=(), shared: "_SharedScripts" = None):
+        super().__init__(values)
+        self._shared = shared
+
+    def __reduce__(self):
+        return (ScriptList, (list(self),))
+
+    def generate_stub(self) -> List[str]:
+        """Returns the rendered lines of the scripts."""
+        shared = self._shared
+        if (
+            shared is None
+            or len(self) != len(shared.values)
+            or any(a is not b for a, b in zip(self, shared.values))
+        ):
+            return pf.Script.generate_list_scripts(list(self))
+        if shared.stub is None:
+            shared.stub = pf.Script.generate_list_scripts(list(shared.values))
+        return list(shared.stub)
+
+
 class ToolStore:
     def __init__(self, lib_dir: str, options: Dict[str, any]):
         """
@@ -754,6 +1468,9 @@ class ToolStore:
 
         # Build tools
         self.tools = {}
+        self._resolved = {}
+        self._interned = {}
+        self._used = {}
 
         # modules:
         for name, options in self.modules.items():
@@ -775,6 +1492,30 @@ class ToolStore:
             var = parse_env_var(name, options)
             self.add_tool(name, var)
 
+        # snapshots load the tools defined above
+        for name, tool in self.tools.items():
+            if isinstance(tool, SnapshotTool):
+                self._bind_snapshot(tool)
+
+    def _bind_snapshot(self, tool: SnapshotTool):
+        digest = hashlib.sha256()
+        for item in tool.snapshot_tools:
+            digest.update(self.definition_hash(item).encode())
+        values = dict(
+            NAME=tool.name, DIR=tool.root, HASH=digest.hexdigest()[:16]
+        )
+        tool.scripts["load"] = [
+            pf.TemplateScript(snapshot_load, **values),
+            self.load(tool.snapshot_tools, track=False),
+            "fi",
+        ]
+        tool.scripts["setup"] = [
+            "# Snapshot the environment set by loading the tools",
+            pf.TemplateScript(snapshot_head, **values),
+            self.load(tool.snapshot_tools, track=False),
+            pf.TemplateScript(snapshot_tail, **values),
+        ]
+
     def add_tool(self, toolname: str, tool: Tool):
         """
         Adds a tool to the tool store.
@@ -787,10 +1528,56 @@ class ToolStore:
             The tool object to add to the dictionary of tools.
         """
         self.tools[toolname] = tool
+        self._resolved = {}
+        self._interned = {}
+
+    def closure(self, toolname: str) -> List[str]:
+        """
+        Returns a tool and all its dependencies, each listed once, in
+        topological order: every tool comes after its dependencies. The
+        closures are resolved once and cached until a tool is added.
+
+        Parameters
+        ----------
+        toolname : str
+            The name of the tool.
+
+        Returns
+        -------
+        list : the names of the tools to load, ending with `toolname`
+
+        Raises
+        ------
+        WelliesConfigurationError
+            If a dependency is not defined or if dependencies form a cycle.
+        """
+        if ("closure", toolname) not in self._resolved:
+            self._resolve(toolname, [])
+        return list(self._resolved["closure", toolname])
+
+    def _resolve(self, toolname: str, path: List[str]):
+        if toolname in path:
+            start = path.index(toolname)
+            cycle = " -> ".join(path[start:] + [toolname])
+            raise WelliesConfigurationError(
+                f"Circular tool dependencies: {cycle}"
+            )
+        if path and toolname not in self.tools:
+            raise WelliesConfigurationError(
+                f"Tool {path[-1]} depends on undefined tool {toolname}"
+            )
+        closure = {}
+        for item in self.tools[toolname].depends:
+            if ("closure", item) not in self._resolved:
+                self._resolve(item, path + [toolname])
+            closure.update(dict.fromkeys(self._resolved["closure", item]))
+        closure[toolname] = None
+        self._resolved["closure", toolname] = tuple(closure)
 
     def tool_script(self, script_type: str, toolname: str) -> dict:
         """
-        Returns the script of a tool and its dependencies.
+        Returns the script of a tool and its dependencies, resolved once per
+        tool and script type.
 
         Parameters
         ----------
@@ -803,39 +1590,105 @@ class ToolStore:
         -------
         dict: a dictionary of tools -> scripts
         """
-        tool = self.tools[toolname]
-        script = {}
-        for item in tool.depends:
-            script.update(self.tool_script(script_type, item))
-        if tool.scripts[script_type]:
-            script[toolname] = tool.scripts[script_type]
-        return script
-
-    def load(self, tools: Union[List[str], str]) -> list:
+        key = (script_type, toolname)
+        if key not in self._resolved:
+            self._resolved[key] = {
+                item: self.tools[item].scripts[script_type]
+                for item in self.closure(toolname)
+                if self.tools[item].scripts[script_type]
+            }
+        return dict(self._resolved[key])
+
+    def load(
+        self,
+        tools: Union[List[str], str],
+        purge: bool = False,
+        track: bool = True,
+    ) -> list:
         """
-        Returns the load script of one or multiple tools.
+        Returns the load script of one or multiple tools. Consecutive modules
+        are loaded with a single `module load` command, after one `module use`
+        per modulefiles path. The script is built once for each list of tools
+        and every call returns a new copy of it.
+
+        The loaded tools are recorded as used by the suite, see
+        [wellies.ToolStore.usage_report][].
 
         Parameters
         ----------
         tools : str or list of str
             The tools to load.
+        purge : bool, optional
+            Whether to start with a `module purge` rather than unloading the
+            modules one by one, by default False. Only for module tools.
+        track : bool, optional
+            Whether to record the tools as used, by default True. Deployment
+            tasks load tools without recording them.
 
         Returns
         -------
-        list : a list of scripts to load the tools
+        ScriptList : a new list of scripts to load the tools
+
+        Raises
+        ------
+        ValueError
+            If purge is set and some of the tools are not modules.
         """
         if not isinstance(tools, list):
             tools = [tools]
-        script = {}
-        script["head"] = "# load tools and activate environment"
-        for item in tools:
-            script.update(self.tool_script("load", item))
-        return list(script.values())
+        if track:
+            for item in tools:
+                self._used[item] = self._used.get(item, 0) + 1
+        key = ("load", tuple(tools), purge)
+        if key not in self._interned:
+            script = {}
+            for item in tools:
+                script.update(self.tool_script("load", item))
+            self._interned[key] = _SharedScripts(
+                ["# load tools and activate environment"]
+                + self._coalesce_modules(script, purge)
+            )
+        shared = self._interned[key]
+        return ScriptList(shared.values, shared)
+
+    def _coalesce_modules(self, script: dict, purge: bool) -> list:
+        def is_module(name):
+            return isinstance(self.tools[name], MODULE_TOOLS)
+
+        if purge and not all(is_module(name) for name in script):
+            raise ValueError("purge can only be used to load modules")
+        coalesced = []
+        used = set()
+        for modules, names in itertools.groupby(script, key=is_module):
+            if not modules:
+                coalesced.extend(script[name] for name in names)
+                continue
+            tools = [self.tools[name] for name in names]
+            paths = []
+            for tool in tools:
+                modulefiles = getattr(tool, "modulefiles", "")
+                if modulefiles and modulefiles not in used:
+                    used.add(modulefiles)
+                    paths.append(modulefiles)
+            coalesced.append(
+                pf.TemplateScript(
+                    module_load_many,
+                    MODULEFILES=paths,
+                    PURGE=purge,
+                    NAMES=[tool.module_name for tool in tools],
+                    MODULES=[
+                        f"{tool.module_name}/{tool.version}" for tool in tools
+                    ],
+                )
+            )
+        return coalesced
 
     def unload(self, tools: Union[List[str], str]):
         """
         Returns the unload script of one or multiple tools.
         In this case we reverse the dependency order to unload the tools.
+        The script is built once for each list of tools and every call returns
+        a new copy of it.
 
         Parameters
         ----------
@@ -844,24 +1697,31 @@ class ToolStore:
 
         Returns
         -------
-        list : a list of scripts to unload the tools
+        ScriptList : a new list of scripts to unload the tools
         """
         if not isinstance(tools, list):
             tools = [tools]
-        script = {}
-        script["head"] = "# unload tools and deactivate environment"
-        for item in tools:
-            # reverse dictionary to unload
-            unload_script = self.tool_script("unload", item)
-            unload_script = unload_script.fromkeys(
-                reversed(list(unload_script.keys()))
-            )
-            script.update(unload_script)
-        return list(script.values())
+        key = ("unload", tuple(tools))
+        if key not in self._interned:
+            script = {}
+            script["head"] = "# unload tools and deactivate environment"
+            for item in tools:
+                # reverse dictionary to unload
+                unload_script = self.tool_script("unload", item)
+                script.update(
+                    (name, unload_script[name])
+                    for name in reversed(list(unload_script))
+                )
+            self._interned[key] = _SharedScripts(script.values())
+        shared = self._interned[key]
+        return ScriptList(shared.values, shared)
 
     def setup(self, toolname: str) -> list:
         """
         Returns the setup script of the tool.
+        Environments with the `stamp` option are only set up if the hash of
+        their definition differs from the stamp left by the last setup, see
+        [wellies.ToolStore.definition_hash][].
 
         Parameters
         ----------
@@ -871,18 +1731,78 @@ class ToolStore:
         Returns
         -------
         list : a list of scripts to setup the tool
+
+        Raises
+        ------
+        WelliesConfigurationError
+            If a tool with the `stamp` option has no directory to stamp.
         """
         script = {}
         script["head"] = "# load tools and activate environment"
+        self.closure(toolname)
         tool = self.tools[toolname]
         for item in tool.depends:
             script.update(self.tool_script("load", item))
-        script[toolname] = tool.scripts["setup"]
-        return list(script.values())
+        if not self.environments.get(toolname, {}).get("stamp"):
+            script[toolname] = tool.scripts["setup"]
+            return list(script.values())
+
+        if tool.root is None:
+            raise WelliesConfigurationError(
+                f"stamp option not supported for {toolname}: "
+                "tool is not set up in a directory"
+            )
+        fetch, files, build = tool.setup_steps()
+        values = dict(
+            NAME=toolname,
+            ROOT=tool.root,
+            HASH=self.definition_hash(toolname),
+            FILES=files,
+        )
+        steps = [
+            fetch,
+            "# Skip setup if the definition of the tool is unchanged",
+            pf.TemplateScript(stamp_check, **values),
+            build,
+            pf.TemplateScript(stamp_write, **values),
+        ]
+        return list(script.values()) + [s for s in steps if s is not None]
+
+    def definition_hash(self, toolname: str) -> str:
+        """
+        Returns a hash of the resolved definition of a tool: its scripts, the
+        hashes of its dependencies and, for environments, of their packages.
+        The content of the files fetched by the setup, such as conda
+        environment files, is added to the stamp at run time.
+
+        Parameters
+        ----------
+        toolname : str
+            The name of the tool.
+
+        Returns
+        -------
+        str : the hexadecimal hash of the tool definition
+        """
+        key = ("hash", toolname)
+        if key not in self._resolved:
+            self.closure(toolname)
+            tool = self.tools[toolname]
+            digest = hashlib.sha256()
+            for script_type in ("load", "unload", "setup"):
+                digest.update(_render(tool.scripts[script_type]).encode())
+            packages = self.environments.get(toolname, {}).get("packages", [])
+            for item in tool.depends + packages:
+                # packages may depend on the environment they are installed in
+                if toolname not in self.closure(item):
+                    digest.update(self.definition_hash(item).encode())
+            self._resolved[key] = digest.hexdigest()[:16]
+        return self._resolved[key]
 
     def depends(self, toolname: str) -> list:
         """
-        Returns the dependencies of a tool.
+        Returns the dependencies of a tool, each listed once, in the order
+        they are first reached from the tool.
 
         Parameters
         ----------
@@ -891,14 +1811,138 @@ class ToolStore:
 
         Returns
         -------
-        list : the list of dependcies of the tool
+        list : the list of dependencies of the tool
+
+        Raises
+        ------
+        WelliesConfigurationError
+            If a dependency is not defined or if dependencies form a cycle.
         """
-        tool = self.tools[toolname]
-        depends = []
-        for item in tool.depends:
-            depends += [item]
-            depends += self.depends(item)
-        return depends
+        key = ("depends", toolname)
+        if key not in self._resolved:
+            self.closure(toolname)
+            depends = {}
+            for item in self.tools[toolname].depends:
+                depends[item] = None
+                depends.update(dict.fromkeys(self.depends(item)))
+            self._resolved[key] = tuple(depends)
+        return list(self._resolved[key])
+
+    def used_tools(self) -> List[str]:
+        """
+        Returns the tools needed by the tasks of the suite: the tools loaded
+        so far, with their dependencies, the tools of the snapshots and the
+        environments the used packages are installed in.
+
+        Returns
+        -------
+        list : the names of the used tools, in the order they are defined
+        """
+        used = set()
+        pending = list(self._used)
+        while pending:
+            name = pending.pop()
+            if name in used:
+                continue
+            for item in self.closure(name):
+                used.add(item)
+                if isinstance(self.tools[item], SnapshotTool):
+                    pending.extend(self.tools[item].snapshot_tools)
+            for env, options in self.environments.items():
+                if name in options.get("packages", []):
+                    pending.append(env)
+        return [name for name in self.tools if name in used]
+
+    def shared_packages(
+        self, environments: Optional[List[str]] = None
+    ) -> Dict[tuple, List[str]]:
+        """
+        Returns the packages with the `wheel_cache` option installed in
+        several virtual environments that use the same interpreter, i.e. that
+        have the same dependencies. Such packages can be built once, see
+        [wellies.tools.shared_wheel_script][].
+
+        Parameters
+        ----------
+        environments : list of str, optional
+            The environments to consider, by default all of them.
+
+        Returns
+        -------
+        dict : (package, interpreter dependencies) -> environments
+        """
+        if environments is None:
+            environments = list(self.environments)
+        groups = {}
+        for env in environments:
+            if not isinstance(self.tools[env], VirtualEnvTool):
+                continue
+            interpreter = tuple(self.closure(env)[:-1])
+            for package in self.environments[env].get("packages", []):
+                if self.tools[package].shares_builds:
+                    key = (package, interpreter)
+                    groups.setdefault(key, []).append(env)
+        return {key: envs for key, envs in groups.items() if len(envs) > 1}
+
+    def usage_report(self) -> "ToolUsageReport":
+        """
+        Reports the tools loaded by the tasks of the suite so far and the
+        tools no task needs, which
+        [wellies.DeployToolsFamily][] does not deploy with `used_only`.
+
+        Returns
+        -------
+        ToolUsageReport : the used and unused tools
+        """
+        used = self.used_tools()
+        return ToolUsageReport(
+            loads=dict(self._used),
+            used=used,
+            unused=[name for name in self.tools if name not in used],
+        )
+
+    def preflight(
+        self,
+        max_workers: int = 8,
+        timeout: float = 60,
+        runner: Optional[Callable[[str, float], str]] = None,
+        host: Optional[str] = None,
+    ) -> data.PreflightReport:
+        """
+        Checks that every module exists, that the sources of packages and
+        environment files exist and that all dependencies are defined, before
+        the suite is deployed. Checks are cheap metadata calls run in
+        parallel, see [wellies.StaticDataStore.preflight][]. Modules are only
+        checked on the host the suite runs on if it is given as `host`.
+
+        Parameters
+        ----------
+        max_workers : int, optional
+            Maximum number of checks running at the same time, by default 8.
+        timeout : float, optional
+            Timeout in seconds for each check, by default 60.
+        runner : callable, optional
+            Function running a check command, by default
+            [wellies.data.run_metadata_command][].
+        host : str, optional
+            Host running the deploy tasks, on which the checks are run
+            through `ssh`, by default None to run them locally.
+
+        Returns
+        -------
+        PreflightReport : all the failed checks
+        """
+        checks = {name: tool.check_command() for name, tool in self.items()}
+        report = data.run_preflight(checks, max_workers, timeout, runner, host)
+        for name, tool in self.items():
+            for item in tool.depends:
+                if item not in self.tools:
+                    report.failures.append(
+                        data.PreflightFailure(
+                            name, "", f"unknown dependency {item}"
+                        )
+                    )
+        return report
 
     def __getitem__(self, item):
         return self.tools[item]
@@ -907,6 +1951,26 @@ class ToolStore:
         return self.tools.items()
 
 
+@dataclass
+class ToolUsageReport:
+    """Usage of the tools of a store by the tasks of a suite."""
+
+    loads: Dict[str, int] = field(default_factory=dict)
+    used: List[str] = field(default_factory=list)
+    unused: List[str] = field(default_factory=list)
+
+    def __str__(self) -> str:
+        lines = [
+            f"{len(self.loads)} loaded, {len(self.used)} used, "
+            f"{len(self.unused)} unused"
+        ]
+        for name, count in self.loads.items():
+            lines.append(f"{name}: loaded by {count} scripts")
+        for name in self.unused:
+            lines.append(f"{name}: unused")
+        return "\n".join(lines)
+
+
 class DeployPackagesFamily(pf.Family):
     """
     A deployment family class for the packages of an environment.
@@ -918,16 +1982,20 @@ class DeployPackagesFamily(pf.Family):
         env_packages: List[str],
         env: str,
         submit_arguments: Dict[str, str],
+        builds: Optional[Dict[str, pf.Task]] = None,
         **kwargs,
     ):
         super().__init__(name="packages", **kwargs)
 
+        if builds is None:
+            builds = {}
+
         with self:
             deploy_tasks = {}
             for package in env_packages:
                 package_tool = tools[package]
                 tool_script = [
-                    tools.load(env),
+                    tools.load(env, track=False),
                     tools.setup(package),
                 ]
                 deploy_tasks[package] = pf.Task(
@@ -940,6 +2008,10 @@ class DeployPackagesFamily(pf.Family):
                 )
         # create dependencies between packages tasks
         for package in env_packages:
+            if package in builds:
+                deploy_tasks[package].triggers = (
+                    deploy_tasks[package].triggers & builds[package].complete
+                )
             for depend in tools[package].depends:
                 if depend in env_packages:
                     deploy_tasks[package].triggers = (
@@ -959,6 +2031,11 @@ class DeployToolsFamily(pf.AnchorFamily):
         - The second level contains the packages to install in the environment.
 
     The environment will be created in $LIB_DIR/env_name.
+
+    Packages with the `wheel_cache` option shared by several environments
+    with the same interpreter are built once, by a task of the
+    `shared_packages` family, and the package tasks of the environments
+    install the cached wheel, see [wellies.ToolStore.shared_packages][].
     """
 
     def __init__(
@@ -966,6 +2043,7 @@ class DeployToolsFamily(pf.AnchorFamily):
         tools: ToolStore,
         submit_arguments: Optional[Dict[str, str]] = None,
         name: str = "deploy_tools",
+        used_only: bool = False,
         **kwargs,
     ):
         """
@@ -978,21 +2056,67 @@ class DeployToolsFamily(pf.AnchorFamily):
             The name of the tool.
         submit_arguments : Dict[str, any], optional
             The execution context of the nodes, by default {}.
+        used_only : bool, optional
+            Whether to only deploy the environments used by the tasks created
+            so far, see [wellies.ToolStore.used_tools][], by default False.
+            The family must then be created after these tasks.
         """
         super().__init__(name=name, **kwargs)
 
         if submit_arguments is None:
             submit_arguments = {}
 
+        environments = list(tools.environments)
+        if used_only:
+            used = tools.used_tools()
+            environments = [env for env in environments if env in used]
+        packed = any(tools[env].pack_script for env in environments)
+        shared = tools.shared_packages(environments)
         with self:
             has_tasks = False
             env_families = {}
-            for env, options in tools.environments.items():
+            builds = {env: {} for env in environments}
+            build_tasks = {}
+            if shared:
+                has_tasks = True
+                with pf.Family(name="shared_packages"):
+                    for package, interpreter in shared:
+                        package_tool = tools[package]
+                        # one task per interpreter building the package
+                        name, index = package, 1
+                        while name in build_tasks:
+                            index += 1
+                            name = f"{package}_{index}"
+                        task = pf.Task(
+                            name=name,
+                            submit_arguments=package_tool.options.get(
+                                "submit_arguments", submit_arguments
+                            ),
+                            script=[
+                                tools.load(list(interpreter), track=False),
+                                shared_wheel_script(
+                                    package,
+                                    package_tool.options,
+                                    package_tool.lib_dir,
+                                    build_name=name,
+                                ),
+                            ],
+                            labels={"version": "NA"},
+                        )
+                        build_tasks[name] = (task, interpreter)
+                        for env in shared[package, interpreter]:
+                            builds[env][package] = task
+            for env in environments:
+                options = tools.environments[env]
                 env_tool = tools[env]
                 if env_tool.scripts["setup"] is not None:
                     has_tasks = True
+                    variables = {"ENV_NAME": env}
+                    if packed:
+                        # deploy in the environments, not their archives
+                        variables["USE_ENV_PACK"] = 0
                     with pf.AnchorFamily(
-                        name=env, variables={"ENV_NAME": env}
+                        name=env, variables=variables
                     ) as env_families[env]:
                         env_task = pf.Task(
                             name="setup",
@@ -1001,21 +2125,50 @@ class DeployToolsFamily(pf.AnchorFamily):
                             ),
                             script=tools.setup(env),
                         )
+                        pack_trigger = env_task.complete
                         if "packages" in options:
                             env_packages = options["packages"]
                             package_family = DeployPackagesFamily(
-                                tools, env_packages, env, submit_arguments
+                                tools,
+                                env_packages,
+                                env,
+                                submit_arguments,
+                                builds=builds[env],
                             )
                             package_family.triggers = env_task.complete
+                            pack_trigger = package_family.complete
+                        if env_tool.pack_script:
+                            pf.Task(
+                                name="pack",
+                                submit_arguments=env_tool.options.get(
+                                    "submit_arguments", submit_arguments
+                                ),
+                                script=[
+                                    tools.load(env_tool.depends, track=False),
+                                    env_tool.pack_script,
+                                ],
+                                triggers=pack_trigger,
+                            )
 
             # create dependencies between environments tasks
-            for env in tools.environments:
-                for depend in tools[env].depends:
+            for env in environments:
+                depends = tools[env].depends
+                if isinstance(tools[env], SnapshotTool):
+                    depends = depends + tools[env].snapshot_tools
+                for depend in depends:
                     if depend in env_families:
                         env_families[env].triggers = (
                             env_families[env].triggers
                             & env_families[depend].complete
                         )
 
+            # shared builds need the environments of their interpreter
+            for task, interpreter in build_tasks.values():
+                for depend in interpreter:
+                    if depend in env_families:
+                        task.triggers = (
+                            task.triggers & env_families[depend].complete
+                        )
+
             if not has_tasks:
                 self.defstatus = pf.state.complete